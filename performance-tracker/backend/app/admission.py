@@ -0,0 +1,285 @@
+"""Admission control and per-user rate limiting.
+
+`AdmissionMiddleware` sits in front of the routers and sheds excess load with
+`429 Too Many Requests` and a `Retry-After` header, rather than letting a
+burst fan out into Firestore and fail for everyone with quota errors.
+
+Every request belongs to a route class:
+
+* `expensive`: analytics, exports and imports, which read or write many
+  documents per request;
+* `write`: any other `POST`, `PUT`, `PATCH` or `DELETE`;
+* `read`: everything else.
+
+Each caller gets a token bucket per class, keyed by the UID of their
+(verified, cached) ID token.  A bucket refills at `RATE_LIMIT_<CLASS>_RPS` requests per
+second up to `RATE_LIMIT_<CLASS>_BURST`.  Unauthenticated requests are not
+limited here; they are rejected by the routes anyway.
+
+Expensive requests are also subject to a process-wide cap of
+`EXPENSIVE_MAX_CONCURRENCY` requests in progress.  At most
+`EXPENSIVE_MAX_QUEUE` more may wait for a slot, for up to
+`EXPENSIVE_QUEUE_TIMEOUT` seconds.  Requests beyond that are rejected
+straight away.  A slot is held until the response body has been sent, so
+long exports count for their whole duration.
+
+The health check, `/metrics` and the live update stream are never limited.
+Rejection counts and queue waits are served by `GET /admission/stats`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .auth import verify_id_token
+from .cache import TTLCache
+from .metrics import Histogram
+
+
+# Set to "off" to disable admission control.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "on") != "off"
+
+# Sustained requests per second and burst size per caller, by route class.
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    "read": (
+        float(os.getenv("RATE_LIMIT_READ_RPS", "10")),
+        float(os.getenv("RATE_LIMIT_READ_BURST", "40")),
+    ),
+    "write": (
+        float(os.getenv("RATE_LIMIT_WRITE_RPS", "5")),
+        float(os.getenv("RATE_LIMIT_WRITE_BURST", "20")),
+    ),
+    "expensive": (
+        float(os.getenv("RATE_LIMIT_EXPENSIVE_RPS", "1")),
+        float(os.getenv("RATE_LIMIT_EXPENSIVE_BURST", "10")),
+    ),
+}
+
+# Expensive requests served at once by this process.
+EXPENSIVE_MAX_CONCURRENCY = int(os.getenv("EXPENSIVE_MAX_CONCURRENCY", "16"))
+
+# Expensive requests allowed to wait for a slot when all are taken.
+EXPENSIVE_MAX_QUEUE = int(os.getenv("EXPENSIVE_MAX_QUEUE", "32"))
+
+# Seconds an expensive request may wait for a slot before it is rejected.
+EXPENSIVE_QUEUE_TIMEOUT = float(os.getenv("EXPENSIVE_QUEUE_TIMEOUT", "2"))
+
+# Callers whose buckets are tracked; idle buckets are full again after
+# `burst / rps` seconds, so they can be dropped after a few minutes.
+_BUCKET_CACHE_SIZE = 10000
+_BUCKET_IDLE_SECONDS = 600.0
+
+_EXEMPT_PATHS = frozenset({"/", "/metrics", "/events/stream"})
+_EXPENSIVE_PREFIXES = ("/analytics/", "/imports/")
+_WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+# Bounds (seconds) of the queue-wait histogram buckets.
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Return the route class of a request, or `None` if it is never limited."""
+    if path in _EXEMPT_PATHS:
+        return None
+    if path.startswith(_EXPENSIVE_PREFIXES) or path.endswith("/export"):
+        return "expensive"
+    return "write" if method in _WRITE_METHODS else "read"
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and bursts of `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take one token and return 0, or return the seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class ConcurrencyLimiter:
+    """Caps requests in progress, with a bounded wait for a free slot."""
+
+    def __init__(self, limit: int, max_queue: int, timeout: float) -> None:
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.peak_active = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self) -> Optional[float]:
+        """Wait for a slot and return the seconds waited, or `None` if rejected."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            return None
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        return time.monotonic() - started
+
+    def release(self) -> None:
+        self.active -= 1
+        self._slots.release()
+
+
+class AdmissionController:
+    """Per-process rate limiter state and counters."""
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[float, float]] = RATE_LIMITS,
+        max_concurrency: int = EXPENSIVE_MAX_CONCURRENCY,
+        max_queue: int = EXPENSIVE_MAX_QUEUE,
+        queue_timeout: float = EXPENSIVE_QUEUE_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.limits = dict(limits)
+        self.expensive = ConcurrencyLimiter(max_concurrency, max_queue, queue_timeout)
+        self._clock = clock
+        self._buckets = TTLCache(_BUCKET_CACHE_SIZE, _BUCKET_IDLE_SECONDS)
+        self.counters: Counter = Counter()
+        self.queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+
+    def check_rate(self, uid: str, route_class: str) -> float:
+        """Charge one request to `uid`'s bucket; return 0 or the seconds to wait."""
+        rate, burst = self.limits[route_class]
+        key = (uid, route_class)
+        now = self._clock()
+        bucket = self._buckets.get(key) or TokenBucket(rate, burst, now)
+        # Re-stored on every request so only idle callers expire.
+        self._buckets.set(key, bucket)
+        return bucket.take(now)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limits": {name: {"rps": rate, "burst": burst} for name, (rate, burst) in self.limits.items()},
+            "expensive": {
+                "max_concurrency": self.expensive.limit,
+                "max_queue": self.expensive.max_queue,
+                "queue_timeout": self.expensive.timeout,
+                "active": self.expensive.active,
+                "waiting": self.expensive.waiting,
+                "peak_active": self.expensive.peak_active,
+            },
+            "tracked_callers": self._buckets.stats()["size"],
+            "counters": dict(self.counters),
+            "queue_wait_seconds": {
+                "count": self.queue_wait.count,
+                "sum": round(self.queue_wait.sum, 6),
+                "buckets": dict(self.queue_wait.cumulative()),
+            },
+        }
+
+
+admission = AdmissionController()
+
+
+def _credential(scope: Dict[str, Any]) -> Optional[str]:
+    for name, value in scope.get("headers") or []:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+    query = scope.get("query_string", b"").decode("latin-1")
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        if key == "access_token" and value:
+            return value
+    return None
+
+
+async def _caller_uid(scope: Dict[str, Any]) -> Optional[str]:
+    """Return the verified UID of the caller, or `None` if the request is not authenticated."""
+    token = _credential(scope)
+    if not token:
+        return None
+    try:
+        claims = await verify_id_token(token)
+    except HTTPException:
+        return None
+    return claims.get("uid")
+
+
+async def _reject(send: Callable, retry_after: float, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying `AdmissionController` limits to each request.
+
+    Plain ASGI, like `MetricsMiddleware`, so a concurrency slot is released
+    only after a streaming response has sent its last byte.
+    """
+
+    def __init__(self, app: Any, controller: Optional[AdmissionController] = None) -> None:
+        self.app = app
+        self.controller = controller or admission
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        route = route_class(scope.get("method", ""), scope.get("path", "")) if scope["type"] == "http" else None
+        if route is None or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        controller = self.controller
+        controller.counters[f"{route}_requests"] += 1
+
+        uid = await _caller_uid(scope)
+        if uid is not None:
+            wait = controller.check_rate(uid, route)
+            if wait:
+                controller.counters[f"{route}_rate_limited"] += 1
+                await _reject(send, wait, "Too many requests; slow down")
+                return
+
+        if route != "expensive":
+            await self.app(scope, receive, send)
+            return
+        waited = await controller.expensive.acquire()
+        if waited is None:
+            controller.counters["expensive_shed"] += 1
+            await _reject(send, controller.expensive.timeout, "Server is busy; try again shortly")
+            return
+        controller.queue_wait.observe(waited)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.expensive.release()
@@ -4,25 +4,49 @@ This module provides helper functions to verify Firebase ID tokens and to
 retrieve the authenticated user's profile.  The FastAPI dependency
 `get_current_user` can be used in API endpoints to ensure the caller is
 authenticated and to access the caller's identity.
+
+Decoded token claims and user profiles are kept in short-lived in-process
+caches so that repeat requests from the same user skip both the JWT
+verification and the Firestore profile read.  On a cache miss the blocking
+Firebase Admin verification runs on the bounded thread pool and the profile is
+read with the asynchronous Firestore client, so neither stalls the event loop.
 """
 
 from __future__ import annotations
 
+import hashlib
 import os
+import time
 from functools import lru_cache
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
 
-from fastapi import Depends, HTTPException, Security
+from fastapi import Depends, HTTPException, Query, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-import firebase_admin
-from firebase_admin import auth as firebase_auth, credentials
 
-from .firestore import get_firestore_client
+from .cache import TTLCache
+from .firestore import get_async_firestore_client, run_blocking
+
+if TYPE_CHECKING:
+    import firebase_admin
 
 
 # Bearer token security scheme for FastAPI
 _bearer_scheme = HTTPBearer(auto_error=False)
 
+# Decoded claims keyed by a hash of the raw token.  Entries never outlive the
+# token's own `exp` claim.
+_token_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300")),
+)
+
+# User profiles keyed by UID.  Entries are invalidated explicitly when an admin
+# changes a user through the `/users` endpoints.
+_profile_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_PROFILE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("AUTH_PROFILE_CACHE_TTL", "60")),
+)
+
 
 @lru_cache(maxsize=1)
 def _initialize_firebase_app() -> firebase_admin.App:
@@ -33,7 +57,14 @@ def _initialize_firebase_app() -> firebase_admin.App:
     environment variable or a service account JSON key file path.  If the
     application has already been initialised elsewhere, this function simply
     returns the existing app.
+
+    The Firebase Admin SDK is imported here rather than at module level so
+    that it does not add to cold-start import time; `app.warmup` calls this
+    during startup.
     """
+    import firebase_admin
+    from firebase_admin import credentials
+
     if not firebase_admin._apps:
         cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
         if not cred_path or not os.path.isfile(cred_path):
@@ -46,9 +77,42 @@ def _initialize_firebase_app() -> firebase_admin.App:
     return firebase_admin.get_app()
 
 
-def verify_id_token(id_token: str) -> Dict[str, Any]:
+def _token_key(id_token: str) -> str:
+    """Return the cache key for a raw ID token."""
+    return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+
+def _verify_with_firebase(id_token: str) -> Dict[str, Any]:
+    """Verify `id_token` with the Firebase Admin SDK (blocking)."""
+    from firebase_admin import auth as firebase_auth
+
+    _initialize_firebase_app()
+    return firebase_auth.verify_id_token(id_token)
+
+
+# Blocking callable that turns a raw ID token into decoded claims.  Replaced by
+# `use_token_verifier`, e.g. with `app.fakes.FakeTokenVerifier` for local runs.
+_token_verifier: Callable[[str], Dict[str, Any]] = _verify_with_firebase
+
+
+def use_token_verifier(verifier: Optional[Callable[[str], Dict[str, Any]]]) -> None:
+    """Verify ID tokens with `verifier` instead of the Firebase Admin SDK.
+
+    Passing `None` restores Firebase verification.  Both auth caches are
+    cleared so that no claims or profiles from the previous backend survive.
+    """
+    global _token_verifier
+    _token_verifier = verifier or _verify_with_firebase
+    _token_cache.clear()
+    _profile_cache.clear()
+
+
+async def verify_id_token(id_token: str) -> Dict[str, Any]:
     """Verify a Firebase ID token and return the decoded claims.
 
+    Successfully verified tokens are cached until the earlier of the cache TTL
+    and the token's `exp` claim.
+
     Args:
         id_token: The JWT provided by the client.
 
@@ -58,37 +122,60 @@ def verify_id_token(id_token: str) -> Dict[str, Any]:
     Raises:
         HTTPException: If the token is invalid or verification fails.
     """
-    _initialize_firebase_app()
+    key = _token_key(id_token)
+    cached = _token_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        decoded = firebase_auth.verify_id_token(id_token)
-        return decoded
+        decoded = await run_blocking(_token_verifier, id_token)
     except Exception as exc:
         raise HTTPException(status_code=401, detail=f"Invalid authentication token: {exc}") from exc
 
+    exp = decoded.get("exp")
+    if exp is not None:
+        _token_cache.set(key, decoded, ttl=float(exp) - time.time())
+    return decoded
 
-async def get_current_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Security(_bearer_scheme),
-) -> Dict[str, Any]:
-    """FastAPI dependency to validate the caller's Firebase ID token.
 
-    If the request does not contain valid credentials, a 401 error is raised.
+async def get_user_profile(uid: str) -> Dict[str, Any]:
+    """Return the Firestore profile for `uid`, served from cache when possible.
 
-    Returns:
-        A dictionary representing the Firebase user and associated profile from Firestore.
+    A copy is returned so that callers may modify the result freely.
     """
-    if credentials is None:
-        raise HTTPException(status_code=401, detail="Missing authentication credentials")
-    token = credentials.credentials
-    decoded = verify_id_token(token)
+    profile = _profile_cache.get(uid)
+    if profile is None:
+        db = get_async_firestore_client()
+        user_doc = await db.collection("users").document(uid).get()
+        profile = user_doc.to_dict() if user_doc.exists else {}
+        _profile_cache.set(uid, profile)
+    return dict(profile)
+
+
+def invalidate_user_profile(uid: str) -> None:
+    """Drop the cached profile for `uid` so the next request re-reads it."""
+    _profile_cache.invalidate(uid)
+
+
+def get_auth_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Return hit/miss statistics for the token and profile caches."""
+    return {"tokens": _token_cache.stats(), "profiles": _profile_cache.stats()}
+
+
+async def authenticate(token: str) -> Dict[str, Any]:
+    """Verify a raw ID token and return the caller's profile with `uid` and `role`.
+
+    Raises:
+        HTTPException: 401 if the token is invalid.
+    """
+    decoded = await verify_id_token(token)
 
     uid: str = decoded.get("uid")
     if not uid:
         raise HTTPException(status_code=401, detail="Invalid token: missing UID")
 
-    # Optionally fetch the user's profile from Firestore
-    db = get_firestore_client()
-    user_doc = db.collection("users").document(uid).get()
-    profile: Dict[str, Any] = user_doc.to_dict() if user_doc.exists else {}
+    # Fetch the user's profile from Firestore (or the profile cache)
+    profile = await get_user_profile(uid)
     profile.setdefault("uid", uid)
 
     # Attach roles/claims if defined in custom claims or Firestore
@@ -96,4 +183,35 @@ async def get_current_user(
     role = decoded.get("role") or profile.get("role")
     if role:
         profile["role"] = role
-    return profile
\ No newline at end of file
+    return profile
+
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(_bearer_scheme),
+) -> Dict[str, Any]:
+    """FastAPI dependency to validate the caller's Firebase ID token.
+
+    If the request does not contain valid credentials, a 401 error is raised.
+
+    Returns:
+        A dictionary representing the Firebase user and associated profile from Firestore.
+    """
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Missing authentication credentials")
+    return await authenticate(credentials.credentials)
+
+
+async def get_current_user_or_query_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(_bearer_scheme),
+    access_token: Optional[str] = Query(None, description="ID token, for clients that cannot send headers"),
+) -> Dict[str, Any]:
+    """Like `get_current_user`, but also accepts the token as `?access_token=`.
+
+    Browsers' `EventSource` cannot set an `Authorization` header, so streaming
+    endpoints accept the token in the query string instead.
+    """
+    if credentials is not None:
+        return await authenticate(credentials.credentials)
+    if access_token:
+        return await authenticate(access_token)
+    raise HTTPException(status_code=401, detail="Missing authentication credentials")
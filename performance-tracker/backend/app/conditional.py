@@ -0,0 +1,86 @@
+"""Conditional GETs and a response cache keyed by data versions.
+
+Dashboards re-fetch the same overview and lists on every navigation.  For
+such endpoints `respond` first reads the versions of the scopes the response
+covers (see `app.services.versions`), one small `get_all`.  Together with
+the path, the query parameters, the date and any caller-specific parts, the
+versions form the cache key, and a hash of the key is the response's ETag:
+
+* a request whose `If-None-Match` carries that ETag gets `304 Not Modified`;
+* otherwise a response rendered earlier for the same key is served from an
+  in-process cache;
+* only when neither applies does the endpoint run its queries.
+
+The versions are read before the queries run, so a write committed while a
+response is being built is never hidden behind a version that predates it.
+The date is part of the key because responses default their ranges to
+today.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from .cache import TTLCache
+from .services.versions import read_versions
+
+
+# Rendered response bodies keyed by scope versions.  Entries never go stale
+# (a change produces a new key); the TTL only bounds the memory they hold.
+_responses = TTLCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "600")),
+)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Return whether an `If-None-Match` header value matches `etag`."""
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    # A weak validator matches as well: the body is the same either way.
+    return "*" in candidates or any(candidate in (etag, f"W/{etag}") for candidate in candidates)
+
+
+async def respond(
+    request: Request,
+    scopes: Iterable[str],
+    compute: Callable[[], Awaitable[Dict[str, Any]]],
+    *key_parts: Hashable,
+) -> Response:
+    """Answer a GET from the versions of `scopes` when nothing changed, else from `compute`.
+
+    Args:
+        request: The request being answered.
+        scopes: Scopes whose records the response reads.
+        compute: Builds the response body when it is not cached.
+        key_parts: Anything else the body depends on that is not in the URL,
+            such as the caller's role or team.
+    """
+    versions = await read_versions(scopes)
+    key = (
+        request.url.path,
+        tuple(sorted(request.query_params.multi_items())),
+        tuple(sorted(versions.items())),
+        date.today().isoformat(),
+        *key_parts,
+    )
+    etag = '"' + hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    body = _responses.get(key)
+    if body is None:
+        body = JSONResponse(jsonable_encoder(await compute())).body
+        _responses.set(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Return hit/miss statistics for the response cache."""
+    return _responses.stats()
@@ -0,0 +1,217 @@
+"""Live change feed pushed to dashboards over server-sent events.
+
+Write paths publish a `ChangeEvent` once their commit has succeeded:
+
+* `payment`: a payment was created, updated or deleted.
+* `incentive`: an incentive amount changed.
+* `call_entry`: a call entry was saved.
+* `whatsapp_payment`: a WhatsApp monthly payment was recorded.
+
+Payment and incentive events carry a `delta` that a client can apply to the
+totals it already shows, so it does not need to re-read them.  A call entry
+event carries the whole entry, which replaces that day's previous one.  Each process keeps one
+`ChangeFeed`, which fans events out to all connected clients (see
+`app.routers.events`).  It also keeps the most recent `EVENT_BUFFER_SIZE`
+events, so a client that reconnects with `Last-Event-ID` receives the events
+it missed.
+
+A slow client cannot make the feed buffer without limit.  Each subscriber has
+a bounded queue of `EVENT_QUEUE_SIZE` events.  When a subscriber falls that
+far behind, its stream ends and the client resumes from its last event ID.
+
+By default (`CHANGE_FEED_SOURCE=local`) events only reach clients connected to
+the process that made the change.  With several instances, set
+`CHANGE_FEED_SOURCE=firestore`.  Events are then also written to the
+`change_events` collection in the background.  Each process runs a single
+Firestore listener on that collection, so every instance delivers every
+event.  Event IDs are globally unique, so a client can resume on any instance.
+Configure a TTL policy on `change_events.expires_at` to purge old events.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import secrets
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+
+logger = logging.getLogger(__name__)
+
+# Recent events kept per process for `Last-Event-ID` resumption.
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+
+# Undelivered events a single client may fall behind by before its stream is closed.
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+
+# Seconds between keep-alive comments on an idle stream.
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+# Where the feed gets its events from: "local" or "firestore" (see module docstring).
+CHANGE_FEED_SOURCE = os.getenv("CHANGE_FEED_SOURCE", "local")
+
+CHANGE_EVENTS_COLLECTION = "change_events"
+
+# How long events are kept in `change_events`.
+CHANGE_EVENT_TTL = timedelta(hours=1)
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """One change pushed to subscribers.
+
+    `uid` and `team_uid` identify whose data changed and decide who may see
+    the event.  `uid` is `None` for organisation-wide changes.
+    """
+
+    id: str
+    type: str
+    uid: Optional[str]
+    team_uid: Optional[str]
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    def to_doc(self) -> Dict[str, Any]:
+        return {"type": self.type, "uid": self.uid, "team_uid": self.team_uid, "data": self.data}
+
+    @classmethod
+    def from_doc(cls, event_id: str, doc: Dict[str, Any]) -> "ChangeEvent":
+        return cls(event_id, doc["type"], doc.get("uid"), doc.get("team_uid"), doc.get("data") or {})
+
+
+class Subscription:
+    """A connected client's view of the feed."""
+
+    def __init__(self, visible: Callable[[ChangeEvent], bool], maxsize: int) -> None:
+        self.visible = visible
+        self.queue: "asyncio.Queue[ChangeEvent]" = asyncio.Queue(maxsize)
+        # Set when the client fell too far behind; its stream should end.
+        self.overflowed = False
+        # Set when the requested `Last-Event-ID` is no longer buffered, so the
+        # client must reload its data instead of relying on the replay.
+        self.reset = False
+
+    def offer(self, event: ChangeEvent) -> None:
+        if self.overflowed or not self.visible(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class ChangeFeed:
+    """Per-process fan-out of change events to subscribers."""
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE, source: str = CHANGE_FEED_SOURCE) -> None:
+        self.source = source
+        self._buffer: Deque[ChangeEvent] = deque(maxlen=buffer_size)
+        self._subscribers: Set[Subscription] = set()
+        self._sequence = itertools.count()
+        self._instance = secrets.token_hex(3)
+        self._pending: Set["asyncio.Task[None]"] = set()
+        self._watch: Any = None
+        self.counters: Counter = Counter()
+
+    def _new_id(self) -> str:
+        # Sortable by time and unique across processes.
+        return f"{time.time_ns():019d}-{self._instance}-{next(self._sequence)}"
+
+    def dispatch(self, event: ChangeEvent) -> None:
+        """Buffer `event` and hand it to every subscriber (event loop thread only)."""
+        self._buffer.append(event)
+        self.counters["events"] += 1
+        for subscription in list(self._subscribers):
+            subscription.offer(event)
+            if subscription.overflowed:
+                self._subscribers.discard(subscription)
+                self.counters["overflows"] += 1
+
+    def publish(self, type: str, uid: Optional[str], team_uid: Optional[str], data: Dict[str, Any]) -> None:
+        """Publish a committed change.  Must be called from the event loop.
+
+        Publishing never delays or fails the write that caused it.
+        """
+        event = ChangeEvent(self._new_id(), type, uid, team_uid, data)
+        if self.source != "firestore":
+            self.dispatch(event)
+            return
+        task = asyncio.get_running_loop().create_task(self._store(event))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _store(self, event: ChangeEvent) -> None:
+        from .firestore import get_async_firestore_client
+
+        doc = {**event.to_doc(), "expires_at": datetime.now(timezone.utc) + CHANGE_EVENT_TTL}
+        try:
+            await get_async_firestore_client().collection(CHANGE_EVENTS_COLLECTION).document(event.id).set(doc)
+        except Exception as exc:  # a lost event must not surface in the request that caused it
+            self.counters["store_errors"] += 1
+            logger.warning("failed to store change event %s: %r", event.id, exc)
+
+    def subscribe(self, visible: Callable[[ChangeEvent], bool], last_event_id: Optional[str] = None) -> Subscription:
+        """Register a subscriber, replaying buffered events after `last_event_id`."""
+        subscription = Subscription(visible, EVENT_QUEUE_SIZE)
+        if last_event_id:
+            ids = [event.id for event in self._buffer]
+            if last_event_id in ids:
+                for event in itertools.islice(self._buffer, ids.index(last_event_id) + 1, None):
+                    subscription.offer(event)
+            else:
+                subscription.reset = True
+        if not subscription.overflowed:
+            self._subscribers.add(subscription)
+        self.counters["subscriptions"] += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+
+    def start(self) -> None:
+        """Start the shared Firestore listener when events come from Firestore."""
+        if self.source != "firestore" or self._watch is not None:
+            return
+        from .firestore import get_firestore_client
+
+        loop = asyncio.get_running_loop()
+
+        def on_snapshot(docs: List[Any], changes: List[Any], read_time: Any) -> None:
+            added = sorted(
+                (change.document for change in changes if change.type.name == "ADDED"), key=lambda doc: doc.id
+            )
+            for doc in added:
+                loop.call_soon_threadsafe(self.dispatch, ChangeEvent.from_doc(doc.id, doc.to_dict()))
+
+        # Only events written from now on: IDs start with their creation time.
+        collection = get_firestore_client().collection(CHANGE_EVENTS_COLLECTION)
+        query = collection.where(FieldPath.document_id(), ">=", collection.document(f"{time.time_ns():019d}"))
+        self._watch = query.on_snapshot(on_snapshot)
+
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "subscribers": len(self._subscribers),
+            "buffered": len(self._buffer),
+            **self.counters,
+        }
+
+
+change_feed = ChangeFeed()
+
+
+def publish(type: str, uid: Optional[str], team_uid: Optional[str], data: Dict[str, Any]) -> None:
+    """Publish a committed change on the process-wide feed."""
+    change_feed.publish(type, uid, team_uid, data)
@@ -0,0 +1,12 @@
+"""In-process stand-ins for Google Cloud services.
+
+These fakes let the API run without network access or credentials, for
+local development, load tests and benchmarks.  They are selected by passing
+them to `app.main.create_app` or by setting `DATA_BACKEND=memory` and
+`AUTH_BACKEND=fake` in the environment.
+"""
+
+from .auth import FakeTokenVerifier
+from .firestore import InMemoryFirestore
+
+__all__ = ["FakeTokenVerifier", "InMemoryFirestore"]
@@ -0,0 +1,30 @@
+"""Fake Firebase ID token verifier."""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict
+
+
+class FakeTokenVerifier:
+    """Accept tokens of the form `<uid>` or `<uid>:<ROLE>` without any signature check.
+
+    The returned claims mimic those of a Firebase ID token, including an `exp`
+    claim `ttl` seconds in the future so the token cache behaves as in
+    production.  A role given in the token is returned as a custom claim.
+    """
+
+    def __init__(self, ttl: float = 3600.0) -> None:
+        self.ttl = ttl
+        self.calls = 0
+
+    def __call__(self, id_token: str) -> Dict[str, Any]:
+        self.calls += 1
+        uid, _, role = id_token.partition(":")
+        if not uid:
+            raise ValueError("empty token")
+        now = int(time.time())
+        claims: Dict[str, Any] = {"uid": uid, "sub": uid, "iat": now, "exp": now + int(self.ttl)}
+        if role:
+            claims["role"] = role
+        return claims
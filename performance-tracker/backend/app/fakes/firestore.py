@@ -0,0 +1,483 @@
+"""In-memory stand-in for `google.cloud.firestore.AsyncClient`.
+
+Implements the subset of the asynchronous Firestore API used by the
+services: document get/create/set/update/delete (including merges, the
+`Increment`, `SERVER_TIMESTAMP` and `DELETE_FIELD` transforms and
+`write_option` preconditions), write batches, transactions usable with
+`firestore.async_transactional`, `get_all`, and queries with `where`,
+`order_by`, `select`, `start_after` and `limit`.
+
+Stored documents are never mutated in place: every write replaces the
+document with a fresh copy, so snapshots can share stored data and only copy
+it when `to_dict` is called.
+
+Every round trip can be delayed by a fixed `latency` so that benchmarks
+reflect the number of network calls a code path makes, and the number of
+round trips, document reads and writes is counted in `stats`.  Transactions
+are not isolated against concurrent writers; they simply buffer their writes
+until commit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import operator
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from google.api_core import exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1 import _helpers
+from google.cloud.firestore_v1.base_client import BaseClient
+
+
+_DOCUMENT_ID = "__name__"
+
+_COMPARISONS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _get_path(data: Dict[str, Any], path: str) -> Tuple[bool, Any]:
+    """Return `(found, value)` for a dotted field path."""
+    if "." not in path:
+        return (True, data[path]) if path in data else (False, None)
+    value: Any = data
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _copy(value: Any) -> Any:
+    """Copy nested maps and arrays; every other stored value is immutable."""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _resolve(value: Any, old: Any, now: datetime) -> Any:
+    """Apply a write value (possibly a transform sentinel) on top of `old`."""
+    if isinstance(value, firestore.Increment):
+        base = old if isinstance(old, (int, float)) and not isinstance(old, bool) else 0
+        return base + value._value
+    if value is firestore.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, firestore.ArrayUnion):
+        items = list(old) if isinstance(old, list) else []
+        return items + [item for item in value._values if item not in items]
+    if isinstance(value, dict):
+        return {k: _resolve(v, None, now) for k, v in value.items() if v is not firestore.DELETE_FIELD}
+    return _copy(value)
+
+
+def _merge(target: Dict[str, Any], data: Dict[str, Any], now: datetime) -> None:
+    """Deep-merge `data` into `target` the way `set(..., merge=True)` does."""
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            child = target.get(key)
+            if not isinstance(child, dict):
+                child = target[key] = {}
+            _merge(child, value, now)
+        else:
+            target[key] = _resolve(value, target.get(key), now)
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    """Order values across types roughly as Firestore does."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+class DocumentSnapshot:
+    """Snapshot of a document at read time."""
+
+    def __init__(self, reference: "DocumentReference", data: Optional[Dict[str, Any]], update_time: Any) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        found, value = _get_path(self._data or {}, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return _copy(value)
+
+
+class DocumentReference:
+    """Reference to a single document."""
+
+    def __init__(self, client: "InMemoryFirestore", collection: str, doc_id: str) -> None:
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    async def get(self, field_paths: Optional[Iterable[str]] = None, transaction: Any = None) -> DocumentSnapshot:
+        await self._client._round_trip()
+        return self._client._snapshot(self)
+
+    async def set(self, document_data: Dict[str, Any], merge: bool = False) -> None:
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        await batch.commit()
+
+    async def create(self, document_data: Dict[str, Any]) -> None:
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        await batch.commit()
+
+    async def update(self, field_updates: Dict[str, Any], option: Any = None) -> None:
+        batch = self._client.batch()
+        batch.update(self, field_updates, option=option)
+        await batch.commit()
+
+    async def delete(self, option: Any = None) -> None:
+        batch = self._client.batch()
+        batch.delete(self, option=option)
+        await batch.commit()
+
+
+class Query:
+    """Immutable query over a single collection."""
+
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(
+        self,
+        client: "InMemoryFirestore",
+        collection: str,
+        filters: Tuple = (),
+        orders: Tuple = (),
+        projection: Optional[Tuple[str, ...]] = None,
+        cursor: Optional[Dict[str, Any]] = None,
+        limit_count: Optional[int] = None,
+    ) -> None:
+        self._client = client
+        self._collection = collection
+        self._filters = filters
+        self._orders = orders
+        self._projection = projection
+        self._cursor = cursor
+        self._limit = limit_count
+
+    def _with(self, **changes: Any) -> "Query":
+        state = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "projection": self._projection,
+            "cursor": self._cursor,
+            "limit_count": self._limit,
+        }
+        state.update(changes)
+        return Query(self._client, self._collection, **state)
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None, *, filter: Any = None) -> "Query":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._with(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "Query":
+        return self._with(orders=self._orders + ((field_path, direction),))
+
+    def select(self, field_paths: Iterable[str]) -> "Query":
+        return self._with(projection=tuple(field_paths))
+
+    def start_after(self, document_fields_or_snapshot: Any) -> "Query":
+        values = document_fields_or_snapshot
+        if isinstance(values, DocumentSnapshot):
+            values = {**(values.to_dict() or {}), _DOCUMENT_ID: values.reference}
+        return self._with(cursor=dict(values))
+
+    def limit(self, count: int) -> "Query":
+        return self._with(limit_count=count)
+
+    def _field(self, doc_id: str, data: Dict[str, Any], field_path: str) -> Tuple[bool, Any]:
+        if field_path == _DOCUMENT_ID:
+            return True, doc_id
+        return _get_path(data, field_path)
+
+    def _predicate(self, op: str, expected: Any) -> Callable[[Any], bool]:
+        """Return a test for one filter applied to a field value."""
+        if isinstance(expected, DocumentReference):
+            expected = expected.id
+        if op in _COMPARISONS:
+            compare, kind = _COMPARISONS[op], _sort_key(expected)[0]
+            return lambda value: _sort_key(value)[0] == kind and compare(value, expected)
+        if op in ("in", "not-in"):
+            values = [item.id if isinstance(item, DocumentReference) else item for item in expected]
+            try:
+                values = set(values)
+            except TypeError:
+                pass
+            return (lambda value: value in values) if op == "in" else (lambda value: value not in values)
+        if op == "array-contains":
+            return lambda value: isinstance(value, list) and expected in value
+        if op == "array-contains-any":
+            return lambda value: isinstance(value, list) and any(item in value for item in expected)
+        raise ValueError(f"Unsupported operator: {op}")
+
+    def _matches(self, doc_id: str, data: Dict[str, Any]) -> bool:
+        for field_path, test in self._tests:
+            found, value = self._field(doc_id, data, field_path)
+            if not found or not test(value):
+                return False
+        return True
+
+    def _order_key(self, doc_id: str, data: Dict[str, Any]) -> List[Any]:
+        orders = self._orders or ((_DOCUMENT_ID, self.ASCENDING),)
+        return [_sort_key(self._field(doc_id, data, field)[1]) for field, _ in orders]
+
+    def _results(self) -> List[Tuple[str, Dict[str, Any]]]:
+        orders = self._orders or ((_DOCUMENT_ID, self.ASCENDING),)
+        self._tests = [(field_path, self._predicate(op, expected)) for field_path, op, expected in self._filters]
+        rows = [
+            (self._order_key(doc_id, data), doc_id, data)
+            for doc_id, data in self._client._collection_docs(self._collection).items()
+            if self._matches(doc_id, data)
+            and all(self._field(doc_id, data, field)[0] for field, _ in self._orders)
+        ]
+        descending = [direction == self.DESCENDING for _, direction in orders]
+        if any(descending):
+            for position in reversed(range(len(orders))):
+                rows.sort(key=lambda row: row[0][position], reverse=descending[position])
+        else:
+            rows.sort(key=lambda row: row[0])
+        if self._cursor is not None:
+            cursor_key = []
+            for field, _ in orders:
+                value = self._cursor.get(field)
+                if isinstance(value, DocumentReference):
+                    value = value.id
+                cursor_key.append(_sort_key(value))
+
+            def after_cursor(key: List[Any]) -> bool:
+                for part, bound, desc in zip(key, cursor_key, descending):
+                    if part != bound:
+                        return part < bound if desc else part > bound
+                return False
+
+            rows = [row for row in rows if after_cursor(row[0])]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        return [(doc_id, data) for _, doc_id, data in rows]
+
+    async def stream(self, transaction: Any = None) -> AsyncIterator[DocumentSnapshot]:
+        await self._client._round_trip()
+        self._client.stats["queries"] += 1
+        for doc_id, data in self._results():
+            if self._projection is not None:
+                projected: Dict[str, Any] = {}
+                for field in self._projection:
+                    found, value = _get_path(data, field)
+                    if found:
+                        projected[field] = value
+                data = projected
+            self._client.stats["reads"] += 1
+            reference = DocumentReference(self._client, self._collection, doc_id)
+            yield DocumentSnapshot(reference, data, self._client._update_times.get(reference.path))
+
+    async def get(self, transaction: Any = None) -> List[DocumentSnapshot]:
+        return [snap async for snap in self.stream(transaction=transaction)]
+
+
+class CollectionReference(Query):
+    """Reference to a top-level collection."""
+
+    def __init__(self, client: "InMemoryFirestore", name: str) -> None:
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, document_id: Optional[str] = None) -> DocumentReference:
+        return DocumentReference(self._client, self._collection, document_id or uuid.uuid4().hex[:20])
+
+
+class WriteBatch:
+    """Buffered writes applied atomically on `commit`."""
+
+    def __init__(self, client: "InMemoryFirestore") -> None:
+        self._client = client
+        self._writes: List[Tuple[str, DocumentReference, Any, Any]] = []
+
+    def set(self, reference: DocumentReference, document_data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append(("merge" if merge else "set", reference, document_data, None))
+
+    def create(self, reference: DocumentReference, document_data: Dict[str, Any]) -> None:
+        self._writes.append(("set", reference, document_data, _helpers.ExistsOption(exists=False)))
+
+    def update(self, reference: DocumentReference, field_updates: Dict[str, Any], option: Any = None) -> None:
+        self._writes.append(("update", reference, field_updates, option))
+
+    def delete(self, reference: DocumentReference, option: Any = None) -> None:
+        self._writes.append(("delete", reference, None, option))
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    async def commit(self) -> List[Any]:
+        await self._client._round_trip()
+        writes, self._writes = self._writes, []
+        return self._client._apply(writes)
+
+
+class Transaction(WriteBatch):
+    """Transaction compatible with `firestore.async_transactional`."""
+
+    def __init__(self, client: "InMemoryFirestore", max_attempts: int = 5, read_only: bool = False) -> None:
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id: Optional[bytes] = None
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._id = None
+
+    async def _begin(self, retry_id: Optional[bytes] = None) -> None:
+        await self._client._round_trip()
+        self._id = uuid.uuid4().bytes
+
+    async def _rollback(self) -> None:
+        self._clean_up()
+
+    async def _commit(self) -> List[Any]:
+        results = await self.commit()
+        self._clean_up()
+        return results
+
+
+class InMemoryFirestore:
+    """In-memory replacement for `firestore.AsyncClient`.
+
+    Args:
+        latency: Seconds to sleep on every simulated round trip.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._update_times: Dict[str, datetime] = {}
+        self._clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.stats: Counter = Counter()
+
+    async def _round_trip(self) -> None:
+        self.stats["round_trips"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _now(self) -> datetime:
+        # Strictly increasing so that update times always differ between writes.
+        self._clock = max(self._clock + timedelta(microseconds=1), datetime.now(timezone.utc))
+        return self._clock
+
+    def _collection_docs(self, name: str) -> Dict[str, Dict[str, Any]]:
+        return self._collections.setdefault(name, {})
+
+    def _snapshot(self, reference: DocumentReference) -> DocumentSnapshot:
+        self.stats["reads"] += 1
+        data = self._collection_docs(reference._collection).get(reference.id)
+        return DocumentSnapshot(reference, data, self._update_times.get(reference.path))
+
+    def _check(self, kind: str, reference: DocumentReference, option: Any) -> None:
+        """Raise the error Firestore returns when a write precondition fails."""
+        exists = reference.path in self._update_times
+        if kind == "update" and not exists:
+            raise exceptions.NotFound(f"No document to update: {reference.path}")
+        if isinstance(option, _helpers.ExistsOption) and option._exists != exists:
+            if exists:
+                raise exceptions.AlreadyExists(f"Document already exists: {reference.path}")
+            raise exceptions.NotFound(f"No document to update: {reference.path}")
+        if isinstance(option, _helpers.LastUpdateOption):
+            if self._update_times.get(reference.path) != option._last_update_time:
+                raise exceptions.FailedPrecondition(f"Document was modified: {reference.path}")
+
+    def _apply(self, writes: List[Tuple[str, DocumentReference, Any, Any]]) -> List[Any]:
+        # All preconditions are checked before anything is applied, so a
+        # failed commit leaves the store untouched.
+        for kind, reference, _, option in writes:
+            self._check(kind, reference, option)
+        now = self._now()
+        for kind, reference, data, _ in writes:
+            docs = self._collection_docs(reference._collection)
+            self.stats["writes"] += 1
+            if kind == "delete":
+                docs.pop(reference.id, None)
+                self._update_times.pop(reference.path, None)
+                continue
+            if kind == "update":
+                document = docs[reference.id] = _copy(docs[reference.id])
+                for path, value in data.items():
+                    *parents, leaf = path.split(".")
+                    target = document
+                    for part in parents:
+                        target = target.setdefault(part, {})
+                    if value is firestore.DELETE_FIELD:
+                        target.pop(leaf, None)
+                    else:
+                        target[leaf] = _resolve(value, target.get(leaf), now)
+            elif kind == "merge":
+                document = docs[reference.id] = _copy(docs.get(reference.id, {}))
+                _merge(document, data, now)
+            else:
+                docs[reference.id] = _resolve(data, None, now)
+            self._update_times[reference.path] = now
+        return [now] * len(writes)
+
+    @staticmethod
+    def write_option(**kwargs: Any) -> Any:
+        """Return a write precondition, as `firestore.AsyncClient.write_option` does."""
+        return BaseClient.write_option(**kwargs)
+
+    def collection(self, collection_id: str) -> CollectionReference:
+        return CollectionReference(self, collection_id)
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> Transaction:
+        return Transaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    async def get_all(
+        self, references: Iterable[DocumentReference], field_paths: Any = None, transaction: Any = None
+    ) -> AsyncIterator[DocumentSnapshot]:
+        references = list(references)
+        await self._round_trip()
+        for reference in references:
+            yield self._snapshot(reference)
+
+    def reset_stats(self) -> None:
+        """Zero the round-trip, read and write counters."""
+        self.stats.clear()
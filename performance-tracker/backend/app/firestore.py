@@ -1,16 +1,40 @@
 """Firestore client helper.
 
-This module exposes a helper to obtain a cached Firestore client.  The client
-is cached using `lru_cache` so that it is created only once per process.
+This module exposes helpers to obtain cached Firestore clients.  The clients
+are cached using `lru_cache` so that they are created only once per process.
+
+Request handlers should use the asynchronous client returned by
+`get_async_firestore_client` so that Firestore round trips do not block the
+event loop.  SDK calls that have no asynchronous equivalent (for example
+Firebase Admin token verification) are dispatched to a bounded thread pool via
+`run_blocking`.
 """
 
 from __future__ import annotations
 
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from functools import lru_cache
-from typing import Any
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, TypeVar
 
 from google.cloud import firestore
 
+from .metrics import InstrumentedFirestore
+
+
+T = TypeVar("T")
+
+# Maximum number of threads used for blocking SDK calls.  Keeping this bounded
+# prevents a burst of requests from spawning an unbounded number of threads.
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "8"))
+
+_blocking_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking-io"
+)
+
 
 @lru_cache(maxsize=1)
 def get_firestore_client() -> firestore.Client:
@@ -20,4 +44,118 @@ def get_firestore_client() -> firestore.Client:
         A cached `google.cloud.firestore.Client` configured to use the project
         associated with the service account credentials.
     """
-    return firestore.Client()
\ No newline at end of file
+    return firestore.Client()
+
+
+@lru_cache(maxsize=1)
+def _default_async_client() -> firestore.AsyncClient:
+    return InstrumentedFirestore(firestore.AsyncClient())
+
+
+# Client installed by `use_firestore_client`, taking precedence over the default.
+_async_client_override: Optional[Any] = None
+
+
+def get_async_firestore_client() -> firestore.AsyncClient:
+    """Get an asynchronous Firestore client instance.
+
+    Returns:
+        The client installed with `use_firestore_client`, or else a cached
+        `google.cloud.firestore.AsyncClient` configured to use the project
+        associated with the service account credentials.  Either way the
+        client is wrapped in `app.metrics.InstrumentedFirestore`, so every
+        round trip is attributed to the current request in `/metrics`.
+    """
+    if _async_client_override is not None:
+        return _async_client_override
+    return _default_async_client()
+
+
+def use_firestore_client(client: Optional[Any]) -> None:
+    """Serve `client` from `get_async_firestore_client` from now on.
+
+    Used to run the API against `app.fakes.InMemoryFirestore`; passing `None`
+    restores the real client.
+    """
+    global _async_client_override
+    _async_client_override = InstrumentedFirestore(client) if client is not None else None
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking callable on the bounded thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
+
+
+# Firestore caps the number of values accepted by an `in` filter.
+IN_FILTER_LIMIT = 30
+
+
+def chunked(values: Sequence[T], size: int) -> Iterator[List[T]]:
+    """Yield successive lists of at most `size` items from `values`."""
+    for start in range(0, len(values), size):
+        yield list(values[start : start + size])
+
+
+def uid_queries(query: Any, uids: Optional[Sequence[str]]) -> List[Any]:
+    """Split `query` into one query per `in` filter chunk of `uids`.
+
+    `None` means no UID restriction, and yields `query` unchanged.
+    """
+    if uids is None:
+        return [query]
+    return [query.where("uid", "in", chunk) for chunk in chunked(list(uids), IN_FILTER_LIMIT)]
+
+
+async def stream_concurrently(queries: Sequence[Any]) -> List[List[Any]]:
+    """Run `queries` concurrently and return the snapshots of each, in order.
+
+    A manager's team usually needs one query per chunk of UIDs; running them
+    together means the request waits for the slowest chunk rather than for
+    all of them in turn.
+    """
+
+    async def collect(query: Any) -> List[Any]:
+        return [snap async for snap in query.stream()]
+
+    if len(queries) == 1:
+        return [await collect(queries[0])]
+    return list(await asyncio.gather(*(collect(query) for query in queries)))
+
+
+def apply_date_range(query: Any, from_date: Optional[date], to_date: Optional[date], field: str = "date") -> Any:
+    """Restrict `query` to documents whose ISO date `field` lies in the range (inclusive)."""
+    if from_date is not None:
+        query = query.where(field, ">=", from_date.isoformat())
+    if to_date is not None:
+        query = query.where(field, "<=", to_date.isoformat())
+    return query
+
+
+# Firestore rejects batches containing more than this many writes.
+MAX_BATCH_WRITES = 500
+
+
+async def commit_in_chunks(
+    db: Any, operations: Iterable[Callable[[Any], None]], chunk_size: int = MAX_BATCH_WRITES
+) -> int:
+    """Apply single-write `operations` to successive batches and commit each one.
+
+    Each operation receives the current batch and must add exactly one write
+    to it.  Returns the number of batches committed.
+    """
+    batch = db.batch()
+    pending = 0
+    commits = 0
+    for operation in operations:
+        operation(batch)
+        pending += 1
+        if pending == chunk_size:
+            await batch.commit()
+            commits += 1
+            batch = db.batch()
+            pending = 0
+    if pending:
+        await batch.commit()
+        commits += 1
+    return commits
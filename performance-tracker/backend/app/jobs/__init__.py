@@ -0,0 +1,6 @@
+"""Background and maintenance jobs.
+
+Jobs are plain async functions that can be triggered from an admin endpoint
+or run from the command line with `python -m app.jobs.<name>` from the
+`backend` directory.
+"""
@@ -0,0 +1,44 @@
+"""Backfill `next_due_date` on WhatsApp customers that do not have one.
+
+Customers created before due dates were materialised are invisible to the
+`/whatsapp/due` range query until this job has run.  Each such customer is
+given the first due date on or after today.
+
+Usage::
+
+    python -m app.jobs.backfill_due_dates
+"""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Dict, Optional
+
+from ..firestore import commit_in_chunks, get_async_firestore_client
+from ..services.whatsapp import CUSTOMERS_COLLECTION, first_due_on_or_after
+
+
+async def backfill_due_dates(today: Optional[date] = None) -> Dict[str, int]:
+    """Set `next_due_date` on every customer missing it and return the count updated."""
+    today = today or date.today()
+    db = get_async_firestore_client()
+    operations = []
+    async for snap in db.collection(CUSTOMERS_COLLECTION).stream():
+        customer = snap.to_dict()
+        if customer.get("next_due_date") or not customer.get("fixed_due_day"):
+            continue
+        next_due = first_due_on_or_after(today, int(customer["fixed_due_day"])).isoformat()
+        operations.append(
+            lambda batch, ref=snap.reference, next_due=next_due: batch.update(ref, {"next_due_date": next_due})
+        )
+    await commit_in_chunks(db, operations)
+    return {"customers_updated": len(operations)}
+
+
+def main() -> None:
+    print(asyncio.run(backfill_due_dates()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Generate the monthly incentive statements of every employee.
+
+The job fetches the month's payments and incentives in two date range
+queries, partitions them by employee and renders the statements across a
+pool of worker processes, so rendering does not hold up the event loop or
+stay on one core.  Once a month has statements, only those out of date (see
+`app.services.statements`) are fetched and rendered again, so re-running the
+job after a few payment changes only touches the affected employees.  Run it
+with `--force` once for months whose payments were written before
+statements existed.
+
+Usage::
+
+    python -m app.jobs.generate_statements --month 2024-05
+    python -m app.jobs.generate_statements --month 2024-05 --force --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+from .. import statements as rendering
+from ..firestore import commit_in_chunks, get_async_firestore_client
+from ..services import statements
+
+
+# Worker processes rendering statements.  1 renders in the calling process.
+STATEMENT_WORKERS = int(os.getenv("STATEMENT_WORKERS", str(os.cpu_count() or 1)))
+
+# Statements sent to a worker at a time.
+STATEMENT_CHUNK_SIZE = 16
+
+# Statements stored per batch.  Each carries its rendered files, and Firestore
+# caps a commit request at 10 MiB.
+STATEMENT_BATCH_WRITES = 50
+
+
+async def render_all(inputs: List[Dict[str, Any]], workers: int = STATEMENT_WORKERS) -> List[Dict[str, Any]]:
+    """Render `inputs` (see `app.statements.render_statement`) on up to `workers` processes."""
+    if workers <= 1 or len(inputs) <= STATEMENT_CHUNK_SIZE:
+        return rendering.render_statements(inputs)
+    chunks = [inputs[start : start + STATEMENT_CHUNK_SIZE] for start in range(0, len(inputs), STATEMENT_CHUNK_SIZE)]
+    loop = asyncio.get_running_loop()
+    # Spawned rather than forked: the API process runs threads (the blocking
+    # pool, the Firestore channel) that a fork would copy mid-operation.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as pool:
+        results = await asyncio.gather(*(loop.run_in_executor(pool, rendering.render_statements, c) for c in chunks))
+    return [rendered for chunk in results for rendered in chunk]
+
+
+async def generate_statements(month: str, force: bool = False, workers: int = STATEMENT_WORKERS) -> Dict[str, Any]:
+    """Render and store the statements of `month` (`YYYY-MM`) that are not current.
+
+    Args:
+        month: Month to generate.
+        force: Re-render current statements as well.
+        workers: Worker processes to render on.
+
+    Returns:
+        The number of employees with a statement, and how many were rendered.
+
+    Raises:
+        ValueError: If `month` is not a `YYYY-MM` month.
+    """
+    if not re.match(statements.MONTH_PATTERN, month):
+        raise ValueError(f"Invalid month: {month}")
+    db = get_async_firestore_client()
+    # Versions are read before the payments, so a change committed in between
+    # leaves the stored statement out of date rather than wrongly current.
+    states = await statements.fetch_states(month)
+    if force or not states:
+        records = await statements.fetch_month(month)
+        employees = sorted(set(states) | set(records))
+        stale = employees
+    else:
+        # Every payment write creates or bumps its statement document, so the
+        # stored states already name every employee with payments this month.
+        employees = sorted(states)
+        stale = [uid for uid in employees if not statements.is_current(states[uid])]
+        records = await statements.fetch_month(month, stale) if stale else {}
+    names = await statements.employee_names(stale)
+    inputs = [statements.statement_input(uid, names.get(uid), month, records.get(uid)) for uid in stale]
+    rendered = await render_all(inputs, workers)
+
+    await commit_in_chunks(
+        db,
+        (
+            lambda batch, result=result: statements.write_statement(
+                batch, db, month, names.get(result["uid"]), states.get(result["uid"], {}).get("version", 0), result
+            )
+            for result in rendered
+        ),
+        chunk_size=STATEMENT_BATCH_WRITES,
+    )
+    return {"month": month, "employees": len(employees), "rendered": len(rendered)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate the monthly incentive statements of every employee.")
+    parser.add_argument("--month", required=True, help="Month to generate (YYYY-MM)")
+    parser.add_argument("--force", action="store_true", help="Re-render statements that are already current")
+    parser.add_argument("--workers", type=int, default=STATEMENT_WORKERS, help="Worker processes")
+    args = parser.parse_args()
+    print(asyncio.run(generate_statements(args.month, args.force, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+"""Bulk import of historical payments and call entries from CSV.
+
+The file is read as a stream, one record at a time, so memory use does not
+grow with the number of rows.  Each row is validated against the `Payment` or
+`CallEntry` model.  Valid rows are added to a `WritePlan` together with
+everything the API would write for them: incentives, daily rollups and the
+customer revenue index for payments, and rollups for call entries.  A chunk
+is cut when its plan approaches the 500-write batch limit, and up to
+`IMPORT_COMMIT_CONCURRENCY` chunks are committed in parallel.  The file is
+not read further while that many commits are in flight.
+
+Each chunk commit also writes an `import_chunks` document.  It records the
+range of data rows the chunk covers and the errors of its invalid rows, so
+the error report and the import's progress are always exactly as committed.
+If a commit fails, the import stops and the job records `next_row`, the
+number of leading data rows that are fully imported.  Re-running the job with
+the same file skips every row that belongs to a committed chunk, so nothing
+is written twice.
+
+A run holds a lease on its job, renewed every third of
+`IMPORT_LEASE_SECONDS` while it runs.  The job is claimed in a transaction,
+and a job still `running` under an unexpired lease cannot be claimed again.
+A job whose process died therefore stays `running` only until its lease
+expires, after which it can be resumed.  Chunk records are created, never
+overwritten, so even two runs that overlap cannot import a chunk twice.
+
+CSV columns are `uid` (the employee) plus the model's fields; other columns,
+such as the `id` of an export, are ignored.  Call entry `demos` are a JSON
+array, as in the call export.  Rows are numbered from 1, not counting the
+header.  Imported rows do not publish live update events.
+
+Usage::
+
+    python -m app.jobs.import_csv payments payments.csv
+    python -m app.jobs.import_csv calls calls.csv --start-row 20000
+    python -m app.jobs.import_csv payments payments.csv --resume <job_id> --errors errors.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from google.cloud import firestore
+from pydantic import ValidationError
+
+from ..auth import get_user_profile
+from ..firestore import MAX_BATCH_WRITES, get_async_firestore_client
+from ..models import CallEntry, Payment
+from ..services import calls as call_service
+from ..services import customer_revenue, demo_index, rollups, statements, versions
+from ..services.incentives import INCENTIVES_COLLECTION, build_incentive_doc
+from ..services.master_data import MasterData, get_master_data
+from ..services.payments import PAYMENTS_COLLECTION, payment_to_doc
+from ..services.write_plan import WritePlan
+from .recalculate_incentives import JOBS_COLLECTION
+
+
+IMPORT_CHUNKS_COLLECTION = "import_chunks"
+
+IMPORT_KINDS = ("payments", "calls")
+
+# Chunk commits in flight at once during an import.
+IMPORT_COMMIT_CONCURRENCY = int(os.getenv("IMPORT_COMMIT_CONCURRENCY", "8"))
+
+# Upper bound on rows per chunk, whatever the write count.
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "400"))
+
+# Most writes a single row can add to a plan: the record itself plus its
+# aggregates (a payment also writes its incentive, three rollups, the
+# customer, three monthly and three daily revenue buckets, its card and its
+# statement; a call entry its demo index entry and three rollups; either bumps
+# three scope versions).
+_ROW_WRITES = {"payments": 17, "calls": 8}
+
+ERROR_REPORT_COLUMNS = ["row", "error"]
+
+# Seconds a running import's lease lasts without being renewed; after that
+# the job counts as abandoned and may be resumed.
+IMPORT_LEASE_SECONDS = float(os.getenv("IMPORT_LEASE_SECONDS", "120"))
+
+
+class ImportInProgress(Exception):
+    """The import job is held by a run whose lease has not expired."""
+
+
+def _job_doc_id(job_id: str) -> str:
+    return f"import_{job_id}"
+
+
+def _chunk_doc_id(job_id: str, first_row: int) -> str:
+    return f"{job_id}_{first_row:09d}"
+
+
+async def iter_csv_records(blocks: AsyncIterable[bytes]) -> AsyncIterator[Dict[str, str]]:
+    """Yield the rows of a UTF-8 CSV byte stream as dicts keyed by the header.
+
+    Only one record is held in memory at a time.  A record ends at a line
+    break outside quotes; since quotes inside a quoted field are doubled, that
+    is a line break after an even number of quote characters.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    header: Optional[List[str]] = None
+    pending = ""
+    record = ""
+
+    def parse(text: str) -> Optional[Dict[str, str]]:
+        nonlocal header
+        values = next(csv.reader([text]), [])
+        if not any(value.strip() for value in values):
+            return None
+        if header is None:
+            header = [name.strip() for name in values]
+            return None
+        return dict(zip(header, values))
+
+    async for block in blocks:
+        pending += decoder.decode(block)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            record += line + "\n"
+            if record.count('"') % 2 == 0:
+                row = parse(record)
+                record = ""
+                if row is not None:
+                    yield row
+    record += pending + decoder.decode(b"", final=True)
+    if record.strip():
+        row = parse(record)
+        if row is not None:
+            yield row
+
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in exc.errors()
+    )
+
+
+def parse_row(kind: str, record: Dict[str, str]) -> Tuple[str, Any]:
+    """Validate one CSV record and return `(uid, model)`.
+
+    Raises:
+        ValueError: If the row is invalid; the message is reported for the row.
+    """
+    fields = {key: value.strip() for key, value in record.items() if key and value is not None and value.strip()}
+    uid = fields.pop("uid", None)
+    if not uid:
+        raise ValueError("uid: Field required")
+    model = Payment if kind == "payments" else CallEntry
+    fields = {key: value for key, value in fields.items() if key in model.__fields__}
+    if kind == "calls" and "demos" in fields:
+        try:
+            fields["demos"] = json.loads(fields["demos"])
+        except ValueError:
+            raise ValueError("demos: Must be a JSON array")
+    try:
+        return uid, model(**fields)
+    except ValidationError as exc:
+        raise ValueError(_validation_message(exc))
+
+
+async def _team_of(uid: str) -> Optional[str]:
+    """Return the team of `uid` as `get_team_uid` would, or raise ValueError for unknown users."""
+    profile = await get_user_profile(uid)
+    if not profile:
+        raise ValueError(f"Unknown user: {uid}")
+    if profile.get("manager_uid"):
+        return profile["manager_uid"]
+    return uid if profile.get("role") == "MANAGER" else None
+
+
+class _Chunk:
+    """Rows collected for one commit."""
+
+    def __init__(self, first_row: int) -> None:
+        self.first_row = first_row
+        self.last_row = first_row
+        self.rows = 0
+        self.written = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.plan = WritePlan()
+        self.call_keys: Set[Tuple[str, str]] = set()
+
+    def add_error(self, row: int, message: str) -> None:
+        self.errors.append({"row": row, "error": message})
+
+
+def _add_row(
+    kind: str, chunk: _Chunk, db: Any, master: MasterData, uid: str, team_uid: Optional[str], model: Any
+) -> None:
+    """Add the writes for one valid row to the chunk's plan.
+
+    Raises:
+        ValueError: If the row cannot be written.
+    """
+    if kind == "calls":
+        key = (uid, model.date.isoformat())
+        if key in chunk.call_keys:
+            raise ValueError("Duplicate of an earlier row for the same employee and date")
+        chunk.call_keys.add(key)
+        call_service.write_call_entry(chunk.plan, db, uid, team_uid, model)
+        demo_index.write_call_entry(chunk.plan, db, uid, team_uid, model)
+        rollups.write_call_entry(chunk.plan, db, uid, team_uid, model)
+        versions.bump_record(chunk.plan, db, uid, team_uid)
+        return
+    if model.service not in master.base_percents:
+        raise ValueError(f"Unknown service: {model.service}")
+    base_percent, global_percent = master.percentages(model.service)
+    payment_ref = db.collection(PAYMENTS_COLLECTION).document()
+    data = payment_to_doc(uid, team_uid, model)
+    data["created_at"] = firestore.SERVER_TIMESTAMP
+    incentive = build_incentive_doc(payment_ref.id, uid, model, base_percent, global_percent)
+    chunk.plan.create(payment_ref, data)
+    chunk.plan.set(db.collection(INCENTIVES_COLLECTION).document(payment_ref.id), incentive)
+    rollups.write_payment_delta(chunk.plan, db, data, incentive["incentive_amount"], 1)
+    customer_revenue.write_payment_delta(chunk.plan, db, data, 1)
+    demo_index.write_payment_delta(chunk.plan, db, payment_ref.id, data, 1)
+    statements.mark_stale(chunk.plan, db, uid, data["date"])
+    versions.bump_record(chunk.plan, db, uid, team_uid)
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Return the checkpoint document of an import job, if any."""
+    db = get_async_firestore_client()
+    snap = await db.collection(JOBS_COLLECTION).document(_job_doc_id(job_id)).get()
+    return snap.to_dict() if snap.exists else None
+
+
+async def start_job(kind: str, start_row: int = 0) -> str:
+    """Create a new import job that skips the first `start_row` data rows and return its ID."""
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    job_id = uuid.uuid4().hex
+    db = get_async_firestore_client()
+    await db.collection(JOBS_COLLECTION).document(_job_doc_id(job_id)).set(
+        {
+            "job_id": job_id,
+            "type": "import",
+            "kind": kind,
+            "status": "pending",
+            "start_row": start_row,
+            "next_row": start_row,
+            "rows": 0,
+            "written": 0,
+            "failed": 0,
+            "error": None,
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+    )
+    return job_id
+
+
+async def _committed_chunks(job_id: str) -> List[Dict[str, Any]]:
+    db = get_async_firestore_client()
+    query = db.collection(IMPORT_CHUNKS_COLLECTION).where("job_id", "==", job_id)
+    query = query.select(["first_row", "last_row", "rows", "written", "failed"])
+    chunks = [snap.to_dict() async for snap in query.stream()]
+    return sorted(chunks, key=lambda chunk: chunk["first_row"])
+
+
+def _next_row(start_row: int, ranges: List[Tuple[int, int]]) -> int:
+    """Return how many leading data rows are covered by `start_row` and the committed ranges."""
+    next_row = start_row
+    for first, last in sorted(ranges):
+        if first > next_row + 1:
+            break
+        next_row = max(next_row, last)
+    return next_row
+
+
+def _lease_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=IMPORT_LEASE_SECONDS)
+
+
+async def _claim(db: Any, job_ref: Any) -> Dict[str, Any]:
+    """Take the lease on a job that is not completed and return the job.
+
+    Raises:
+        KeyError: If the job does not exist.
+        ImportInProgress: If another run holds an unexpired lease.
+    """
+
+    @firestore.async_transactional
+    async def apply(transaction: Any) -> Dict[str, Any]:
+        snap = await job_ref.get(transaction=transaction)
+        if not snap.exists:
+            raise KeyError(job_ref.id)
+        job = snap.to_dict()
+        if job["status"] == "completed":
+            return job
+        lease = job.get("lease_expires_at")
+        if job["status"] == "running" and lease is not None and lease > datetime.now(timezone.utc):
+            raise ImportInProgress(f"Job {job['job_id']} is already running")
+        transaction.update(
+            job_ref,
+            {"status": "running", "lease_expires_at": _lease_expiry(), "updated_at": firestore.SERVER_TIMESTAMP},
+        )
+        return {**job, "status": "running"}
+
+    return await apply(db.transaction())
+
+
+async def _renew_lease(job_ref: Any) -> None:
+    """Renew a job's lease until cancelled."""
+    while True:
+        await asyncio.sleep(IMPORT_LEASE_SECONDS / 3)
+        await job_ref.update({"lease_expires_at": _lease_expiry(), "updated_at": firestore.SERVER_TIMESTAMP})
+
+
+async def run_job(job_id: str, records: AsyncIterable[Dict[str, str]]) -> Dict[str, Any]:
+    """Run (or resume) an import job over the CSV `records` of its file.
+
+    Returns:
+        The final checkpoint document.
+
+    Raises:
+        KeyError: If the job does not exist.
+        ImportInProgress: If the job is being run elsewhere.
+    """
+    db = get_async_firestore_client()
+    job_ref = db.collection(JOBS_COLLECTION).document(_job_doc_id(job_id))
+    job = await _claim(db, job_ref)
+    if job["status"] == "completed":
+        return job
+
+    kind = job["kind"]
+    start_row = job["start_row"]
+    committed = await _committed_chunks(job_id)
+    ranges = [(chunk["first_row"], chunk["last_row"]) for chunk in committed]
+    totals = {
+        "rows": sum(chunk["rows"] for chunk in committed),
+        "written": sum(chunk["written"] for chunk in committed),
+        "failed": sum(chunk["failed"] for chunk in committed),
+    }
+    master = await get_master_data()
+    max_writes = MAX_BATCH_WRITES - 1 - _ROW_WRITES[kind]  # keep room for the chunk record
+    semaphore = asyncio.Semaphore(IMPORT_COMMIT_CONCURRENCY)
+    in_flight: Set["asyncio.Task[None]"] = set()
+    failures: List[Tuple[int, str]] = []
+
+    async def commit(chunk: _Chunk) -> None:
+        try:
+            chunk.plan.create(
+                db.collection(IMPORT_CHUNKS_COLLECTION).document(_chunk_doc_id(job_id, chunk.first_row)),
+                {
+                    "job_id": job_id,
+                    "first_row": chunk.first_row,
+                    "last_row": chunk.last_row,
+                    "rows": chunk.rows,
+                    "written": chunk.written,
+                    "failed": len(chunk.errors),
+                    "errors": chunk.errors,
+                },
+            )
+            # Buffered upserts of the same entries must not overwrite the imported rows.
+            doc_ids = [f"{uid}_{day}" for uid, day in chunk.call_keys]
+            async with call_service.write_buffer.write_through(doc_ids):
+                await chunk.plan.commit(db)
+        except Exception as exc:  # stop the import and leave the chunk to a resumed run
+            failures.append((chunk.first_row, f"Rows {chunk.first_row}-{chunk.last_row}: {exc}"))
+        else:
+            ranges.append((chunk.first_row, chunk.last_row))
+            totals["rows"] += chunk.rows
+            totals["written"] += chunk.written
+            totals["failed"] += len(chunk.errors)
+        finally:
+            semaphore.release()
+
+    async def schedule(chunk: _Chunk) -> None:
+        await semaphore.acquire()
+        task = asyncio.create_task(commit(chunk))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    heartbeat = asyncio.create_task(_renew_lease(job_ref))
+    skip = iter(sorted(ranges))
+    skip_range = next(skip, None)
+    chunk: Optional[_Chunk] = None
+    row = 0
+    try:
+        async for record in records:
+            row += 1
+            if row <= start_row:
+                continue
+            while skip_range is not None and skip_range[1] < row:
+                skip_range = next(skip, None)
+            if skip_range is not None and skip_range[0] <= row:
+                continue
+            if failures:
+                break
+            if chunk is None:
+                chunk = _Chunk(row)
+            chunk.last_row = row
+            chunk.rows += 1
+            try:
+                uid, model = parse_row(kind, record)
+                _add_row(kind, chunk, db, master, uid, await _team_of(uid), model)
+            except ValueError as exc:
+                chunk.add_error(row, str(exc))
+            else:
+                chunk.written += 1
+            if len(chunk.plan) > max_writes or chunk.rows >= IMPORT_CHUNK_ROWS:
+                await schedule(chunk)
+                chunk = None
+        if chunk is not None and not failures:
+            await schedule(chunk)
+    except Exception as exc:
+        # Reading the file failed (e.g. the client disconnected); keep what was committed.
+        failures.append((row, f"Import interrupted at row {row}: {exc}"))
+        raise
+    finally:
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+        first_failure = min(failures) if failures else None
+        await job_ref.update(
+            {
+                **totals,
+                "next_row": _next_row(start_row, ranges),
+                "status": "failed" if first_failure else "completed",
+                "error": first_failure[1] if first_failure else None,
+                "lease_expires_at": None,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            }
+        )
+    return await get_job(job_id)
+
+
+async def list_errors(job_id: str, cursor: Optional[str], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return a page of the per-row error report of an import job.
+
+    `limit` counts chunks, so a page holds the errors of up to `limit`
+    chunks, in row order.  The cursor is the first row of the last chunk read.
+    """
+    db = get_async_firestore_client()
+    query = db.collection(IMPORT_CHUNKS_COLLECTION).where("job_id", "==", job_id).order_by("first_row")
+    if cursor:
+        query = query.start_after({"first_row": int(cursor)})
+    snaps = [snap async for snap in query.select(["first_row", "errors"]).limit(limit).stream()]
+    errors = [error for snap in snaps for error in snap.get("errors")]
+    next_cursor = str(snaps[-1].get("first_row")) if len(snaps) == limit else None
+    return errors, next_cursor
+
+
+async def _file_blocks(path: str, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(size)
+            if not block:
+                return
+            yield block
+
+
+async def _write_error_report(job_id: str, path: str) -> int:
+    """Write the row errors of `job_id` to the CSV file at `path` and return how many there were."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(ERROR_REPORT_COLUMNS)
+        cursor: Optional[str] = None
+        while True:
+            errors, cursor = await list_errors(job_id, cursor, 100)
+            writer.writerows([error["row"], error["error"]] for error in errors)
+            count += len(errors)
+            if cursor is None:
+                return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import historical payments or call entries from a CSV file.")
+    parser.add_argument("kind", choices=IMPORT_KINDS)
+    parser.add_argument("path", help="CSV file to import")
+    parser.add_argument("--start-row", type=int, default=0, help="Skip this many data rows (new jobs only)")
+    parser.add_argument("--resume", metavar="JOB_ID", help="Resume an interrupted import of the same file")
+    parser.add_argument("--errors", metavar="PATH", help="Write the per-row error report to this CSV file")
+    args = parser.parse_args()
+
+    # One event loop for the whole run: the cached async client is bound to it.
+    async def run() -> None:
+        job_id = args.resume or await start_job(args.kind, args.start_row)
+        job = await run_job(job_id, iter_csv_records(_file_blocks(args.path)))
+        print(job)
+        if args.errors:
+            print(f"{await _write_error_report(job['job_id'], args.errors)} row errors written to {args.errors}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Copy call entries from the per-day layout into month documents.
+
+Reads the `calls` collection one month at a time and merges every entry into
+the slot for its day in `calls_monthly/{uid}_{YYYY-MM}` (see
+`app.services.calls`).  Only the copied slots are written, so the job can be
+re-run or resumed with `--from` after an interruption, and entries already
+upserted in the monthly layout are only overwritten by the same day's daily
+entry.  Switch the application to `CALL_STORAGE_LAYOUT=monthly` once the copy
+has finished.  Pass `--delete-source` to remove the per-day documents after
+their month has been written.
+
+Usage::
+
+    python -m app.jobs.migrate_call_layout
+    python -m app.jobs.migrate_call_layout --from 2024-01-01 --to 2024-03-31 --delete-source
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+from google.cloud import firestore
+
+from ..firestore import apply_date_range, commit_in_chunks, get_async_firestore_client
+from ..services.calls import (
+    CALLS_COLLECTION,
+    MONTHLY_CALLS_COLLECTION,
+    month_key,
+    monthly_doc_id,
+    monthly_slot_write,
+)
+
+
+async def _date_bound(db: Any, descending: bool) -> Optional[date]:
+    """Return the earliest (or latest) entry date in the per-day layout."""
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    async for snap in db.collection(CALLS_COLLECTION).order_by("date", direction=direction).limit(1).stream():
+        return date.fromisoformat(snap.get("date"))
+    return None
+
+
+async def migrate_call_layout(
+    from_date: Optional[date] = None, to_date: Optional[date] = None, delete_source: bool = False
+) -> Dict[str, int]:
+    """Copy per-day call entries between `from_date` and `to_date` into month documents.
+
+    Missing bounds default to the earliest and latest stored entry.
+
+    Returns:
+        Counts of entries copied, month documents written and per-day
+        documents deleted.
+    """
+    db = get_async_firestore_client()
+    from_date = from_date or await _date_bound(db, descending=False)
+    to_date = to_date or await _date_bound(db, descending=True)
+    totals = {"entries_copied": 0, "month_documents_written": 0, "daily_documents_deleted": 0}
+    if from_date is None or to_date is None:
+        return totals
+
+    monthly = db.collection(MONTHLY_CALLS_COLLECTION)
+    start = from_date
+    while start <= to_date:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        end = min(to_date, next_month - timedelta(days=1))
+        payloads: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"days": {}})
+        sources = []
+        async for snap in apply_date_range(db.collection(CALLS_COLLECTION), start, end).stream():
+            entry = snap.to_dict()
+            payload = monthly_slot_write(entry["uid"], entry["date"], entry)
+            merged = payloads[monthly_doc_id(entry["uid"], month_key(start))]
+            merged.update(uid=payload["uid"], month=payload["month"])
+            merged["days"].update(payload["days"])
+            sources.append(snap.reference)
+        # Month documents are committed before any source is deleted, so an
+        # interrupted run never loses entries.
+        await commit_in_chunks(
+            db,
+            [
+                lambda batch, doc_id=doc_id, payload=payload: batch.set(monthly.document(doc_id), payload, merge=True)
+                for doc_id, payload in payloads.items()
+            ],
+        )
+        if delete_source:
+            await commit_in_chunks(db, [lambda batch, ref=ref: batch.delete(ref) for ref in sources])
+            totals["daily_documents_deleted"] += len(sources)
+        totals["entries_copied"] += len(sources)
+        totals["month_documents_written"] += len(payloads)
+        start = next_month
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Copy per-day call entries into month documents.")
+    parser.add_argument("--from", dest="from_date", type=date.fromisoformat, default=None)
+    parser.add_argument("--to", dest="to_date", type=date.fromisoformat, default=None)
+    parser.add_argument("--delete-source", action="store_true", help="Delete per-day documents once copied")
+    args = parser.parse_args()
+    print(asyncio.run(migrate_call_layout(args.from_date, args.to_date, args.delete_source)))
+
+
+if __name__ == "__main__":
+    main()
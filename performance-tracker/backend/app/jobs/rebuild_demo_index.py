@@ -0,0 +1,71 @@
+"""Rebuild the demo index from stored call entries and payments.
+
+The demo index (see `app.services.demo_index`) is normally maintained by the
+write paths.  This job indexes records written before it existed and repairs
+it after an incident.  Index entries in the range are rewritten from the call
+entries (in either storage layout), entries with no demos left are deleted,
+and every payment in the range is written to its card.  After remapping
+employees, run `app.jobs.rebuild_rollups` first so that the entries carry
+their current team.
+
+Usage::
+
+    python -m app.jobs.rebuild_demo_index --from 2024-01-01 --to 2024-03-31
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from datetime import date
+from typing import Any, Dict
+
+from ..firestore import apply_date_range, commit_in_chunks, get_async_firestore_client
+from ..services import calls as call_service
+from ..services import demo_index
+from ..services.payments import PAYMENTS_COLLECTION
+
+
+async def rebuild_demo_index(from_date: date, to_date: date) -> Dict[str, Any]:
+    """Re-index the call entries and payments between `from_date` and `to_date` inclusive.
+
+    Returns:
+        Counts of index entries written and deleted and of payments indexed.
+    """
+    db = get_async_firestore_client()
+    index = db.collection(demo_index.DEMO_INDEX_COLLECTION)
+
+    entries: Dict[str, Dict[str, Any]] = {}
+    for record in await call_service.fetch_call_records(from_date, to_date):
+        doc = demo_index.demo_index_doc(record["uid"], record.get("team_uid"), record)
+        if doc is not None:
+            entries[record["id"]] = doc
+    query = apply_date_range(index, from_date, to_date).select(["date"])
+    stale = [snap.id async for snap in query.stream() if snap.id not in entries]
+
+    operations = [
+        lambda batch, doc_id=doc_id, doc=doc: batch.set(index.document(doc_id), doc) for doc_id, doc in entries.items()
+    ]
+    operations += [lambda batch, doc_id=doc_id: batch.delete(index.document(doc_id)) for doc_id in stale]
+    payments = 0
+    async for snap in apply_date_range(db.collection(PAYMENTS_COLLECTION), from_date, to_date).stream():
+        operations.append(
+            lambda batch, payment_id=snap.id, payment=snap.to_dict(): demo_index.write_payment_delta(
+                batch, db, payment_id, payment, 1
+            )
+        )
+        payments += 1
+    await commit_in_chunks(db, operations)
+    return {"entries_written": len(entries), "entries_deleted": len(stale), "payments_indexed": payments}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the demo index from call entries and payments.")
+    parser.add_argument("--from", dest="from_date", type=date.fromisoformat, required=True)
+    parser.add_argument("--to", dest="to_date", type=date.fromisoformat, required=True)
+    args = parser.parse_args()
+    print(asyncio.run(rebuild_demo_index(args.from_date, args.to_date)))
+
+
+if __name__ == "__main__":
+    main()
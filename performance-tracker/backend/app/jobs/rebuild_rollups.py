@@ -0,0 +1,101 @@
+"""Rebuild the daily analytics rollups from raw call and payment data.
+
+The rollups are normally maintained incrementally by the write paths.  This
+repair job recomputes them for a date range from the stored call entries (in
+either storage layout) and the `payments` and `incentives` collections,
+overwriting every rollup in the range and deleting rollups for days that no
+longer have any data.  Team membership is taken from
+the current `users` mapping, and records whose stored `team_uid` is out of
+date are corrected, so the job should be run after employees are remapped.
+Finally the global data version is bumped, so that no response cached before
+the rebuild is served again (see `app.services.versions`).
+
+Usage::
+
+    python -m app.jobs.rebuild_rollups --from 2024-01-01 --to 2024-03-31
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from datetime import date
+from typing import Any, Dict
+
+from google.cloud import firestore
+
+from ..firestore import apply_date_range, commit_in_chunks, get_async_firestore_client
+from ..services import calls as call_service
+from ..services import versions
+from ..services.incentives import INCENTIVES_COLLECTION
+from ..services.payments import PAYMENTS_COLLECTION
+from ..services.rollups import ROLLUPS_COLLECTION, build_rollups
+from ..services.users import USERS_COLLECTION
+
+
+async def rebuild_rollups(from_date: date, to_date: date) -> Dict[str, Any]:
+    """Recompute all rollups between `from_date` and `to_date` inclusive.
+
+    Returns:
+        Counts of rollup documents written and deleted and of records whose
+        team was corrected.
+    """
+    db = get_async_firestore_client()
+
+    async def fetch(collection: str) -> list:
+        query = apply_date_range(db.collection(collection), from_date, to_date)
+        return [{"id": snap.id, **snap.to_dict()} async for snap in query.stream()]
+
+    team_of: Dict[str, Any] = {}
+    async for snap in db.collection(USERS_COLLECTION).stream():
+        profile = snap.to_dict()
+        team_of[snap.id] = profile.get("manager_uid") or (snap.id if profile.get("role") == "MANAGER" else None)
+
+    calls = await call_service.fetch_call_records(from_date, to_date)
+    payments = await fetch(PAYMENTS_COLLECTION)
+    operations = []
+    for record in calls:
+        if record["uid"] in team_of and record.get("team_uid") != team_of[record["uid"]]:
+            record["team_uid"] = team_of[record["uid"]]
+            operations.append(
+                lambda batch, record=record: call_service.set_entry_team_uid(batch, db, record, record["team_uid"])
+            )
+    for record in payments:
+        if record["uid"] in team_of and record.get("team_uid") != team_of[record["uid"]]:
+            record["team_uid"] = team_of[record["uid"]]
+            ref = db.collection(PAYMENTS_COLLECTION).document(record["id"])
+            operations.append(
+                lambda batch, ref=ref, team_uid=record["team_uid"]: batch.update(
+                    ref, {"team_uid": team_uid, "updated_at": firestore.SERVER_TIMESTAMP}
+                )
+            )
+    corrected = len(operations)
+
+    incentive_amounts = {
+        incentive["id"]: float(incentive.get("incentive_amount", 0.0))
+        for incentive in await fetch(INCENTIVES_COLLECTION)
+    }
+    rebuilt = build_rollups(calls, payments, incentive_amounts)
+    stale = [doc["id"] for doc in await fetch(ROLLUPS_COLLECTION) if doc["id"] not in rebuilt]
+
+    rollups = db.collection(ROLLUPS_COLLECTION)
+    operations += [
+        lambda batch, doc_id=doc_id, doc=doc: batch.set(rollups.document(doc_id), doc)
+        for doc_id, doc in rebuilt.items()
+    ]
+    operations += [lambda batch, doc_id=doc_id: batch.delete(rollups.document(doc_id)) for doc_id in stale]
+    operations.append(lambda batch: versions.bump(batch, db, [versions.GLOBAL_SCOPE]))
+    await commit_in_chunks(db, operations)
+    return {"rollups_written": len(rebuilt), "rollups_deleted": len(stale), "records_corrected": corrected}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild daily analytics rollups from raw data.")
+    parser.add_argument("--from", dest="from_date", type=date.fromisoformat, required=True)
+    parser.add_argument("--to", dest="to_date", type=date.fromisoformat, required=True)
+    args = parser.parse_args()
+    print(asyncio.run(rebuild_rollups(args.from_date, args.to_date)))
+
+
+if __name__ == "__main__":
+    main()
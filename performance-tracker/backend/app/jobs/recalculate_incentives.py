@@ -0,0 +1,390 @@
+"""Recalculate incentives after the master percentages change.
+
+The job reads payments in keyset pages, fetches the linked incentives for the
+page in one round trip, and computes the new incentive amounts for the whole
+page at once with NumPy.  Only incentives whose percentages or amount change
+are written, together with the matching `Increment` deltas on the daily
+rollups, the versions of the affected monthly statements, the global data
+version (see `app.services.versions`) and the job checkpoint, in a single
+batch per page.  Because the checkpoint advances in the same commit as the
+writes it covers, a job that is interrupted can be resumed from its
+checkpoint without applying any page twice.  Each incentive write is
+conditioned on the incentive (or payment) not having changed since the page
+was read, so a payment edited while the job runs makes the page be read and
+written again rather than overwritten.
+
+In dry-run mode nothing but the checkpoint is written and the checkpoint
+accumulates a diff summary (changed counts and amount deltas per service plus
+a sample of individual changes).
+
+Usage::
+
+    python -m app.jobs.recalculate_incentives --from 2024-01-01 --dry-run
+    python -m app.jobs.recalculate_incentives --resume <job_id>
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import uuid
+from collections import defaultdict
+from datetime import date
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from google.api_core import exceptions
+from google.cloud import firestore
+
+from .. import events
+from ..firestore import commit_in_chunks, get_async_firestore_client
+from ..services import rollups, statements, versions
+from ..services.incentives import INCENTIVES_COLLECTION
+from ..services.master_data import get_master_data
+from ..services.payments import PAYMENTS_COLLECTION, list_payments
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+JOBS_COLLECTION = "jobs"
+
+# Payments per page.  Kept small enough that a page's incentive writes (and,
+# for payments without an incentive, the payment's precondition), rollup
+# deltas, statement versions, global version and checkpoint always fit in one
+# 500-write batch, so the preconditions guard every write of the page.
+PAGE_SIZE = 80
+
+# Times a page is read and written again after a payment on it changed.
+MAX_PAGE_ATTEMPTS = 5
+
+# Number of individual changes kept in a dry-run summary.
+MAX_SAMPLES = 50
+
+_PAYMENT_FIELDS = ["date", "uid", "team_uid", "service", "amount_paid"]
+
+
+def compute_incentive_amounts(amounts: np.ndarray, base_percents: np.ndarray, global_percent: float) -> np.ndarray:
+    """Vectorised form of `app.services.incentives.compute_incentive_amount`."""
+    import numpy as np
+
+    return np.round(amounts * base_percents / 100 * global_percent / 100, 2)
+
+
+def _job_doc_id(job_id: str) -> str:
+    return f"incentive_recalc_{job_id}"
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Return the checkpoint document of a recalculation job, if any."""
+    db = get_async_firestore_client()
+    snap = await db.collection(JOBS_COLLECTION).document(_job_doc_id(job_id)).get()
+    return snap.to_dict() if snap.exists else None
+
+
+async def start_job(
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    services: Optional[List[str]] = None,
+    dry_run: bool = False,
+) -> str:
+    """Create the checkpoint for a new recalculation job and return its ID."""
+    job_id = uuid.uuid4().hex
+    db = get_async_firestore_client()
+    await db.collection(JOBS_COLLECTION).document(_job_doc_id(job_id)).set(
+        {
+            "job_id": job_id,
+            "type": "incentive_recalculation",
+            "status": "pending",
+            "dry_run": dry_run,
+            "from": from_date.isoformat() if from_date else None,
+            "to": to_date.isoformat() if to_date else None,
+            "services": sorted(services) if services else None,
+            "cursor": None,
+            "processed": 0,
+            "changed": 0,
+            "skipped_unknown_service": 0,
+            "old_total": 0.0,
+            "new_total": 0.0,
+            "by_service": {},
+            "samples": [],
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+    )
+    return job_id
+
+
+async def _read_current(
+    db: Any, payments: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    """Read the incentives of a page and return what the page's writes must be based on.
+
+    A payment and its incentive are always written in one batch, and the
+    incentive keeps a copy of the payment fields its amount depends on.  The
+    incentive's copy is used, and the write is conditioned on the incentive's
+    update time, so a payment edited after it was listed makes the commit
+    fail instead of being overwritten with a stale amount.  Payments without
+    an incentive are re-read and conditioned on their own update time.
+
+    Returns:
+        The current payments (without those deleted since they were listed),
+        the stored incentives by payment ID, and a write precondition per
+        payment ID.
+    """
+    incentives_collection = db.collection(INCENTIVES_COLLECTION)
+    refs = [incentives_collection.document(payment["id"]) for payment in payments]
+    snaps = {snap.id: snap async for snap in db.get_all(refs) if snap.exists}
+    current: Dict[str, Dict[str, Any]] = {}
+    incentives: Dict[str, Dict[str, Any]] = {}
+    preconditions: Dict[str, Any] = {}
+    for payment in payments:
+        snap = snaps.get(payment["id"])
+        if snap is None:
+            continue
+        incentive = incentives[snap.id] = snap.to_dict()
+        preconditions[snap.id] = db.write_option(last_update_time=snap.update_time)
+        current[snap.id] = {**payment, **{name: incentive[name] for name in _PAYMENT_FIELDS if name in incentive}}
+    missing = [db.collection(PAYMENTS_COLLECTION).document(p["id"]) for p in payments if p["id"] not in snaps]
+    if missing:
+        async for snap in db.get_all(missing):
+            if snap.exists:
+                preconditions[snap.id] = db.write_option(last_update_time=snap.update_time)
+                current[snap.id] = {"id": snap.id, **{name: snap.get(name) for name in _PAYMENT_FIELDS}}
+    return [current[p["id"]] for p in payments if p["id"] in current], incentives, preconditions
+
+
+def _diff_page(
+    payments: List[Dict[str, Any]],
+    incentives: Dict[str, Dict[str, Any]],
+    base_by_service: Dict[str, float],
+    global_percent: float,
+    services: Optional[List[str]],
+) -> Dict[str, Any]:
+    """Compute the incentive changes for one page of payments."""
+    # Imported on first use: the API imports this module for its endpoints,
+    # and NumPy would otherwise add to every cold start.
+    import numpy as np
+
+    if services:
+        payments = [p for p in payments if p["service"] in services]
+    known = np.array([p["service"] in base_by_service for p in payments], dtype=bool)
+    payments = [p for p, ok in zip(payments, known) if ok]
+    skipped = int((~known).sum())
+    if not payments:
+        return {"changes": [], "skipped": skipped}
+
+    amounts = np.array([float(p["amount_paid"]) for p in payments])
+    bases = np.array([base_by_service[p["service"]] for p in payments])
+    stored = [incentives.get(p["id"], {}) for p in payments]
+    old_amounts = np.array([float(i.get("incentive_amount", np.nan)) for i in stored])
+    old_bases = np.array([float(i.get("base_percent", np.nan)) for i in stored])
+    old_globals = np.array([float(i.get("global_percent", np.nan)) for i in stored])
+
+    new_amounts = compute_incentive_amounts(amounts, bases, global_percent)
+    changed = (
+        np.isnan(old_amounts)
+        | (np.abs(new_amounts - old_amounts) >= 0.005)
+        | (old_bases != bases)
+        | (old_globals != global_percent)
+    )
+
+    changes = []
+    for index in np.flatnonzero(changed):
+        payment = payments[index]
+        old = 0.0 if np.isnan(old_amounts[index]) else float(old_amounts[index])
+        changes.append(
+            {
+                "payment": payment,
+                "base_percent": float(bases[index]),
+                "old_amount": old,
+                "new_amount": float(new_amounts[index]),
+            }
+        )
+    return {"changes": changes, "skipped": skipped}
+
+
+def _summary_update(job: Dict[str, Any], page_size: int, diff: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold a page diff into the running job summary."""
+    by_service: Dict[str, Dict[str, float]] = {k: dict(v) for k, v in (job.get("by_service") or {}).items()}
+    samples = list(job.get("samples") or [])
+    old_total = new_total = 0.0
+    for change in diff["changes"]:
+        service = change["payment"]["service"]
+        totals = by_service.setdefault(service, {"changed": 0, "delta": 0.0})
+        totals["changed"] += 1
+        totals["delta"] = round(totals["delta"] + change["new_amount"] - change["old_amount"], 2)
+        old_total += change["old_amount"]
+        new_total += change["new_amount"]
+        if len(samples) < MAX_SAMPLES:
+            samples.append(
+                {
+                    "payment_id": change["payment"]["id"],
+                    "service": service,
+                    "old_amount": change["old_amount"],
+                    "new_amount": change["new_amount"],
+                }
+            )
+    return {
+        "processed": job.get("processed", 0) + page_size,
+        "changed": job.get("changed", 0) + len(diff["changes"]),
+        "skipped_unknown_service": job.get("skipped_unknown_service", 0) + diff["skipped"],
+        "old_total": round(job.get("old_total", 0.0) + old_total, 2),
+        "new_total": round(job.get("new_total", 0.0) + new_total, 2),
+        "by_service": by_service,
+        "samples": samples,
+    }
+
+
+async def run_job(job_id: str) -> Dict[str, Any]:
+    """Run (or resume) a recalculation job until every page is processed.
+
+    Returns:
+        The final checkpoint document.
+
+    Raises:
+        KeyError: If the job does not exist.
+    """
+    db = get_async_firestore_client()
+    job_ref = db.collection(JOBS_COLLECTION).document(_job_doc_id(job_id))
+    job = await get_job(job_id)
+    if job is None:
+        raise KeyError(job_id)
+    if job["status"] == "completed":
+        return job
+
+    # Always recalculate against the latest percentages, not a cached copy.
+    master = await get_master_data(max_age=0)
+    base_by_service = master.base_percents
+    global_percent = master.global_percent
+    from_date = date.fromisoformat(job["from"]) if job.get("from") else None
+    to_date = date.fromisoformat(job["to"]) if job.get("to") else None
+    services = job.get("services")
+    service_filter = services[0] if services and len(services) == 1 else None
+    incentives_collection = db.collection(INCENTIVES_COLLECTION)
+
+    await job_ref.update({"status": "running", "updated_at": firestore.SERVER_TIMESTAMP})
+    try:
+        cursor = job.get("cursor")
+        attempts = 0
+        while True:
+            listed, next_cursor = await list_payments(
+                None, from_date, to_date, service_filter, None, cursor, PAGE_SIZE, _PAYMENT_FIELDS
+            )
+            if not listed:
+                break
+            payments, incentives, preconditions = await _read_current(db, listed)
+            diff = _diff_page(payments, incentives, base_by_service, global_percent, services)
+            summary = _summary_update(job, len(listed), diff)
+            checkpoint = {
+                **summary,
+                "cursor": next_cursor,
+                "status": "running" if next_cursor else "completed",
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            }
+
+            operations = []
+            if not job.get("dry_run"):
+                rollup_deltas: Dict[str, float] = defaultdict(float)
+                stale_statements: Dict[Tuple[str, str], str] = {}
+                for change in diff["changes"]:
+                    payment = change["payment"]
+                    incentive = {
+                        "payment_id": payment["id"],
+                        "uid": payment["uid"],
+                        "date": payment["date"],
+                        "service": payment["service"],
+                        "amount_paid": float(payment["amount_paid"]),
+                        "base_percent": change["base_percent"],
+                        "global_percent": global_percent,
+                        "incentive_amount": change["new_amount"],
+                        "updated_at": firestore.SERVER_TIMESTAMP,
+                    }
+                    ref = incentives_collection.document(payment["id"])
+                    unchanged = preconditions[payment["id"]]
+                    if payment["id"] in incentives:
+                        operations.append(
+                            lambda batch, ref=ref, data=incentive, option=unchanged: batch.update(
+                                ref, data, option=option
+                            )
+                        )
+                    else:
+                        operations.append(lambda batch, ref=ref, data=incentive: batch.create(ref, data))
+                        # Rewrites an unchanged field: only fails if the payment changed.
+                        payment_ref = db.collection(PAYMENTS_COLLECTION).document(payment["id"])
+                        operations.append(
+                            lambda batch, ref=payment_ref, uid=payment["uid"], option=unchanged: batch.update(
+                                ref, {"uid": uid}, option=option
+                            )
+                        )
+                    for scope in rollups.stored_scopes_for(payment["uid"], payment.get("team_uid")):
+                        rollup_deltas[rollups.rollup_doc_id(scope, payment["date"])] += (
+                            change["new_amount"] - change["old_amount"]
+                        )
+                    stale_statements[payment["uid"], payment["date"][:7]] = payment["date"]
+                operations += [
+                    lambda batch, ref=db.collection(rollups.ROLLUPS_COLLECTION).document(doc_id), delta=delta: (
+                        batch.set(ref, {"incentives": {"amount": firestore.Increment(delta)}}, merge=True)
+                    )
+                    for doc_id, delta in rollup_deltas.items()
+                    if delta
+                ]
+                operations += [
+                    lambda batch, uid=uid, day=day: statements.mark_stale(batch, db, uid, day)
+                    for (uid, _), day in sorted(stale_statements.items())
+                ]
+                if diff["changes"]:
+                    operations.append(lambda batch: versions.bump(batch, db, [versions.GLOBAL_SCOPE]))
+            operations.append(lambda batch: batch.update(job_ref, checkpoint))
+            try:
+                await commit_in_chunks(db, operations)
+            except (exceptions.FailedPrecondition, exceptions.AlreadyExists, exceptions.NotFound):
+                # A payment on the page changed since it was read: read the page again.
+                attempts += 1
+                if attempts >= MAX_PAGE_ATTEMPTS:
+                    raise
+                continue
+            attempts = 0
+            if not job.get("dry_run"):
+                for change in diff["changes"]:
+                    payment = change["payment"]
+                    events.publish(
+                        "incentive",
+                        payment["uid"],
+                        payment.get("team_uid"),
+                        {
+                            "payment_id": payment["id"],
+                            "date": payment["date"],
+                            "incentive_amount": change["new_amount"],
+                            "delta": {"amount": round(change["new_amount"] - change["old_amount"], 2)},
+                        },
+                    )
+
+            job.update(summary, cursor=next_cursor)
+            cursor = next_cursor
+            if not cursor:
+                break
+        await job_ref.update({"status": "completed", "cursor": None, "updated_at": firestore.SERVER_TIMESTAMP})
+    except Exception as exc:
+        await job_ref.update({"status": "failed", "error": str(exc), "updated_at": firestore.SERVER_TIMESTAMP})
+        raise
+    return await get_job(job_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recalculate incentives from the current master percentages.")
+    parser.add_argument("--from", dest="from_date", type=date.fromisoformat)
+    parser.add_argument("--to", dest="to_date", type=date.fromisoformat)
+    parser.add_argument("--service", dest="services", action="append", help="Limit to a service (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--resume", metavar="JOB_ID", help="Resume an interrupted job from its checkpoint")
+    args = parser.parse_args()
+
+    async def run() -> Dict[str, Any]:
+        job_id = args.resume or await start_job(args.from_date, args.to_date, args.services, args.dry_run)
+        return await run_job(job_id)
+
+    print(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,81 @@ This module constructs the FastAPI application, configures CORS, and
 registers all API routers.  The authentication dependency provided in
 `app.auth` ensures that every request is accompanied by a valid Firebase
 identity token.
+
+For local development and load tests the app can run entirely in-process:
+`DATA_BACKEND=memory` swaps Firestore for `app.fakes.InMemoryFirestore` and
+`AUTH_BACKEND=fake` accepts `<uid>` or `<uid>:<ROLE>` as bearer tokens.
+
+Startup is kept short for Cloud Run: heavy SDKs that are not needed to build
+the app are imported lazily, and the lifespan hook runs `app.warmup` so the
+first request does not pay for credential loading or connection setup.
 """
 
 from __future__ import annotations
 
-from fastapi import FastAPI
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from . import admission, auth, firestore, warmup
+from .events import change_feed
+from .metrics import MetricsMiddleware, registry
+from .routers import users, calls, payments, incentives, analytics, whatsapp, events, imports
+from .services import analytics_store, calls as call_service
+
 
-from .routers import users, calls, payments, incentives, analytics, whatsapp
+def create_app(
+    firestore_client: Optional[Any] = None,
+    token_verifier: Optional[Callable[[str], Dict[str, Any]]] = None,
+    admission_control: Optional[bool] = None,
+) -> FastAPI:
+    """Create and configure the FastAPI application.
 
+    Args:
+        firestore_client: Async Firestore client to use instead of the default
+            one.  Defaults to an in-memory store when `DATA_BACKEND=memory`.
+        token_verifier: Blocking callable used to verify ID tokens instead of
+            Firebase.  Defaults to a fake verifier when `AUTH_BACKEND=fake`.
+        admission_control: Whether to apply rate limits and the cap on
+            expensive requests (see `app.admission`).  Defaults to on unless
+            `ADMISSION_CONTROL=off`.
+    """
+    if firestore_client is None and os.getenv("DATA_BACKEND") == "memory":
+        from .fakes import InMemoryFirestore
 
-def create_app() -> FastAPI:
-    """Create and configure the FastAPI application."""
-    app = FastAPI(title="Performance Tracker API", version="0.1.0")
+        firestore_client = InMemoryFirestore()
+    if token_verifier is None and os.getenv("AUTH_BACKEND") == "fake":
+        from .fakes import FakeTokenVerifier
 
+        token_verifier = FakeTokenVerifier()
+    if firestore_client is not None:
+        firestore.use_firestore_client(firestore_client)
+    if token_verifier is not None:
+        auth.use_token_verifier(token_verifier)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        # Warm credentials, the Firestore channel and signing keys before the
+        # server starts accepting requests, so cold starts do not hit users.
+        app.state.warmup = await warmup.warm_up() if warmup.WARMUP_ON_STARTUP else {}
+        change_feed.start()
+        yield
+        # Write buffered call entries before the instance goes away.
+        await call_service.write_buffer.close()
+        change_feed.stop()
+        await analytics_store.store.close()
+
+    app = FastAPI(title="Performance Tracker API", version="0.1.0", lifespan=lifespan)
+
+    if admission_control is None:
+        admission_control = admission.ADMISSION_CONTROL
+    if admission_control:
+        # Added first so it runs inside CORS and 429 responses carry CORS headers
+        app.add_middleware(admission.AdmissionMiddleware)
     # CORS configuration – adjust origins as needed for the Next.js front‑end
     app.add_middleware(
         CORSMiddleware,
@@ -26,12 +87,28 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    # Added last so it is outermost and times the whole request
+    app.add_middleware(MetricsMiddleware)
 
     # Health check endpoint
     @app.get("/", summary="Health check")
     async def root() -> dict[str, str]:
         return {"status": "ok"}
 
+    # Prometheus scrape endpoint; protected by a bearer token when METRICS_TOKEN is set
+    @app.get("/metrics", summary="Prometheus metrics", include_in_schema=False)
+    async def metrics(request: Request) -> PlainTextResponse:
+        token = os.getenv("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/admission/stats", summary="Rate limiting statistics (admin only)")
+    async def admission_stats(current_user: Dict[str, Any] = Depends(auth.get_current_user)) -> Dict[str, Any]:
+        if current_user.get("role") != "ADMIN":
+            raise HTTPException(status_code=403, detail="Only admins can view admission statistics")
+        return {"status": "success", "admission": admission.admission.stats()}
+
     # Register API routers
     app.include_router(users.router)
     app.include_router(calls.router)
@@ -39,6 +116,8 @@ def create_app() -> FastAPI:
     app.include_router(incentives.router)
     app.include_router(analytics.router)
     app.include_router(whatsapp.router)
+    app.include_router(events.router)
+    app.include_router(imports.router)
 
     return app
 
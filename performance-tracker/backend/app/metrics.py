@@ -0,0 +1,486 @@
+"""Request and Firestore metrics in Prometheus text format.
+
+`MetricsMiddleware` records, for every HTTP request, a latency histogram and a
+status-code counter labelled by method and route template, plus a gauge of
+requests in flight.  It also opens a per-request `RequestStats` in a context
+variable, which the instrumented Firestore client (`InstrumentedFirestore`,
+installed by `app.firestore.get_async_firestore_client`) fills with the reads,
+writes, queries and round-trip time the request caused.  Those are folded
+into per-route Firestore counters when the request finishes, so `/metrics`
+shows which endpoints drive the Firestore bill.
+
+Requests slower than `SLOW_REQUEST_MS` (disabled when unset) are logged with
+their per-operation Firestore breakdown.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests taking at least this long are logged with a Firestore breakdown.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+# Route label used for Firestore work done outside any HTTP request.
+NO_ROUTE = "none"
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds."""
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Return `(le, cumulative count)` pairs including `+Inf`."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return pairs
+
+
+class RequestStats:
+    """Firestore work attributed to one request."""
+
+    __slots__ = ("scope", "reads", "writes", "queries", "round_trips", "seconds", "by_op")
+
+    def __init__(self, scope: Optional[Dict[str, Any]] = None) -> None:
+        self.scope = scope
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.round_trips = 0
+        self.seconds = 0.0
+        # op -> [calls, seconds]
+        self.by_op: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+
+    def record(self, op: str, seconds: float, reads: int = 0, writes: int = 0, queries: int = 0) -> None:
+        self.reads += reads
+        self.writes += writes
+        self.queries += queries
+        self.round_trips += 1
+        self.seconds += seconds
+        entry = self.by_op[op]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        return {op: {"calls": int(calls), "ms": round(seconds * 1000, 2)} for op, (calls, seconds) in self.by_op.items()}
+
+
+_current_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+class MetricsRegistry:
+    """Process-wide metric store rendered by `/metrics`."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests: Dict[Tuple[str, str, str], int] = defaultdict(int)
+            self.latency: Dict[Tuple[str, str], Histogram] = {}
+            self.in_flight = 0
+            self.firestore: Dict[Tuple[str, str], float] = defaultdict(float)
+            self.firestore_latency: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float) -> None:
+        with self._lock:
+            self.requests[(method, route, str(status))] += 1
+            histogram = self.latency.get((method, route))
+            if histogram is None:
+                histogram = self.latency[(method, route)] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_firestore(self, route: str, stats: RequestStats) -> None:
+        with self._lock:
+            self.firestore[(route, "reads")] += stats.reads
+            self.firestore[(route, "writes")] += stats.writes
+            self.firestore[(route, "queries")] += stats.queries
+            self.firestore[(route, "round_trips")] += stats.round_trips
+            self.firestore[(route, "seconds")] += stats.seconds
+
+    def observe_firestore_op(self, route: str, op: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.firestore_latency.get((route, op))
+            if histogram is None:
+                histogram = self.firestore_latency[(route, op)] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            lines += [
+                "# HELP http_requests_total HTTP requests by method, route and status.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+            lines += [
+                "# HELP http_request_duration_seconds HTTP request latency by method and route.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (method, route), histogram in sorted(self.latency.items()):
+                lines += _histogram_lines("http_request_duration_seconds", histogram, method=method, route=route)
+            lines += [
+                "# HELP http_requests_in_flight HTTP requests currently being served.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+            ]
+            for kind, help_text in (
+                ("reads", "Firestore document reads (as billed)"),
+                ("writes", "Firestore document writes"),
+                ("queries", "Firestore queries run"),
+                ("round_trips", "Firestore round trips"),
+                ("seconds", "Seconds spent waiting on Firestore"),
+            ):
+                name = f"firestore_{kind}_total"
+                lines += [f"# HELP {name} {help_text} by route.", f"# TYPE {name} counter"]
+                for (route, metric), value in sorted(self.firestore.items()):
+                    if metric == kind:
+                        rendered = repr(round(value, 6)) if kind == "seconds" else str(int(value))
+                        lines.append(f"{name}{_labels(route=route)} {rendered}")
+            lines += [
+                "# HELP firestore_operation_duration_seconds Firestore round-trip time by route and operation.",
+                "# TYPE firestore_operation_duration_seconds histogram",
+            ]
+            for (route, op), histogram in sorted(self.firestore_latency.items()):
+                lines += _histogram_lines("firestore_operation_duration_seconds", histogram, route=route, op=op)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, histogram: Histogram, **labels: str) -> List[str]:
+    lines = [f"{name}_bucket{_labels(**labels, le=le)} {count}" for le, count in histogram.cumulative()]
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum!r}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+
+registry = MetricsRegistry()
+
+
+def _route_label(scope: Dict[str, Any]) -> str:
+    """Return the route template matched for `scope`, once routing has run."""
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+def record_firestore_op(op: str, seconds: float, reads: int = 0, writes: int = 0, queries: int = 0) -> None:
+    """Attribute one Firestore round trip to the current request, if any."""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(op, seconds, reads=reads, writes=writes, queries=queries)
+        registry.observe_firestore_op(_route_label(stats.scope), op, seconds)
+        return
+    # Work outside a request (jobs, CLI tools) is counted straight away.
+    stats = RequestStats()
+    stats.record(op, seconds, reads=reads, writes=writes, queries=queries)
+    registry.observe_firestore(NO_ROUTE, stats)
+    registry.observe_firestore_op(NO_ROUTE, op, seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency, status and Firestore usage.
+
+    Implemented as plain ASGI rather than `BaseHTTPMiddleware` so that
+    streaming responses are timed to their last byte and the per-request
+    context variable is visible to the endpoint and its background tasks.
+    """
+
+    def __init__(self, app: Any, exclude_paths: Iterable[str] = ("/metrics",)) -> None:
+        self.app = app
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope.get("path") in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current_stats.set(stats)
+        status = 500
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with registry._lock:
+            registry.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_stats.reset(token)
+            with registry._lock:
+                registry.in_flight -= 1
+            route = _route_label(scope)
+            method = scope.get("method", "")
+            registry.observe_request(method, route, status, elapsed)
+            registry.observe_firestore(route, stats)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(
+                    "slow request %s %s status=%s duration_ms=%.1f firestore_ms=%.1f reads=%d writes=%d "
+                    "queries=%d round_trips=%d breakdown=%s",
+                    method,
+                    route,
+                    status,
+                    elapsed * 1000,
+                    stats.seconds * 1000,
+                    stats.reads,
+                    stats.writes,
+                    stats.queries,
+                    stats.round_trips,
+                    stats.breakdown(),
+                )
+
+
+# ---------------------------------------------------------------------------
+# Instrumented Firestore client
+# ---------------------------------------------------------------------------
+
+
+class _Proxy:
+    """Delegate every attribute not overridden to the wrapped SDK object."""
+
+    __slots__ = ("_target",)
+
+    def __init__(self, target: Any) -> None:
+        self._target = target
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+
+def _unwrap(value: Any) -> Any:
+    """Return the SDK object behind a proxy, also inside lists and tuples."""
+    if isinstance(value, _Proxy):
+        return value._target
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(item) for item in value)
+    return value
+
+
+def _unwrap_all(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    return [_unwrap(arg) for arg in args], {key: _unwrap(value) for key, value in kwargs.items()}
+
+
+async def _timed_stream(op: str, iterator: Any, queries: int) -> Any:
+    """Re-yield `iterator`, timing only the waits on Firestore and counting documents."""
+    reads = 0
+    seconds = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                snapshot = await iterator.__anext__()
+            except StopAsyncIteration:
+                seconds += time.perf_counter() - started
+                break
+            seconds += time.perf_counter() - started
+            reads += 1
+            yield snapshot
+    finally:
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+        # A query that matches nothing is still billed one read.
+        record_firestore_op(op, seconds, reads=max(reads, queries), queries=queries)
+
+
+class _QueryProxy(_Proxy):
+    __slots__ = ()
+
+    def _chain(self, name: str, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        if args and isinstance(args[0], dict):
+            args = ({key: _unwrap(value) for key, value in args[0].items()},) + args[1:]
+        args, kwargs = _unwrap_all(args, kwargs)
+        return _QueryProxy(getattr(self._target, name)(*args, **kwargs))
+
+    def where(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("where", *args, **kwargs)
+
+    def order_by(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("order_by", *args, **kwargs)
+
+    def select(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("select", *args, **kwargs)
+
+    def limit(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("limit", *args, **kwargs)
+
+    def offset(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("offset", *args, **kwargs)
+
+    def start_at(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("start_at", *args, **kwargs)
+
+    def start_after(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("start_after", *args, **kwargs)
+
+    def end_at(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("end_at", *args, **kwargs)
+
+    def end_before(self, *args: Any, **kwargs: Any) -> "_QueryProxy":
+        return self._chain("end_before", *args, **kwargs)
+
+    def document(self, *args: Any) -> "_DocumentProxy":
+        return _DocumentProxy(self._target.document(*args))
+
+    def stream(self, *args: Any, **kwargs: Any) -> Any:
+        args, kwargs = _unwrap_all(args, kwargs)
+        return _timed_stream("query", self._target.stream(*args, **kwargs), queries=1)
+
+    async def get(self, *args: Any, **kwargs: Any) -> List[Any]:
+        return [snapshot async for snapshot in self.stream(*args, **kwargs)]
+
+
+class _DocumentProxy(_Proxy):
+    __slots__ = ()
+
+    async def _call(self, op: str, name: str, *args: Any, **kwargs: Any) -> Any:
+        args, kwargs = _unwrap_all(args, kwargs)
+        started = time.perf_counter()
+        try:
+            return await getattr(self._target, name)(*args, **kwargs)
+        finally:
+            reads, writes = (1, 0) if op == "get" else (0, 1)
+            record_firestore_op(op, time.perf_counter() - started, reads=reads, writes=writes)
+
+    async def get(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("get", "get", *args, **kwargs)
+
+    async def set(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("write", "set", *args, **kwargs)
+
+    async def create(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("write", "create", *args, **kwargs)
+
+    async def update(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("write", "update", *args, **kwargs)
+
+    async def delete(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("write", "delete", *args, **kwargs)
+
+    def collection(self, *args: Any) -> _QueryProxy:
+        return _QueryProxy(self._target.collection(*args))
+
+
+class _BatchProxy(_Proxy):
+    __slots__ = ()
+
+    def set(self, *args: Any, **kwargs: Any) -> Any:
+        args, kwargs = _unwrap_all(args, kwargs)
+        return self._target.set(*args, **kwargs)
+
+    def create(self, *args: Any, **kwargs: Any) -> Any:
+        args, kwargs = _unwrap_all(args, kwargs)
+        return self._target.create(*args, **kwargs)
+
+    def update(self, *args: Any, **kwargs: Any) -> Any:
+        args, kwargs = _unwrap_all(args, kwargs)
+        return self._target.update(*args, **kwargs)
+
+    def delete(self, *args: Any, **kwargs: Any) -> Any:
+        args, kwargs = _unwrap_all(args, kwargs)
+        return self._target.delete(*args, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self._target)
+
+    async def _timed_commit(self, op: str, method: str, *args: Any, **kwargs: Any) -> Any:
+        writes = len(self._target)
+        started = time.perf_counter()
+        try:
+            return await getattr(self._target, method)(*args, **kwargs)
+        finally:
+            record_firestore_op(op, time.perf_counter() - started, writes=writes)
+
+    async def commit(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._timed_commit("commit", "commit", *args, **kwargs)
+
+
+class _TransactionProxy(_BatchProxy):
+    """Transaction proxy; `firestore.async_transactional` drives the private hooks."""
+
+    __slots__ = ()
+
+    async def _begin(self, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await self._target._begin(*args, **kwargs)
+        finally:
+            record_firestore_op("begin_transaction", time.perf_counter() - started)
+
+    async def _commit(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._timed_commit("commit", "_commit", *args, **kwargs)
+
+    async def _rollback(self, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await self._target._rollback(*args, **kwargs)
+        finally:
+            record_firestore_op("rollback", time.perf_counter() - started)
+
+
+class InstrumentedFirestore(_Proxy):
+    """Wrap an async Firestore client so every round trip is timed and counted.
+
+    Collections, queries, documents, batches and transactions obtained from
+    the wrapper are wrapped too; anything else is passed straight through.
+    """
+
+    __slots__ = ()
+
+    def collection(self, *args: Any) -> _QueryProxy:
+        return _QueryProxy(self._target.collection(*args))
+
+    def collection_group(self, *args: Any) -> _QueryProxy:
+        return _QueryProxy(self._target.collection_group(*args))
+
+    def document(self, *args: Any) -> _DocumentProxy:
+        return _DocumentProxy(self._target.document(*args))
+
+    def batch(self) -> _BatchProxy:
+        return _BatchProxy(self._target.batch())
+
+    def transaction(self, *args: Any, **kwargs: Any) -> _TransactionProxy:
+        return _TransactionProxy(self._target.transaction(*args, **kwargs))
+
+    def get_all(self, references: Iterable[Any], *args: Any, **kwargs: Any) -> Any:
+        args, kwargs = _unwrap_all(args, kwargs)
+        references = [_unwrap(reference) for reference in references]
+        return _timed_stream("get_all", self._target.get_all(references, *args, **kwargs), queries=0)
@@ -7,7 +7,7 @@ updating records as well as response models returned by the API.
 
 from __future__ import annotations
 
-from datetime import date
+import datetime
 from typing import List, Optional
 
 from pydantic import BaseModel, Field, constr
@@ -26,7 +26,7 @@ class Demo(BaseModel):
 class CallEntry(BaseModel):
     """Represents a daily call entry for an employee."""
 
-    date: date = Field(..., description="Date of the calls entry (YYYY‑MM‑DD)")
+    date: datetime.date = Field(..., description="Date of the calls entry (YYYY‑MM‑DD)")
     answered_calls: int = Field(..., ge=0, description="Number of calls answered")
     unanswered_calls: int = Field(..., ge=0, description="Number of calls unanswered")
     total_call_time_minutes: int = Field(..., ge=0, description="Total call time in minutes")
@@ -34,18 +34,18 @@ class CallEntry(BaseModel):
 
     class Config:
         # Allow population by field name for nested objects
-        orm_mode = True
+        from_attributes = True
 
 
 class Payment(BaseModel):
     """Represents a payment entry."""
 
-    date: date = Field(..., description="Date of the payment (YYYY‑MM‑DD)")
+    date: datetime.date = Field(..., description="Date of the payment (YYYY‑MM‑DD)")
     customer_name: str = Field(..., description="Name of the customer")
     mobile: str = Field(..., description="Customer's mobile number")
     organization_name: Optional[str] = Field(None, description="Name of the customer's organisation")
     customer_type: constr(to_lower=True) = Field(
-        ..., regex="^(new|repeat)$", description="Indicates whether the customer is new or repeat"
+        ..., pattern="^(new|repeat)$", description="Indicates whether the customer is new or repeat"
     )
     service: str = Field(..., description="Service taken (WhatsApp API, RCS, Bulk SMS, Voice Calls, Email)")
     product_type: str = Field(..., description="Product type (same as service for now)")
@@ -60,7 +60,7 @@ class Incentive(BaseModel):
     """Represents an incentive derived from a payment."""
 
     payment_id: str = Field(..., description="Identifier of the corresponding payment")
-    date: date = Field(..., description="Date of the payment (same as the payment date)")
+    date: datetime.date = Field(..., description="Date of the payment (same as the payment date)")
     service: str = Field(..., description="Service that generated the incentive")
     amount_paid: float = Field(..., gt=0, description="Amount paid that triggers the incentive")
     base_percent: float = Field(..., gt=0, description="Service‑specific base percentage")
@@ -0,0 +1,113 @@
+"""Keyset pagination and field projection for list endpoints.
+
+List queries are ordered by `date` and then by document ID, and a page is
+continued from the last `(date, id)` pair returned rather than by offset, so
+fetching page N costs the same as fetching page 1.  The pair is handed to the
+client as an opaque, URL-safe `next_cursor` token.
+
+When the caller's scope spans more employees than a single Firestore `in`
+filter accepts, one query is issued per chunk of UIDs with the same cursor.
+The queries run concurrently and, since each returns its documents already
+in `(date, id)` order, their results are combined with a k-way merge that
+stops as soon as the page is full.  This yields exactly the same page as a
+single query would.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import heapq
+import itertools
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from .firestore import stream_concurrently, uid_queries
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(day: str, doc_id: str) -> str:
+    """Return an opaque cursor token for the position after `(day, doc_id)`."""
+    raw = json.dumps([day, doc_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor token produced by `encode_cursor`.
+
+    Raises:
+        HTTPException: If the token is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        day, doc_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+    if not isinstance(day, str) or not isinstance(doc_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return day, doc_id
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """Parse a comma-separated `fields=` parameter.
+
+    Returns:
+        The requested fields (always including `date`, which pagination
+        needs), or `None` when no projection was requested.
+
+    Raises:
+        HTTPException: If an unknown field is requested.
+    """
+    if not fields:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = sorted(set(requested) - set(allowed))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(["date", *requested]))
+
+
+async def fetch_page(
+    collection: Any,
+    base_query: Any,
+    uids: Optional[Sequence[str]],
+    cursor: Optional[str],
+    limit: int,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Fetch one page of documents ordered by `(date, id)`.
+
+    Args:
+        collection: Collection reference the query runs against.
+        base_query: Query with all filters except the UID filter applied.
+        uids: Employee UIDs to restrict to, or `None` for no restriction.
+        cursor: Token returned as `next_cursor` by the previous page.
+        limit: Page size.
+        fields: Fields to project, or `None` for whole documents.
+
+    Returns:
+        The page of documents (each with its `id`) and the cursor for the next
+        page, or `None` when there are no further results.
+    """
+    query = base_query.order_by("date").order_by(FieldPath.document_id())
+    if fields is not None:
+        query = query.select(fields)
+    if cursor:
+        day, doc_id = decode_cursor(cursor)
+        query = query.start_after({"date": day, FieldPath.document_id(): collection.document(doc_id)})
+    query = query.limit(limit + 1)
+
+    results = await stream_concurrently(uid_queries(query, uids))
+    merged = heapq.merge(*results, key=lambda snap: (snap.get("date"), snap.id))
+    items = [{"id": snap.id, **snap.to_dict()} for snap in itertools.islice(merged, limit + 1)]
+
+    if len(items) <= limit:
+        return items, None
+    page = items[:limit]
+    return page, encode_cursor(page[-1]["date"], page[-1]["id"])
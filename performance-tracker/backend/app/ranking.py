@@ -0,0 +1,91 @@
+"""Top-K ranking helpers.
+
+These helpers merge several score buckets (for example revenue per customer
+for each month) and return the K highest combined scores without summing
+every key, and split date ranges into whole-month buckets.  They have no
+external dependencies so that they can be used by both the services and the
+benchmarks.
+"""
+
+from __future__ import annotations
+
+import heapq
+from datetime import date, timedelta
+from typing import Dict, List, Sequence, Tuple
+
+
+Bucket = Dict[str, float]
+SortedBucket = List[Tuple[str, float]]
+
+
+def sort_bucket(bucket: Bucket) -> SortedBucket:
+    """Return the positive entries of `bucket` sorted by descending score."""
+    return sorted(((key, score) for key, score in bucket.items() if score > 0), key=lambda kv: kv[1], reverse=True)
+
+
+def top_k_merge(buckets: Sequence[Tuple[Bucket, SortedBucket]], k: int) -> List[Tuple[str, float]]:
+    """Return the `k` keys with the highest total score across `buckets`.
+
+    Uses Fagin's threshold algorithm: the pre-sorted buckets are scanned in
+    lockstep and each newly seen key is scored exactly by looking it up in
+    every bucket.  Scanning stops as soon as the K-th best total is at least
+    the sum of the scores at the current depth, which no unseen key can beat.
+    Scores must be non-negative.
+
+    Args:
+        buckets: Pairs of (scores by key, the same scores sorted descending).
+        k: Number of results to return.
+
+    Returns:
+        Up to `k` `(key, total)` pairs ordered by descending total.
+    """
+    if k <= 0 or not buckets:
+        return []
+    if len(buckets) == 1:
+        return list(buckets[0][1][:k])
+
+    heap: List[Tuple[float, str]] = []
+    seen = set()
+    depth = 0
+    while True:
+        threshold = 0.0
+        exhausted = True
+        for _, ordered in buckets:
+            if depth >= len(ordered):
+                continue
+            exhausted = False
+            key, score = ordered[depth]
+            threshold += score
+            if key in seen:
+                continue
+            seen.add(key)
+            total = sum(scores.get(key, 0.0) for scores, _ in buckets)
+            if len(heap) < k:
+                heapq.heappush(heap, (total, key))
+            elif total > heap[0][0]:
+                heapq.heapreplace(heap, (total, key))
+        depth += 1
+        if exhausted or (len(heap) == k and heap[0][0] >= threshold):
+            break
+    return [(key, total) for total, key in sorted(heap, reverse=True)]
+
+
+def split_range(from_date: date, to_date: date) -> Tuple[List[str], List[Tuple[date, date]]]:
+    """Split a date range into whole months and partial-month edge ranges.
+
+    Returns:
+        The `YYYY-MM` keys of months fully covered by the range, and the
+        `(start, end)` date ranges that only partly cover a month.
+    """
+    months: List[str] = []
+    partial: List[Tuple[date, date]] = []
+    cursor = from_date
+    while cursor <= to_date:
+        next_month = (cursor.replace(day=28) + timedelta(days=4)).replace(day=1)
+        end = min(to_date, next_month - timedelta(days=1))
+        if cursor.day == 1 and end == next_month - timedelta(days=1):
+            months.append(cursor.strftime("%Y-%m"))
+        else:
+            partial.append((cursor, end))
+        cursor = next_month
+    return months, partial
@@ -1,71 +1,239 @@
 """Analytics endpoints.
 
 This router provides aggregated reporting endpoints used by the dashboards.
-The endpoints are protected and return stubbed responses; actual
-implementations would perform Firestore queries and aggregations or export
-data to BigQuery for analysis.
+The overview is served from the pre-aggregated daily rollups maintained by the
+call and payment write paths (see `app.services.rollups`) and the top
+customers from the monthly customer revenue index (see
+`app.services.customer_revenue`).  Trends are bucketed from the same daily
+rollups (see `app.services.trends`).  With `ANALYTICS_ENGINE=duckdb` all three
+are answered by SQL over an embedded mirror of the raw data instead (see
+`app.services.analytics_store`).  The conversion funnel reads only the demo
+index (see `app.services.demo_index`).
+
+Served from the rollups, the overview, trends and top customers carry ETags
+and are cached per scope version (see `app.conditional`), so an unchanged
+dashboard costs one version read.
 """
 
 from __future__ import annotations
 
-from datetime import date
-from typing import Any, Dict, Optional
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
 
-from ..auth import get_current_user
+from .. import conditional
+from ..auth import get_current_user, get_user_profile
+from ..jobs.rebuild_rollups import rebuild_rollups
+from ..services import analytics_store, customer_revenue, demo_index, rollups, trends
+from ..services.users import resolve_scope
 
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
+# Range used when the caller does not specify one.
+DEFAULT_RANGE_DAYS = 30
+
+
+def _resolve_range(from_date: Optional[date], to_date: Optional[date]) -> tuple:
+    """Fill in missing range bounds and validate the range length."""
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="`from` must not be after `to`")
+    if (to_date - from_date).days + 1 > rollups.MAX_OVERVIEW_DAYS:
+        raise HTTPException(
+            status_code=400, detail=f"Date range may span at most {rollups.MAX_OVERVIEW_DAYS} days"
+        )
+    return from_date, to_date
+
+
+async def _team_scope(current_user: Dict[str, Any], manager_uid: str) -> str:
+    """Return the rollup scope of a manager's team, including the manager's own records."""
+    profile = current_user if manager_uid == current_user.get("uid") else await get_user_profile(manager_uid)
+    return rollups.team_read_scope(manager_uid, profile.get("manager_uid"))
+
+
+async def _rollup_scope(current_user: Dict[str, Any], employee_uid: Optional[str]) -> tuple:
+    """Return the rollup scope visible to the caller and the UIDs it covers."""
+    uids = await resolve_scope(current_user, employee_uid)
+    if employee_uid or current_user.get("role") not in {"MANAGER", "ADMIN"}:
+        return rollups.employee_scope(uids[0]), uids
+    if current_user.get("role") == "MANAGER":
+        return await _team_scope(current_user, current_user["uid"]), uids
+    return rollups.ALL_SCOPE, uids
+
+
+async def _respond(
+    request: Request, scope: str, build: Callable[[], Awaitable[Dict[str, Any]]], *key_parts: Hashable
+) -> Response:
+    """Answer from the scope version cache, or straight from `build` when the mirror serves analytics.
+
+    The mirror may lag the writes by up to `ANALYTICS_MAX_STALENESS`, so its
+    answers cannot be keyed by the versions read before the query.
+    """
+    if analytics_store.enabled():
+        return JSONResponse(jsonable_encoder(await build()))
+    return await conditional.respond(request, [scope], build, *key_parts)
+
 
 @router.get("/overview", summary="Overall analytics overview")
 async def get_overview(
+    request: Request,
     from_date: Optional[date] = Query(None, alias="from"),
     to_date: Optional[date] = Query(None, alias="to"),
+    employee_uid: Optional[str] = Query(None),
     current_user: Dict[str, Any] = Depends(get_current_user),
-) -> Dict[str, Any]:
+) -> Response:
     """Return high‑level analytics for the authenticated user or team.
 
     The exact metrics returned depend on the user's role.  For employees the
-    statistics are limited to their own performance; managers and admins
-    receive aggregated team statistics.  In this stub we return a static
-    structure.
+    statistics are limited to their own performance; managers receive their
+    team's statistics and admins the whole organisation's, unless
+    `employee_uid` selects a single employee.  The range defaults to the last
+    30 days and is answered by reading one rollup document per day.
     """
     role = current_user.get("role")
-    return {
-        "status": "success",
-        "role": role,
-        "from": from_date,
-        "to": to_date,
-        "data": {
-            "total_calls": 0,
-            "total_answered": 0,
-            "total_unanswered": 0,
-            "total_payments": 0,
-            "total_incentives": 0,
-            "service_breakdown": {},
-        },
-    }
+    from_date, to_date = _resolve_range(from_date, to_date)
+    scope, _ = await _rollup_scope(current_user, employee_uid)
+
+    async def build() -> Dict[str, Any]:
+        if analytics_store.enabled():
+            data = await analytics_store.store.overview(scope, from_date, to_date)
+        else:
+            data = await rollups.read_overview(scope, from_date, to_date)
+        return {
+            "status": "success",
+            "role": role,
+            "scope": scope,
+            "from": from_date,
+            "to": to_date,
+            "data": data,
+        }
+
+    return await _respond(request, scope, build, role)
+
+
+@router.get("/trends", summary="Revenue trends by day, week or month")
+async def get_trends(
+    request: Request,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    granularity: str = Query("day", regex=trends.GRANULARITY_PATTERN),
+    employee_uid: Optional[str] = Query(None),
+    team_uid: Optional[str] = Query(None, description="Manager UID of the team (admins only, or the manager)"),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Response:
+    """Return gap-filled payment count and amount series for the range.
+
+    Every bucket in the range is present, with zeros where nothing was paid.
+    Besides the `total` series, the response has one series per service and
+    per customer type (`new`/`repeat`) seen in the range.  Buckets are keyed
+    by their first day; weeks start on Monday.  The scope follows the overview,
+    and `team_uid` selects a single team.
+    """
+    from_date, to_date = _resolve_range(from_date, to_date)
+    if team_uid:
+        if employee_uid:
+            raise HTTPException(status_code=400, detail="Pass either `employee_uid` or `team_uid`, not both")
+        role = current_user.get("role")
+        if role != "ADMIN" and not (role == "MANAGER" and team_uid == current_user.get("uid")):
+            raise HTTPException(status_code=403, detail="Not allowed to view this team's trends")
+        scope = await _team_scope(current_user, team_uid)
+    else:
+        scope, _ = await _rollup_scope(current_user, employee_uid)
+
+    async def build() -> Dict[str, Any]:
+        # Memoized trends could predate the versions the response is cached under.
+        fetch = trends.get_trends if analytics_store.enabled() else trends.compute_trends
+        data = await fetch(scope, from_date, to_date, granularity)
+        return {
+            "status": "success",
+            "scope": scope,
+            "from": from_date,
+            "to": to_date,
+            "data": data,
+        }
+
+    return await _respond(request, scope, build)
 
 
 @router.get("/top-customers", summary="Top customers by revenue")
 async def top_customers(
+    request: Request,
     limit: int = Query(10, ge=1, le=100),
     from_date: Optional[date] = Query(None, alias="from"),
     to_date: Optional[date] = Query(None, alias="to"),
+    employee_uid: Optional[str] = Query(None),
     current_user: Dict[str, Any] = Depends(get_current_user),
-) -> Dict[str, Any]:
+) -> Response:
     """Return the top customers ranked by revenue.
 
-    The results are grouped by mobile number.  In a real implementation this
-    would require either Firestore aggregation (which is limited) or an
-    export to BigQuery.  Here we return a stubbed list.
+    The results are grouped by mobile number and scoped like the overview.
+    Whole months in the range are served from the maintained monthly revenue
+    buckets and the days of partial months at the edges from the daily ones.
     """
+    from_date, to_date = _resolve_range(from_date, to_date)
+    scope, _ = await _rollup_scope(current_user, employee_uid)
+
+    async def build() -> Dict[str, Any]:
+        if analytics_store.enabled():
+            customers = await analytics_store.store.top_customers(scope, from_date, to_date, limit)
+        else:
+            customers = await customer_revenue.top_customers(scope, from_date, to_date, limit)
+        return {
+            "status": "success",
+            "limit": limit,
+            "scope": scope,
+            "from": from_date,
+            "to": to_date,
+            "customers": customers,
+        }
+
+    return await _respond(request, scope, build)
+
+
+@router.get("/conversion-funnel", summary="Demo-to-payment conversion funnel")
+async def conversion_funnel(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    employee_uid: Optional[str] = Query(None),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Return how many demoed customer cards went on to pay, and how fast.
+
+    Covers the demos given in the range, scoped like the overview.  A card
+    converts when a payment with the same customer card link is dated on or
+    after the demo.  Besides the totals, the response breaks conversion rate,
+    revenue and the time-to-conversion distribution down per employee.
+    """
+    from_date, to_date = _resolve_range(from_date, to_date)
+    scope, _ = await _rollup_scope(current_user, employee_uid)
+    data = await demo_index.conversion_funnel(scope, from_date, to_date)
     return {
         "status": "success",
-        "limit": limit,
+        "scope": scope,
         "from": from_date,
         "to": to_date,
-        "customers": [],
-    }
\ No newline at end of file
+        "data": data,
+    }
+
+
+@router.post("/rollups/rebuild", summary="Rebuild analytics rollups (admin only)")
+async def rebuild(
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Recompute the daily rollups for a date range from the raw data.
+
+    Use this after remapping employees to managers or to repair rollups after
+    an incident.
+    """
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can rebuild rollups")
+    from_date, to_date = _resolve_range(from_date, to_date)
+    result = await rebuild_rollups(from_date, to_date)
+    return {"status": "success", "from": from_date, "to": to_date, **result}
@@ -2,62 +2,177 @@
 
 This router exposes endpoints for employees to create or fetch call entries
 for a given date and for managers/admins to query call history of their
-team.  Actual persistence is not implemented; these endpoints return
-placeholder responses.
+team.  Entries are persisted one document per employee per day.
 """
 
 from __future__ import annotations
 
+import asyncio
 from datetime import date
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
 from ..auth import get_current_user
+from ..export import EXPORT_FORMAT_PATTERN, stream_export
 from ..models import CallEntry
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields
+from ..services import calls as call_service
+from ..services.users import get_team_uid, resolve_scope, resolve_target_uid
 
 
 router = APIRouter(prefix="/calls", tags=["calls"])
 
+# Maximum number of entries accepted by a single bulk request.
+MAX_BULK_ENTRIES = 2000
+
+EXPORT_COLUMNS = [
+    "id",
+    "date",
+    "uid",
+    "answered_calls",
+    "unanswered_calls",
+    "total_call_time_minutes",
+    "demos",
+]
+
 
 @router.post("/", summary="Create or update a daily call entry")
 async def upsert_call_entry(
-    entry: CallEntry, current_user: Dict[str, Any] = Depends(get_current_user)
+    entry: CallEntry,
+    employee_uid: Optional[str] = Query(None, description="Employee to upsert for (managers/admins)"),
+    current_user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """Create or update the call entry for the given date.
 
     Employees can create or update their own entry.  Managers/admins can
-    optionally specify an `employee_id` field in the payload to upsert on
-    behalf of an employee.  Here we return a stubbed response only.
+    optionally specify `employee_uid` to upsert on behalf of an employee.
+    The entry is saved with a deterministic document ID (`uid_date`).  With
+    `CALL_WRITE_BEHIND_MS` set it is written shortly after the response,
+    together with other upserts (see `app.services.calls`).
     """
+    uid = await resolve_target_uid(current_user, employee_uid)
+    team_uid = await get_team_uid(current_user, uid)
+    doc_id = await call_service.upsert_call_entry(uid, team_uid, entry)
+    return {"status": "success", "doc_id": doc_id, "data": entry.dict()}
+
+
+@router.post("/bulk", summary="Create or update many daily call entries")
+async def bulk_upsert_call_entries(
+    entries: List[Dict[str, Any]] = Body(..., embed=True),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Create or update many call entries in one request.
+
+    Each item has the fields of a `CallEntry` plus an optional
+    `employee_uid`.  Employees may only submit their own entries; managers may
+    submit entries for their team and admins for anyone.  All items are
+    validated up front and the valid ones are written in chunked batch
+    commits.  The response reports the outcome of every item by index.
+    """
+    if len(entries) > MAX_BULK_ENTRIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ENTRIES} entries per request")
     uid = current_user.get("uid")
     role = current_user.get("role")
+    allowed = await resolve_scope(current_user)
 
-    # In a real implementation, validate that only managers/admins can upsert
-    # entries for other users.
-    # Save the entry in Firestore with a deterministic document ID (uid_date).
-    doc_id = f"{uid}_{entry.date}"
-    # TODO: Write to Firestore
-    return {"status": "success", "doc_id": doc_id, "data": entry.dict()}
+    results: List[Dict[str, Any]] = [{"index": index} for index in range(len(entries))]
+    valid: List[tuple] = []
+    seen: Dict[tuple, int] = {}
+    for index, item in enumerate(entries):
+        item = dict(item)
+        target_uid = item.pop("employee_uid", None) or uid
+        error: Optional[str] = None
+        if target_uid != uid and role not in {"MANAGER", "ADMIN"}:
+            error = "Only managers or admins can write on behalf of other users"
+        elif allowed is not None and target_uid not in allowed:
+            error = "Employee is not part of your team"
+        else:
+            try:
+                entry = CallEntry(**item)
+            except ValidationError as exc:
+                error = str(exc)
+            else:
+                key = (target_uid, entry.date)
+                if key in seen:
+                    error = f"Duplicate of entry {seen[key]} for the same employee and date"
+                else:
+                    seen[key] = index
+                    valid.append((index, target_uid, entry))
+        if error:
+            results[index].update(status="error", error=error)
+
+    targets = sorted({target_uid for _, target_uid, _ in valid})
+    team_uids = dict(zip(targets, await asyncio.gather(*(get_team_uid(current_user, t) for t in targets))))
+    errors = await call_service.bulk_upsert_call_entries(
+        [(target_uid, team_uids[target_uid], entry) for _, target_uid, entry in valid]
+    )
+    for (index, target_uid, entry), error in zip(valid, errors):
+        if error:
+            results[index].update(status="error", error=error)
+        else:
+            results[index].update(status="success", doc_id=call_service.call_doc_id(target_uid, entry.date))
+
+    failed = sum(1 for result in results if result["status"] == "error")
+    return {
+        "status": "success" if not failed else "partial",
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    }
 
 
 @router.get("/", summary="List call entries for the current user")
 async def list_calls(
     from_date: Optional[date] = Query(None, alias="from", description="Start date inclusive"),
     to_date: Optional[date] = Query(None, alias="to", description="End date inclusive"),
+    employee_uid: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
     current_user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
-    """List call entries for the authenticated user within the given date range.
+    """List call entries within the given date range, one page at a time.
 
-    Returns a stub response.  In a full implementation this would query
-    Firestore for documents with IDs between `uid_from` and `uid_to`.
+    Employees see their own entries.  Managers and admins can set
+    `employee_uid` to view a team member's entries, or omit it to see their
+    whole team (managers) or everyone (admins).  Entries are ordered by date;
+    pass `next_cursor` back as `cursor` to fetch the following page.
     """
     uid = current_user.get("uid")
-    # TODO: Query Firestore for calls between from_date and to_date
+    projection = parse_fields(fields, call_service.CALL_FIELDS)
+    uids = await resolve_scope(current_user, employee_uid)
+    entries, next_cursor = await call_service.list_call_entries(
+        uids, from_date, to_date, cursor, limit, projection
+    )
     return {
         "status": "success",
         "uid": uid,
         "from": from_date,
         "to": to_date,
-        "entries": [],
-    }
\ No newline at end of file
+        "entries": entries,
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/export", summary="Export call history as CSV or NDJSON")
+async def export_calls(
+    format: str = Query("csv", regex=EXPORT_FORMAT_PATTERN),
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    employee_uid: Optional[str] = Query(None),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> StreamingResponse:
+    """Stream every call entry matching the same filters as `list_calls`.
+
+    Demos are written as a JSON array in the CSV `demos` column.
+    """
+    uids = await resolve_scope(current_user, employee_uid)
+    projection = [column for column in EXPORT_COLUMNS if column != "id"]
+
+    async def fetch_page(cursor: Optional[str], limit: int) -> tuple:
+        return await call_service.list_call_entries(uids, from_date, to_date, cursor, limit, projection)
+
+    return stream_export(fetch_page, EXPORT_COLUMNS, format, "calls")
@@ -0,0 +1,106 @@
+"""Live update endpoints.
+
+Dashboards open `GET /events/stream` once instead of polling the overview and
+list endpoints.  The stream is a `text/event-stream` of the changes the caller
+is allowed to see (see `app.events` for the event types).  Employees see their
+own changes, managers see their team's changes and WhatsApp payments, and
+admins see everything.
+
+Every event has an `id`.  When the connection drops, `EventSource`
+reconnects automatically and sends the last ID it received as
+`Last-Event-ID`, and the stream resumes from there.  If that event is no
+longer buffered, a `reset` event is sent first to tell the client to reload
+its data.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from ..auth import get_current_user, get_current_user_or_query_token
+from ..events import EVENT_HEARTBEAT_SECONDS, ChangeEvent, Subscription, change_feed
+from ..services.users import resolve_scope
+
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+# Reconnection delay suggested to clients, in milliseconds.
+RETRY_MS = 3000
+
+# Organisation-wide event types managers may see in addition to their team's changes.
+MANAGER_BROADCAST_TYPES = {"whatsapp_payment"}
+
+
+def format_event(event: ChangeEvent) -> str:
+    """Serialise `event` as one server-sent event."""
+    payload = json.dumps({"uid": event.uid, "team_uid": event.team_uid, **event.data}, default=str)
+    return f"id: {event.id}\nevent: {event.type}\ndata: {payload}\n\n"
+
+
+async def _event_stream(request: Request, subscription: Subscription) -> AsyncIterator[str]:
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if subscription.reset:
+            yield "event: reset\ndata: {}\n\n"
+        while True:
+            if subscription.overflowed and subscription.queue.empty():
+                # Too far behind: end the stream so the client reconnects and
+                # catches up from the buffer with its `Last-Event-ID`.
+                return
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                # Comment lines keep proxies from closing an idle connection.
+                yield ": heartbeat\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        change_feed.unsubscribe(subscription)
+
+
+@router.get("/stream", summary="Stream live changes (server-sent events)")
+async def stream(
+    request: Request,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    current_user: Dict[str, Any] = Depends(get_current_user_or_query_token),
+) -> StreamingResponse:
+    """Push payment, incentive, call entry and WhatsApp payment changes as they happen.
+
+    Authenticate with the usual `Authorization` header, or with
+    `?access_token=` from a browser `EventSource`.  Each event's `data` is a
+    JSON object with the owning `uid` and `team_uid`, the changed record's
+    identifiers and a `delta` to apply to totals already displayed.
+    """
+    role = current_user.get("role")
+    uid = current_user.get("uid")
+    scope = await resolve_scope(current_user)
+    team = set(scope) if scope is not None else None
+
+    def visible(event: ChangeEvent) -> bool:
+        if team is None:
+            return True
+        if event.uid is None:
+            return role == "MANAGER" and event.type in MANAGER_BROADCAST_TYPES
+        return event.uid in team or (role == "MANAGER" and event.team_uid == uid)
+
+    subscription = change_feed.subscribe(visible, last_event_id)
+    return StreamingResponse(
+        _event_stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/stats", summary="Change feed statistics (admin only)")
+async def stats(current_user: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
+    """Return the number of connected subscribers and event counters for this process."""
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can view change feed statistics")
+    return {"status": "success", "feed": change_feed.stats()}
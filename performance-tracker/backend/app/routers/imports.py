@@ -0,0 +1,95 @@
+"""Bulk import endpoints (admin only).
+
+Historical payments and call entries are imported by uploading a CSV file as
+the raw request body (`Content-Type: text/csv`).  The body is streamed
+through `app.jobs.import_csv`, which validates and commits it in chunks, so
+files with hundreds of thousands of rows can be imported in one request.
+The same job is available as a CLI for files too large to upload.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from ..auth import get_current_user
+from ..export import EXPORT_FORMAT_PATTERN, stream_export
+from ..jobs import import_csv
+
+
+router = APIRouter(prefix="/imports", tags=["imports"])
+
+
+def _require_admin(current_user: Dict[str, Any]) -> None:
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can import data")
+
+
+@router.post("/{kind}", summary="Import payments or call entries from CSV (admin only)")
+async def start_import(
+    request: Request,
+    kind: str,
+    start_row: int = Query(0, ge=0, description="Number of data rows to skip"),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Import every row of the CSV request body and return the job summary.
+
+    `kind` is `payments` or `calls`.  The first line must be a header with
+    `uid` and the fields of a payment or call entry.  Invalid rows are
+    skipped and listed in `GET /imports/{job_id}/errors`.  If the job fails,
+    upload the same file to `POST /imports/{job_id}/resume`.
+    """
+    _require_admin(current_user)
+    if kind not in import_csv.IMPORT_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown import kind: {kind}")
+    job_id = await import_csv.start_job(kind, start_row)
+    job = await import_csv.run_job(job_id, import_csv.iter_csv_records(request.stream()))
+    return {"status": "success", "job": job}
+
+
+@router.post("/{job_id}/resume", summary="Resume a failed import (admin only)")
+async def resume_import(
+    request: Request, job_id: str, current_user: Dict[str, Any] = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """Resume an import with the same CSV file, skipping the rows already committed.
+
+    A job still `running` can be resumed once its lease has expired, i.e. the
+    process that ran it has stopped renewing it.
+    """
+    _require_admin(current_user)
+    try:
+        job = await import_csv.run_job(job_id, import_csv.iter_csv_records(request.stream()))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    except import_csv.ImportInProgress as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return {"status": "success", "job": job}
+
+
+@router.get("/{job_id}", summary="Import progress (admin only)")
+async def import_status(job_id: str, current_user: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
+    """Return the checkpoint of an import job, including `next_row` for resuming."""
+    _require_admin(current_user)
+    job = await import_csv.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", "job": job}
+
+
+@router.get("/{job_id}/errors", summary="Per-row import error report (admin only)")
+async def import_errors(
+    job_id: str,
+    format: str = Query("csv", regex=EXPORT_FORMAT_PATTERN),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> StreamingResponse:
+    """Stream the row number and error message of every rejected row."""
+    _require_admin(current_user)
+    if await import_csv.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def fetch_page(cursor: Optional[str], limit: int) -> tuple:
+        return await import_csv.list_errors(job_id, cursor, limit)
+
+    return stream_export(fetch_page, import_csv.ERROR_REPORT_COLUMNS, format, f"import_{job_id}_errors")
@@ -2,7 +2,10 @@
 
 This router exposes read‑only endpoints for fetching incentives.  Incentives
 are automatically created and updated when payments are saved or modified.
-The current implementation returns stub responses.
+Admins can also trigger a bulk recalculation after the master percentages
+change, and generate every employee's monthly statement in one batch job; the
+statements are stored and served as downloads (see
+`app.services.statements`).
 """
 
 from __future__ import annotations
@@ -10,34 +13,203 @@ from __future__ import annotations
 from datetime import date
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Path, Query, Request
+from fastapi.responses import Response, StreamingResponse
 
+from .. import conditional
 from ..auth import get_current_user
+from ..export import EXPORT_FORMAT_PATTERN, stream_export
+from ..jobs import generate_statements, recalculate_incentives
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields
+from ..services import incentives as incentive_service
+from ..services import statements as statement_service
+from ..services import versions
+from ..statements import MEDIA_TYPES, STATEMENT_FORMAT_PATTERN
+from ..services.master_data import get_master_data, invalidate_master_data
+from ..services.users import resolve_scope
 
 
 router = APIRouter(prefix="/incentives", tags=["incentives"])
 
+EXPORT_COLUMNS = [
+    "id",
+    "payment_id",
+    "date",
+    "uid",
+    "service",
+    "amount_paid",
+    "base_percent",
+    "global_percent",
+    "incentive_amount",
+]
+
 
 @router.get("/", summary="List incentives")
 async def list_incentives(
+    request: Request,
     from_date: Optional[date] = Query(None, alias="from"),
     to_date: Optional[date] = Query(None, alias="to"),
     employee_uid: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
     current_user: Dict[str, Any] = Depends(get_current_user),
-) -> Dict[str, Any]:
+) -> Response:
     """List incentives for the current user or a specified employee.
 
     Managers and admins can set `employee_uid` to view incentives for team
     members.  The `from` and `to` parameters restrict the date range.
+    Results are paginated by date; pass `next_cursor` back as `cursor` for the
+    next page and use `fields` to fetch only the columns needed.  Pages carry
+    an ETag and are cached until a payment in scope changes (see
+    `app.conditional`).
+    """
+    projection = parse_fields(fields, incentive_service.INCENTIVE_FIELDS)
+    uids = await resolve_scope(current_user, employee_uid)
+
+    async def build() -> Dict[str, Any]:
+        incentives, next_cursor = await incentive_service.list_incentives(
+            uids, from_date, to_date, cursor, limit, projection
+        )
+        return {
+            "status": "success",
+            "filters": {
+                "from": from_date,
+                "to": to_date,
+                "employee_uid": employee_uid,
+            },
+            "incentives": incentives,
+            "next_cursor": next_cursor,
+        }
+
+    scopes = versions.request_scopes(current_user, employee_uid, uids)
+    return await conditional.respond(request, scopes, build, tuple(uids or ()))
+
+
+@router.get("/export", summary="Export incentives as CSV or NDJSON")
+async def export_incentives(
+    format: str = Query("csv", regex=EXPORT_FORMAT_PATTERN),
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    employee_uid: Optional[str] = Query(None),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> StreamingResponse:
+    """Stream every incentive matching the same filters as `list_incentives`."""
+    uids = await resolve_scope(current_user, employee_uid)
+    projection = [column for column in EXPORT_COLUMNS if column != "id"]
+
+    async def fetch_page(cursor: Optional[str], limit: int) -> tuple:
+        return await incentive_service.list_incentives(uids, from_date, to_date, cursor, limit, projection)
+
+    return stream_export(fetch_page, EXPORT_COLUMNS, format, "incentives")
+
+
+@router.get("/statements", summary="List monthly incentive statements")
+async def list_statements(
+    month: str = Query(..., regex=statement_service.MONTH_PATTERN, description="Month (YYYY-MM)"),
+    employee_uid: Optional[str] = Query(None),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """List the stored statements of a month with their totals.
+
+    Scoped like `list_incentives`.  `current` is false for statements whose
+    payments changed since they were generated; downloading one regenerates
+    it.
     """
-    role = current_user.get("role")
-    # TODO: Query Firestore for incentives within range
-    return {
-        "status": "success",
-        "filters": {
-            "from": from_date,
-            "to": to_date,
-            "employee_uid": employee_uid,
-        },
-        "incentives": [],
-    }
\ No newline at end of file
+    uids = await resolve_scope(current_user, employee_uid)
+    statements = await statement_service.list_statements(uids, month)
+    return {"status": "success", "month": month, "statements": statements}
+
+
+@router.get("/statements/{month}/{uid}", summary="Download a monthly incentive statement")
+async def download_statement(
+    month: str = Path(..., regex=statement_service.MONTH_PATTERN),
+    uid: str = Path(...),
+    format: str = Query("csv", regex=STATEMENT_FORMAT_PATTERN),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Response:
+    """Download the statement of `uid` for `month` as CSV or HTML.
+
+    A statement generated by the batch job and unchanged since is served as
+    stored.  Otherwise it is generated now and stored for the next download.
+    """
+    if uid not in await resolve_scope(current_user, uid):
+        raise HTTPException(status_code=403, detail="You can only download your own or your team's statements")
+    statement = await statement_service.get_statement(uid, month)
+    return Response(
+        content=statement[format],
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="statement-{uid}-{month}.{format}"'},
+    )
+
+
+@router.post("/statements/{month}/generate", summary="Generate every statement of a month (admin only)")
+async def generate_month_statements(
+    background_tasks: BackgroundTasks,
+    month: str = Path(..., regex=statement_service.MONTH_PATTERN),
+    force: bool = Query(False, description="Also regenerate statements that are current"),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Start a background job generating the statements of a month that are missing or out of date."""
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can generate statements")
+    background_tasks.add_task(generate_statements.generate_statements, month, force)
+    return {"status": "success", "month": month, "force": force}
+
+
+@router.post("/recalculate", summary="Recalculate incentives from master percentages (admin only)")
+async def recalculate(
+    background_tasks: BackgroundTasks,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    service: Optional[List[str]] = Query(None, description="Limit to these services"),
+    dry_run: bool = Query(False, description="Only report what would change"),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Start a background job recalculating incentives for the given payments.
+
+    Poll `GET /incentives/recalculate/{job_id}` for progress and, in dry-run
+    mode, the diff summary.
+    """
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can recalculate incentives")
+    # A recalculation follows a change of percentages; make new payments on
+    # this instance use them straight away rather than after the cache TTL.
+    invalidate_master_data()
+    master = await get_master_data()
+    for name in service or []:
+        master.validate_service(name)
+    job_id = await recalculate_incentives.start_job(from_date, to_date, service, dry_run)
+    background_tasks.add_task(recalculate_incentives.run_job, job_id)
+    return {"status": "success", "job_id": job_id, "dry_run": dry_run}
+
+
+@router.post("/recalculate/{job_id}/resume", summary="Resume an interrupted recalculation (admin only)")
+async def resume_recalculation(
+    job_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Resume a recalculation job from its last checkpoint."""
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can recalculate incentives")
+    job = await recalculate_incentives.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "running":
+        raise HTTPException(status_code=409, detail="Job is already running")
+    background_tasks.add_task(recalculate_incentives.run_job, job_id)
+    return {"status": "success", "job_id": job_id}
+
+
+@router.get("/recalculate/{job_id}", summary="Recalculation progress (admin only)")
+async def recalculation_status(
+    job_id: str, current_user: Dict[str, Any] = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """Return the checkpoint of a recalculation job, including its progress and diff summary."""
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can view recalculation jobs")
+    job = await recalculate_incentives.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", "job": job}
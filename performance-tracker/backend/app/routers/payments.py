@@ -2,8 +2,9 @@
 
 This router allows employees to create payment entries and managers/admins to
 view and edit payments.  Incentives are automatically created or updated
-when payments are changed.  The current implementation returns stub
-responses.
+when payments are changed; a payment and its incentive are always written
+in the same batch.  Writes accept an `Idempotency-Key` header so that
+clients can retry them safely.
 """
 
 from __future__ import annotations
@@ -11,18 +12,47 @@ from __future__ import annotations
 from datetime import date
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
 from ..auth import get_current_user
+from ..export import EXPORT_FORMAT_PATTERN, stream_export
 from ..models import Payment
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields
+from ..services import payments as payment_service
+from ..services.users import get_team_uid, resolve_scope
 
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
+EXPORT_COLUMNS = [
+    "id",
+    "date",
+    "uid",
+    "customer_name",
+    "mobile",
+    "organization_name",
+    "customer_type",
+    "service",
+    "product_type",
+    "amount_paid",
+    "customer_card_link",
+    "notes",
+]
+
+OUT_OF_SCOPE = "Payment belongs to an employee outside your team"
+
+
+# Optional header making a write safe to retry: a request repeated with the
+# same key (per caller) is applied at most once.
+IdempotencyKey = Header(None, alias="Idempotency-Key", max_length=255)
+
 
 @router.post("/", summary="Create a payment entry (employees)")
 async def create_payment(
-    payment: Payment, current_user: Dict[str, Any] = Depends(get_current_user)
+    payment: Payment,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    current_user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """Create a new payment entry for the authenticated employee.
 
@@ -31,8 +61,12 @@ async def create_payment(
     automatically in the backend service layer.
     """
     uid = current_user.get("uid")
-    # TODO: Persist to Firestore and compute incentive
-    payment_id = "payment_stub_id"
+    team_uid = await get_team_uid(current_user, uid)
+    key = payment_service.scoped_idempotency_key(uid, idempotency_key)
+    try:
+        payment_id = await payment_service.create_payment(uid, team_uid, payment, key)
+    except payment_service.PaymentConflict as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
     return {"status": "success", "payment_id": payment_id, "data": payment.dict()}
 
 
@@ -43,14 +77,23 @@ async def list_payments(
     service: Optional[str] = Query(None),
     customer_type: Optional[str] = Query(None),
     employee_uid: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
     current_user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """List payments filtered by date range, service, customer type and employee.
 
     Managers and admins can specify `employee_uid` to view payments for a team
-    member.  Employees ignore the `employee_uid` parameter.
+    member.  Employees ignore the `employee_uid` parameter.  Results are
+    paginated by date; pass `next_cursor` back as `cursor` for the next page
+    and use `fields` to fetch only the columns needed.
     """
-    # TODO: Query Firestore with filters respecting RBAC
+    projection = parse_fields(fields, payment_service.PAYMENT_FIELDS)
+    uids = await resolve_scope(current_user, employee_uid)
+    payments, next_cursor = await payment_service.list_payments(
+        uids, from_date, to_date, service, customer_type, cursor, limit, projection
+    )
     return {
         "status": "success",
         "filters": {
@@ -60,14 +103,42 @@ async def list_payments(
             "customer_type": customer_type,
             "employee_uid": employee_uid,
         },
-        "payments": [],
+        "payments": payments,
+        "next_cursor": next_cursor,
     }
 
 
+@router.get("/export", summary="Export payments as CSV or NDJSON")
+async def export_payments(
+    format: str = Query("csv", regex=EXPORT_FORMAT_PATTERN),
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    service: Optional[str] = Query(None),
+    customer_type: Optional[str] = Query(None),
+    employee_uid: Optional[str] = Query(None),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+) -> StreamingResponse:
+    """Stream every payment matching the same filters as `list_payments`.
+
+    Rows are fetched from Firestore page by page and written to the response
+    as they arrive.
+    """
+    uids = await resolve_scope(current_user, employee_uid)
+    projection = [column for column in EXPORT_COLUMNS if column != "id"]
+
+    async def fetch_page(cursor: Optional[str], limit: int) -> tuple:
+        return await payment_service.list_payments(
+            uids, from_date, to_date, service, customer_type, cursor, limit, projection
+        )
+
+    return stream_export(fetch_page, EXPORT_COLUMNS, format, "payments")
+
+
 @router.put("/{payment_id}", summary="Update a payment (manager/admin)")
 async def update_payment(
     payment_id: str,
     payment: Payment,
+    idempotency_key: Optional[str] = IdempotencyKey,
     current_user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """Update an existing payment.
@@ -79,21 +150,41 @@ async def update_payment(
     role = current_user.get("role")
     if role not in {"MANAGER", "ADMIN"}:
         raise HTTPException(status_code=403, detail="Only managers or admins can edit payments")
-    # TODO: Update Firestore record and linked incentive
+    key = payment_service.scoped_idempotency_key(current_user.get("uid"), idempotency_key)
+    uids = await resolve_scope(current_user)
+    try:
+        await payment_service.update_payment(payment_id, payment, uids, key)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    except PermissionError:
+        raise HTTPException(status_code=403, detail=OUT_OF_SCOPE)
+    except payment_service.PaymentConflict as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
     return {"status": "success", "payment_id": payment_id, "data": payment.dict()}
 
 
 @router.delete("/{payment_id}", summary="Delete a payment (manager/admin)")
 async def delete_payment(
-    payment_id: str, current_user: Dict[str, Any] = Depends(get_current_user)
+    payment_id: str,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    current_user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """Delete a payment and its associated incentive.
 
     Only managers or admins can perform deletions.  On deletion the linked
-    incentive must also be removed.  Here we return a stub response.
+    incentive must also be removed.
     """
     role = current_user.get("role")
     if role not in {"MANAGER", "ADMIN"}:
         raise HTTPException(status_code=403, detail="Only managers or admins can delete payments")
-    # TODO: Delete the payment and its incentive from Firestore
+    key = payment_service.scoped_idempotency_key(current_user.get("uid"), idempotency_key)
+    uids = await resolve_scope(current_user)
+    try:
+        await payment_service.delete_payment(payment_id, uids, key)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    except PermissionError:
+        raise HTTPException(status_code=403, detail=OUT_OF_SCOPE)
+    except payment_service.PaymentConflict as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
     return {"status": "success", "payment_id": payment_id}
\ No newline at end of file
@@ -2,8 +2,7 @@
 
 This router provides endpoints for creating users and retrieving the
 authenticated user's profile.  Administrative actions are restricted to
-admins.  Actual persistence logic should be implemented in the service layer;
-here we provide stubs for demonstration purposes.
+admins.  Persistence is delegated to `app.services.users`.
 """
 
 from __future__ import annotations
@@ -12,8 +11,10 @@ from typing import Any, Dict, List
 
 from fastapi import APIRouter, Depends, HTTPException
 
-from ..auth import get_current_user
+from ..auth import get_auth_cache_stats, get_current_user, invalidate_user_profile
+from ..conditional import get_response_cache_stats
 from ..models import Payment
+from ..services import users as user_service
 
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -35,10 +36,59 @@ async def create_user(user: Dict[str, Any], current_user: Dict[str, Any] = Depen
     """Create a new user.
 
     Only admins are allowed to create users.  The input `user` should
-    contain at minimum an `email`, `password` and `role`.  In this stub,
-    we simply validate the caller's role and return the submitted data.
+    contain at minimum an `email`, `password` and `role`; `name` and
+    `manager_uid` are optional.  The account is created in Firebase Auth and
+    the profile stored in Firestore.
     """
     if current_user.get("role") != "ADMIN":
         raise HTTPException(status_code=403, detail="Only admins can create users")
-    # TODO: Create the user in Firebase Auth and store the profile in Firestore
-    return {"status": "success", "user": user}
\ No newline at end of file
+    missing = [field for field in ("email", "password", "role") if not user.get(field)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing required fields: {', '.join(missing)}")
+    if user["role"] not in {"EMPLOYEE", "MANAGER", "ADMIN"}:
+        raise HTTPException(status_code=400, detail="Invalid role")
+
+    uid = await user_service.create_auth_user(user["email"], user["password"], user.get("name"))
+    profile = {k: user[k] for k in ("email", "role", "name", "manager_uid") if user.get(k) is not None}
+    await user_service.set_profile(uid, profile)
+    invalidate_user_profile(uid)
+    if profile.get("manager_uid"):
+        user_service.invalidate_team_membership()
+    return {"status": "success", "user": {"uid": uid, **profile}}
+
+
+@router.patch("/{uid}", summary="Update a user's role or manager (admin only)")
+async def update_user(
+    uid: str, changes: Dict[str, Any], current_user: Dict[str, Any] = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """Update the role and/or manager mapping of an existing user.
+
+    Only `role` and `manager_uid` may be changed.  The cached profile for the
+    user and the cached team memberships are invalidated so the change takes
+    effect on the next request.
+    """
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can update users")
+    allowed = {k: v for k, v in changes.items() if k in {"role", "manager_uid"}}
+    if not allowed:
+        raise HTTPException(status_code=400, detail="Nothing to update: expected `role` or `manager_uid`")
+    if "role" in allowed and allowed["role"] not in {"EMPLOYEE", "MANAGER", "ADMIN"}:
+        raise HTTPException(status_code=400, detail="Invalid role")
+
+    await user_service.set_profile(uid, allowed)
+    invalidate_user_profile(uid)
+    user_service.invalidate_team_membership()
+    return {"status": "success", "uid": uid, "updated": allowed}
+
+
+@router.get("/cache-stats", summary="Authentication cache statistics (admin only)")
+async def cache_stats(current_user: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
+    """Return hit/miss counters for the token, profile, team and response caches."""
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can view cache statistics")
+    caches = {
+        **get_auth_cache_stats(),
+        "teams": user_service.get_team_cache_stats(),
+        "responses": get_response_cache_stats(),
+    }
+    return {"status": "success", "caches": caches}
\ No newline at end of file
@@ -3,21 +3,29 @@
 This router manages recurring WhatsApp API monthly payments.  Each customer
 has a fixed due day; new payments set the next due date to the same day of
 the following month (adjusting for month length).  Only managers and admins
-may create or edit these records.  Stub implementations are provided.
+may create or edit these records.  The next due date is stored on each
+customer so that due payments are listed with an indexed range query.
 """
 
 from __future__ import annotations
 
-from datetime import date
+from datetime import date, timedelta
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response
 
+from .. import conditional
 from ..auth import get_current_user
+from ..services import versions
+from ..services import whatsapp as whatsapp_service
 
 
 router = APIRouter(prefix="/whatsapp", tags=["whatsapp"])
 
+# Maximum span of a custom `from`/`to` due window.
+MAX_DUE_WINDOW_DAYS = 366
+
 
 @router.post("/customers", summary="Add or update a WhatsApp monthly customer")
 async def add_customer(
@@ -37,8 +45,17 @@ async def add_customer(
     role = current_user.get("role")
     if role not in {"MANAGER", "ADMIN"}:
         raise HTTPException(status_code=403, detail="Only managers or admins can manage WhatsApp customers")
-    # TODO: Persist customer to Firestore
-    return {"status": "success", "customer": customer}
+    if not customer.get("mobile"):
+        raise HTTPException(status_code=400, detail="`mobile` is required")
+    try:
+        fixed_due_day = int(customer.get("fixed_due_day"))
+    except (TypeError, ValueError):
+        fixed_due_day = 0
+    if not 1 <= fixed_due_day <= 31:
+        raise HTTPException(status_code=400, detail="`fixed_due_day` must be an integer between 1 and 31")
+    customer = {**customer, "fixed_due_day": fixed_due_day}
+    stored = await whatsapp_service.upsert_customer(customer)
+    return {"status": "success", "customer": stored}
 
 
 @router.post("/monthly-payments", summary="Record a WhatsApp monthly payment")
@@ -54,27 +71,66 @@ async def add_monthly_payment(
     - `amount`: Payment amount
     - `card_link`: Customer card link
     - `notes`: Optional notes
-    Only managers or admins may perform this action.
+    Only managers or admins may perform this action.  The customer's next
+    due date advances by one billing cycle.
     """
     role = current_user.get("role")
     if role not in {"MANAGER", "ADMIN"}:
         raise HTTPException(status_code=403, detail="Only managers or admins can record WhatsApp payments")
-    # TODO: Persist payment and update next due date
-    return {"status": "success", "payment": payment}
+    if not payment.get("mobile"):
+        raise HTTPException(status_code=400, detail="`mobile` is required")
+    try:
+        date.fromisoformat(str(payment.get("date_paid")))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="`date_paid` must be a date (YYYY-MM-DD)")
+    try:
+        result = await whatsapp_service.record_payment(payment)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="WhatsApp customer not found")
+    return {"status": "success", **result, "payment": payment}
 
 
 @router.get("/due", summary="List upcoming WhatsApp payments due")
 async def list_due_payments(
+    request: Request,
     window: str = Query("today", regex="^(today|week)$"),
+    from_date: Optional[date] = Query(None, alias="from", description="Custom window start (overrides `window`)"),
+    to_date: Optional[date] = Query(None, alias="to", description="Custom window end (overrides `window`)"),
+    include_overdue: bool = Query(False, description="Also list customers whose due date has passed"),
     current_user: Dict[str, Any] = Depends(get_current_user),
-) -> Dict[str, Any]:
-    """List WhatsApp payments due today or this week.
-
-    Managers and admins see all due payments across all customers.
+) -> Response:
+    """List WhatsApp payments due today, this week or in a custom window.
+
+    Managers and admins see all due payments across all customers.  The
+    `week` window covers today and the following six days.  Passing `from`
+    and/or `to` selects a custom inclusive window instead.  The list carries
+    an ETag and is cached until a WhatsApp record changes (see
+    `app.conditional`).
     """
-    # TODO: Query Firestore for customers with due dates in the specified window
-    return {
-        "status": "success",
-        "window": window,
-        "due_payments": [],
-    }
\ No newline at end of file
+    role = current_user.get("role")
+    if role not in {"MANAGER", "ADMIN"}:
+        raise HTTPException(status_code=403, detail="Only managers or admins can view WhatsApp due payments")
+    today = date.today()
+    if from_date or to_date:
+        window = "range"
+        start = from_date or today
+        end = to_date or start + timedelta(days=6)
+        if start > end:
+            raise HTTPException(status_code=400, detail="`from` must not be after `to`")
+        if (end - start).days + 1 > MAX_DUE_WINDOW_DAYS:
+            raise HTTPException(status_code=400, detail=f"Window may span at most {MAX_DUE_WINDOW_DAYS} days")
+    else:
+        start = today
+        end = start if window == "today" else start + timedelta(days=6)
+
+    async def build() -> Dict[str, Any]:
+        due_payments = await whatsapp_service.list_due(None if include_overdue else start, end)
+        return {
+            "status": "success",
+            "window": window,
+            "from": start,
+            "to": end,
+            "due_payments": due_payments,
+        }
+
+    return await conditional.respond(request, [versions.WHATSAPP_SCOPE], build)
\ No newline at end of file
@@ -0,0 +1,17 @@
+"""Service layer package.
+
+This package contains the asynchronous data-access functions used by the API
+routers.  All Firestore access goes through the `AsyncClient` returned by
+`app.firestore.get_async_firestore_client`, so request handlers never block
+the event loop on a network round trip.
+"""
+
+from . import users, calls, payments, incentives, whatsapp  # noqa: F401
+
+__all__ = [
+    "users",
+    "calls",
+    "payments",
+    "incentives",
+    "whatsapp",
+]
@@ -0,0 +1,448 @@
+"""Embedded columnar mirror of the analytics data (DuckDB).
+
+With `ANALYTICS_ENGINE=duckdb` the overview, top customers and trends are
+answered with SQL over a local DuckDB copy of the `payments`, `incentives`
+and call entry collections, instead of from the daily rollups and the
+customer revenue index.  Any range or grouping then costs one columnar scan
+in process rather than one Firestore read per day or month.
+
+The mirror is kept current by an incremental sync.  For each source
+collection the sync reads only the documents whose `updated_at` is later
+than the watermark, and upserts them.  The watermark is the time the
+previous sync started minus `ANALYTICS_SYNC_OVERLAP` seconds, which allows
+for skew between the local clock and Firestore commit timestamps; documents
+written within the overlap are read twice, which is harmless.  Deleted
+payments are picked up from their tombstones (see `app.services.payments`).
+A new mirror, or one that has not synced for longer than tombstones are
+kept, is rebuilt from every document.
+
+Queries sync first when the last sync is older than
+`ANALYTICS_MAX_STALENESS` seconds.  The mirror lives in memory unless
+`ANALYTICS_DB_PATH` names a file, in which case it survives restarts and
+only the changes since the last sync are read.  DuckDB calls run on one
+dedicated thread; DuckDB parallelises each query itself.
+
+`duckdb` is imported lazily and is only needed when the engine is enabled.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from ..firestore import get_async_firestore_client
+from . import calls as call_service
+from . import rollups
+from .customer_revenue import normalize_mobile
+from .incentives import INCENTIVES_COLLECTION
+from .payments import PAYMENTS_COLLECTION, TOMBSTONE_TTL, TOMBSTONES_COLLECTION
+
+if TYPE_CHECKING:
+    import duckdb
+    import numpy as np
+
+
+T = TypeVar("T")
+
+# "duckdb" serves analytics from the mirror; "rollups" (the default) from Firestore.
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "rollups")
+
+# DuckDB database file; ":memory:" rebuilds the mirror after every restart.
+ANALYTICS_DB_PATH = os.getenv("ANALYTICS_DB_PATH", ":memory:")
+
+# Age in seconds beyond which a query syncs the mirror before running.
+ANALYTICS_MAX_STALENESS = float(os.getenv("ANALYTICS_MAX_STALENESS", "5"))
+
+# Seconds re-read before each watermark to tolerate out-of-order commit timestamps.
+ANALYTICS_SYNC_OVERLAP = timedelta(seconds=float(os.getenv("ANALYTICS_SYNC_OVERLAP", "5")))
+
+# Rows staged in memory before a sync writes them to DuckDB.
+SYNC_BATCH_ROWS = 20000
+
+# Mirrored tables and their columns.  Dates are ISO strings in Firestore and
+# timestamps are stored as naive UTC.
+TABLES: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "payments": (
+        ("id", "VARCHAR PRIMARY KEY"),
+        ("uid", "VARCHAR"),
+        ("team_uid", "VARCHAR"),
+        ("date", "DATE"),
+        ("service", "VARCHAR"),
+        ("customer_type", "VARCHAR"),
+        ("mobile", "VARCHAR"),
+        ("customer_name", "VARCHAR"),
+        ("organization_name", "VARCHAR"),
+        ("amount_paid", "DOUBLE"),
+        ("updated_at", "TIMESTAMP"),
+    ),
+    "incentives": (
+        ("id", "VARCHAR PRIMARY KEY"),
+        ("incentive_amount", "DOUBLE"),
+        ("updated_at", "TIMESTAMP"),
+    ),
+    "calls": (
+        ("id", "VARCHAR PRIMARY KEY"),
+        ("uid", "VARCHAR"),
+        ("team_uid", "VARCHAR"),
+        ("date", "DATE"),
+        ("answered", "BIGINT"),
+        ("unanswered", "BIGINT"),
+        ("minutes", "BIGINT"),
+        ("demos", "BIGINT"),
+        ("updated_at", "TIMESTAMP"),
+    ),
+}
+
+# `sync_state` key holding the time the last completed sync started.
+_SYNCED_AT = "synced_at"
+
+# Staged columns are NumPy arrays, which DuckDB scans without copying row by
+# row.  Text is staged as fixed-width strings (far cheaper to scan than object
+# arrays) with `None` as "", turned back into NULL on insert.
+_NUMPY_TYPES = {"DOUBLE": "float64", "BIGINT": "int64", "TIMESTAMP": "datetime64[us]"}
+
+# One thread owns the connection, so DuckDB is never used concurrently.
+_duckdb_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics")
+
+
+def enabled() -> bool:
+    """Return whether analytics are served from the mirror."""
+    return ANALYTICS_ENGINE == "duckdb"
+
+
+def _utc(value: Any) -> Optional[datetime]:
+    """Return a Firestore timestamp as the naive UTC datetime DuckDB stores."""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _payment_row(doc_id: str, doc: Dict[str, Any]) -> tuple:
+    return (
+        doc_id,
+        doc.get("uid"),
+        doc.get("team_uid"),
+        doc.get("date"),
+        doc.get("service"),
+        doc.get("customer_type"),
+        normalize_mobile(doc.get("mobile") or ""),
+        doc.get("customer_name"),
+        doc.get("organization_name"),
+        float(doc.get("amount_paid") or 0.0),
+        _utc(doc.get("updated_at")),
+    )
+
+
+def _incentive_row(doc_id: str, doc: Dict[str, Any]) -> tuple:
+    return (doc_id, float(doc.get("incentive_amount") or 0.0), _utc(doc.get("updated_at")))
+
+
+def _call_row(record: Dict[str, Any], updated_at: Any) -> tuple:
+    totals = rollups.call_totals(record)
+    return (
+        record["id"],
+        record.get("uid"),
+        record.get("team_uid"),
+        record["date"],
+        totals["answered"],
+        totals["unanswered"],
+        totals["total_call_time_minutes"],
+        totals["demos"],
+        _utc(record.get("updated_at") or updated_at),
+    )
+
+
+def _column(values: Sequence[Any], sql_type: str) -> np.ndarray:
+    import numpy as np
+
+    if sql_type in _NUMPY_TYPES:
+        return np.array(values, dtype=_NUMPY_TYPES[sql_type])
+    return np.array(["" if value is None else value for value in values], dtype=str)
+
+
+def _select(name: str, sql_type: str) -> str:
+    if sql_type == "DATE":
+        return f"CAST(NULLIF({name}, '') AS DATE)"
+    return f"NULLIF({name}, '')" if sql_type == "VARCHAR" else name
+
+
+def _scope_filter(scope: str, table: str) -> Tuple[str, List[Any]]:
+    """Return the SQL condition and parameters restricting `table` to a rollup scope."""
+    if scope == rollups.ALL_SCOPE:
+        return "TRUE", []
+    conditions, params = [], []
+    for part in rollups.scope_parts(scope):
+        kind, _, value = part.partition(":")
+        column = {"emp": "uid", "team": "team_uid"}[kind]
+        conditions.append(f"{table}.{column} = ?")
+        params.append(value)
+    return f"({' OR '.join(conditions)})", params
+
+
+class _Changes:
+    """Rows and deletions read from Firestore but not yet written to DuckDB."""
+
+    def __init__(self) -> None:
+        self.rows: Dict[str, List[tuple]] = {table: [] for table in TABLES}
+        self.deleted: List[Tuple[str, Optional[datetime]]] = []
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self.rows.values()) + len(self.deleted)
+
+
+class AnalyticsStore:
+    """A DuckDB mirror of payments, incentives and call entries."""
+
+    def __init__(self, path: str = ANALYTICS_DB_PATH, max_staleness: float = ANALYTICS_MAX_STALENESS) -> None:
+        self.path = path
+        self.max_staleness = max_staleness
+        self.synced_at: Optional[float] = None
+        self._conn: Optional[duckdb.DuckDBPyConnection] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_duckdb_executor, functools.partial(func, *args))
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        if self._conn is None:
+            import duckdb
+
+            conn = duckdb.connect(self.path)
+            for table, columns in TABLES.items():
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{c} {t}' for c, t in columns)})")
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key VARCHAR PRIMARY KEY, value TIMESTAMP)")
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql: str, params: List[Any]) -> List[tuple]:
+        return self._connect().execute(sql, params).fetchall()
+
+    def _synced_at(self) -> Optional[datetime]:
+        rows = self._query("SELECT value FROM sync_state WHERE key = ?", [_SYNCED_AT])
+        return rows[0][0] if rows else None
+
+    def _write(self, changes: _Changes, clear: bool, synced_at: Optional[datetime]) -> None:
+        """Apply staged changes (and, once a sync completes, its start time) in one transaction."""
+        conn = self._connect()
+        conn.begin()
+        try:
+            if clear:
+                for table in (*TABLES, "sync_state"):
+                    conn.execute(f"DELETE FROM {table}")
+            for table, rows in changes.rows.items():
+                if not rows:
+                    continue
+                columns = TABLES[table]
+                staged = {
+                    name: _column(values, sql_type.split()[0]) for (name, sql_type), values in zip(columns, zip(*rows))
+                }
+                select = ", ".join(_select(name, sql_type.split()[0]) for name, sql_type in columns)
+                conn.register("staged", staged)
+                conn.execute(f"INSERT OR REPLACE INTO {table} SELECT {select} FROM staged")
+                conn.unregister("staged")
+            if changes.deleted:
+                ids, deleted_at = zip(*changes.deleted)
+                conn.register(
+                    "staged",
+                    {"id": _column(ids, "VARCHAR"), "deleted_at": _column(deleted_at, "TIMESTAMP")},
+                )
+                for table in ("payments", "incentives"):
+                    # A payment written again after its deletion is kept.
+                    conn.execute(
+                        f"DELETE FROM {table} USING staged WHERE {table}.id = staged.id "
+                        f"AND ({table}.updated_at IS NULL OR {table}.updated_at <= staged.deleted_at)"
+                    )
+                conn.unregister("staged")
+            if synced_at is not None:
+                conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", [_SYNCED_AT, synced_at])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    async def sync(self) -> Dict[str, int]:
+        """Read every change since the last sync into the mirror.
+
+        Returns:
+            The number of rows upserted per table and of tombstones applied.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await self._sync()
+
+    async def ensure_fresh(self) -> None:
+        """Sync unless the last sync happened within `max_staleness` seconds."""
+        if self.synced_at is not None and time.monotonic() - self.synced_at < self.max_staleness:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.synced_at is None or time.monotonic() - self.synced_at >= self.max_staleness:
+                await self._sync()
+
+    async def _sync(self) -> Dict[str, int]:
+        db = get_async_firestore_client()
+        started = time.monotonic()
+        now = _utc(datetime.now(timezone.utc))
+        last_sync = await self._run(self._synced_at)
+        rebuild = clear = last_sync is None or now - last_sync > TOMBSTONE_TTL
+        since = None if rebuild else last_sync.replace(tzinfo=timezone.utc) - ANALYTICS_SYNC_OVERLAP
+        counts: Counter = Counter()
+        changes = _Changes()
+
+        async def flush(final: bool = False) -> None:
+            nonlocal changes, clear
+            for table, rows in changes.rows.items():
+                counts[table] += len(rows)
+            counts["deleted"] += len(changes.deleted)
+            await self._run(self._write, changes, clear, now if final else None)
+            changes, clear = _Changes(), False
+
+        async def changed(collection: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+            query = db.collection(collection)
+            if since is not None:
+                query = query.where("updated_at", ">", since)
+            async for snap in query.stream():
+                yield snap.id, snap.to_dict()
+
+        for collection, table, to_row in (
+            (PAYMENTS_COLLECTION, "payments", _payment_row),
+            (INCENTIVES_COLLECTION, "incentives", _incentive_row),
+        ):
+            async for doc_id, doc in changed(collection):
+                changes.rows[table].append(to_row(doc_id, doc))
+                if len(changes) >= SYNC_BATCH_ROWS:
+                    await flush()
+        async for updated_at, records in call_service.stream_changed_documents(since):
+            changes.rows["calls"] += [_call_row(record, updated_at) for record in records]
+            if len(changes) >= SYNC_BATCH_ROWS:
+                await flush()
+        async for doc_id, doc in changed(TOMBSTONES_COLLECTION):
+            changes.deleted.append((doc_id, _utc(doc.get("updated_at"))))
+        await flush(final=True)
+        self.synced_at = time.monotonic()
+        return {**counts, "rebuilt": int(rebuild), "seconds": round(self.synced_at - started, 3)}
+
+    async def close(self) -> None:
+        """Close the DuckDB connection, if one was opened."""
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+            self.synced_at = None
+
+    async def overview(self, scope: str, from_date: date, to_date: date) -> Dict[str, Any]:
+        """Return the overview of `scope` for the range, shaped like `rollups.read_overview`."""
+        await self.ensure_fresh()
+        where, params = _scope_filter(scope, "p")
+        payment_rows = await self._run(
+            self._query,
+            f"""
+            SELECT GROUPING(p.service, p.customer_type), p.service, p.customer_type,
+                   count(*), coalesce(sum(p.amount_paid), 0), coalesce(sum(i.incentive_amount), 0)
+            FROM payments p LEFT JOIN incentives i ON i.id = p.id
+            WHERE p.date BETWEEN ? AND ? AND {where}
+            GROUP BY GROUPING SETS ((), (p.service), (p.customer_type))
+            """,
+            [from_date, to_date, *params],
+        )
+        where, params = _scope_filter(scope, "c")
+        (call_totals,) = await self._run(
+            self._query,
+            f"""
+            SELECT coalesce(sum(answered), 0), coalesce(sum(unanswered), 0),
+                   coalesce(sum(minutes), 0), coalesce(sum(demos), 0)
+            FROM calls c WHERE c.date BETWEEN ? AND ? AND {where}
+            """,
+            [from_date, to_date, *params],
+        )
+
+        overview = rollups.empty_overview()
+        answered, unanswered, minutes, demos = (int(value) for value in call_totals)
+        overview.update(
+            total_calls=answered + unanswered,
+            total_answered=answered,
+            total_unanswered=unanswered,
+            total_call_time_minutes=minutes,
+            total_demos=demos,
+        )
+        for level, service, customer_type, count, amount, incentives in payment_rows:
+            if level == 3:
+                overview["payment_count"] = count
+                overview["total_payments"] = round(amount, 2)
+                overview["total_incentives"] = round(incentives, 2)
+            elif level == 1:
+                overview["service_breakdown"][service] = {"count": count, "amount": amount}
+            else:
+                overview["customer_type_breakdown"][customer_type] = {"count": count, "amount": amount}
+        return overview
+
+    async def top_customers(self, scope: str, from_date: date, to_date: date, limit: int) -> List[Dict[str, Any]]:
+        """Return the top customers of `scope`, shaped like `customer_revenue.top_customers`.
+
+        Names are those of each customer's most recently written payment.
+        """
+        await self.ensure_fresh()
+        where, params = _scope_filter(scope, "p")
+        rows = await self._run(
+            self._query,
+            f"""
+            SELECT p.mobile, arg_max(p.customer_name, p.updated_at), arg_max(p.organization_name, p.updated_at),
+                   sum(p.amount_paid) AS revenue
+            FROM payments p
+            WHERE p.date BETWEEN ? AND ? AND {where}
+            GROUP BY p.mobile
+            ORDER BY revenue DESC, p.mobile
+            LIMIT ?
+            """,
+            [from_date, to_date, *params, limit],
+        )
+        return [
+            {"mobile": mobile, "customer_name": name, "organization_name": organization, "revenue": round(revenue, 2)}
+            for mobile, name, organization, revenue in rows
+        ]
+
+    async def trend_totals(
+        self, scope: str, from_date: date, to_date: date, granularity: str
+    ) -> List[Tuple[str, str, Optional[str], int, float]]:
+        """Return payment totals of `scope` per bucket, overall and per service and customer type.
+
+        Returns:
+            `(bucket start, group, name, count, amount)` rows, where `group`
+            is `""` for the overall totals (with `name` `None`), `services` or
+            `customer_types`.  Empty buckets are omitted.
+        """
+        await self.ensure_fresh()
+        where, params = _scope_filter(scope, "p")
+        rows = await self._run(
+            self._query,
+            f"""
+            SELECT CAST(date_trunc(?, p.date) AS DATE) AS bucket, GROUPING(p.service, p.customer_type),
+                   p.service, p.customer_type, count(*), sum(p.amount_paid)
+            FROM payments p
+            WHERE p.date BETWEEN ? AND ? AND {where}
+            GROUP BY GROUPING SETS ((bucket), (bucket, p.service), (bucket, p.customer_type))
+            """,
+            [granularity, from_date, to_date, *params],
+        )
+        totals = []
+        for bucket, level, service, customer_type, count, amount in rows:
+            if level == 3:
+                totals.append((bucket.isoformat(), "", None, count, amount))
+            elif level == 1:
+                totals.append((bucket.isoformat(), "services", service, count, amount))
+            else:
+                totals.append((bucket.isoformat(), "customer_types", customer_type, count, amount))
+        return totals
+
+
+store = AnalyticsStore()
@@ -0,0 +1,547 @@
+"""Call entry data access.
+
+Two storage layouts are supported, selected with `CALL_STORAGE_LAYOUT`:
+
+* `daily` (the default) stores one document per employee per day in the
+  `calls` collection, using the deterministic document ID `uid_date`.
+* `monthly` packs an employee's month into one `calls_monthly/{uid}_{YYYY-MM}`
+  document.  Its `days` map has one slot per day of the month (`"01"` to
+  `"31"`), and each slot holds the same fields as a daily document.  An upsert
+  merges a single slot, and listing a range reads at most one document per
+  employee-month.  A 90-day dashboard for a 40-person team therefore reads
+  about 160 documents instead of 3,600.
+
+`app.jobs.migrate_call_layout` copies existing daily documents into the
+monthly layout.  Entry IDs stay `uid_date` in both layouts.  Each upsert also
+refreshes the employee's totals in the daily rollups, the entry's demos in
+the demo index (see `app.services.demo_index`) and the versions of its scopes
+(see `app.services.versions`) within the same batch.
+
+Employees save the current day's entry again after every few calls, and
+Firestore throttles sustained writes to a single document.  With
+`CALL_WRITE_BEHIND_MS` set, upserts are written behind instead.  Each process
+keeps the latest entry per document in `write_buffer` and writes everything
+buffered during that many milliseconds as one bulk upsert.  Listing entries
+overlays the buffered ones, so a user reads their own writes on the instance
+that took them.  The buffer is flushed on shutdown.  Rollups, the demo index,
+versions and `call_entry` events follow when an entry is flushed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from google.cloud import firestore
+
+from .. import events
+from ..firestore import (
+    MAX_BATCH_WRITES,
+    apply_date_range,
+    get_async_firestore_client,
+    stream_concurrently,
+    uid_queries,
+)
+from ..models import CallEntry
+from ..pagination import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor, fetch_page
+from . import demo_index, rollups, versions
+
+
+logger = logging.getLogger(__name__)
+
+CALLS_COLLECTION = "calls"
+MONTHLY_CALLS_COLLECTION = "calls_monthly"
+
+# Storage layout for call entries: "daily" or "monthly" (see module docstring).
+CALL_STORAGE_LAYOUT = os.getenv("CALL_STORAGE_LAYOUT", "daily")
+
+# Fields that may be requested with `fields=` when listing entries.
+CALL_FIELDS = set(CallEntry.__fields__) | {"uid", "team_uid", "updated_at"}
+
+# Number of bulk upsert batches committed concurrently.
+BULK_COMMIT_CONCURRENCY = 4
+
+# Milliseconds upserts are buffered and coalesced before being written; 0
+# writes each upsert through (see module docstring).
+CALL_WRITE_BEHIND_MS = float(os.getenv("CALL_WRITE_BEHIND_MS", "0"))
+
+# Buffered documents at which an upsert waits for the buffer to be written.
+CALL_WRITE_BEHIND_MAX_PENDING = int(os.getenv("CALL_WRITE_BEHIND_MAX_PENDING", "1000"))
+
+
+def call_doc_id(uid: str, day: date) -> str:
+    """Return the deterministic document ID for `uid`'s entry on `day`."""
+    return f"{uid}_{day.isoformat()}"
+
+
+def month_key(day: date) -> str:
+    """Return the `YYYY-MM` month bucket of `day`."""
+    return day.isoformat()[:7]
+
+
+def monthly_doc_id(uid: str, month: str) -> str:
+    """Return the document ID of `uid`'s month bucket `month` (`YYYY-MM`)."""
+    return f"{uid}_{month}"
+
+
+def _next_month(month: str) -> str:
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def call_entry_to_doc(uid: str, team_uid: Optional[str], entry: CallEntry) -> Dict[str, Any]:
+    """Convert a `CallEntry` into its Firestore document representation."""
+    data = entry.dict()
+    data["date"] = entry.date.isoformat()
+    data["uid"] = uid
+    data["team_uid"] = team_uid
+    data["updated_at"] = firestore.SERVER_TIMESTAMP
+    return data
+
+
+def monthly_slot_write(uid: str, day: str, slot: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the merge payload that stores `slot` as `uid`'s entry for ISO date `day`.
+
+    Written with `merge=True`, only the fields of that day's slot and the
+    document's `updated_at` change; other days in the month document are left
+    untouched.
+    """
+    return {"uid": uid, "month": day[:7], "updated_at": firestore.SERVER_TIMESTAMP, "days": {day[8:10]: slot}}
+
+
+def write_call_entry(writer: Any, db: Any, uid: str, team_uid: Optional[str], entry: CallEntry) -> None:
+    """Add the write storing `entry` in the configured layout to a batch or transaction."""
+    data = call_entry_to_doc(uid, team_uid, entry)
+    if CALL_STORAGE_LAYOUT == "monthly":
+        ref = db.collection(MONTHLY_CALLS_COLLECTION).document(monthly_doc_id(uid, month_key(entry.date)))
+        writer.set(ref, monthly_slot_write(uid, data["date"], data), merge=True)
+    else:
+        writer.set(db.collection(CALLS_COLLECTION).document(call_doc_id(uid, entry.date)), data)
+
+
+def set_entry_team_uid(writer: Any, db: Any, record: Dict[str, Any], team_uid: Optional[str]) -> None:
+    """Add a write correcting the `team_uid` of a stored entry (as returned by `fetch_call_records`)."""
+    if CALL_STORAGE_LAYOUT == "monthly":
+        ref = db.collection(MONTHLY_CALLS_COLLECTION).document(monthly_doc_id(record["uid"], record["date"][:7]))
+        slot = {"team_uid": team_uid, "updated_at": firestore.SERVER_TIMESTAMP}
+        writer.set(ref, {"updated_at": firestore.SERVER_TIMESTAMP, "days": {record["date"][8:10]: slot}}, merge=True)
+    else:
+        writer.update(
+            db.collection(CALLS_COLLECTION).document(record["id"]),
+            {"team_uid": team_uid, "updated_at": firestore.SERVER_TIMESTAMP},
+        )
+
+
+def _month_records(month_doc: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield the entries packed in a monthly document, shaped like daily documents."""
+    uid = month_doc.get("uid")
+    for slot in (month_doc.get("days") or {}).values():
+        yield {"id": f"{uid}_{slot['date']}", **slot}
+
+
+def _publish_entry(uid: str, team_uid: Optional[str], entry: CallEntry) -> None:
+    """Publish a `call_entry` event; the entry replaces any earlier one for that day."""
+    data = {"entry_id": call_doc_id(uid, entry.date), **entry.dict(), "date": entry.date.isoformat()}
+    events.publish("call_entry", uid, team_uid, data)
+
+
+async def upsert_call_entry(uid: str, team_uid: Optional[str], entry: CallEntry) -> str:
+    """Create or replace `uid`'s call entry for `entry.date` and return its ID.
+
+    Args:
+        uid: Employee who owns the entry.
+        team_uid: Manager whose team the employee belongs to, if any.
+        entry: The call entry to store.
+
+    With write-behind enabled the entry is buffered and written by the next
+    flush of `write_buffer`.
+    """
+    if write_buffer.enabled:
+        return await write_buffer.put(uid, team_uid, entry)
+    db = get_async_firestore_client()
+    batch = db.batch()
+    write_call_entry(batch, db, uid, team_uid, entry)
+    demo_index.write_call_entry(batch, db, uid, team_uid, entry)
+    rollups.write_call_entry(batch, db, uid, team_uid, entry)
+    versions.bump_record(batch, db, uid, team_uid)
+    await batch.commit()
+    _publish_entry(uid, team_uid, entry)
+    return call_doc_id(uid, entry.date)
+
+
+def plan_bulk_batches(
+    items: List[Tuple[str, Optional[str], CallEntry]], max_writes: int = MAX_BATCH_WRITES
+) -> List[Tuple[List[int], Dict[str, Dict[str, Any]]]]:
+    """Group call entry upserts into batches that respect the write limit.
+
+    Rollup updates for the same day and scope, and the version bumps of the
+    same scope, are coalesced so that each document is written once per
+    batch.  An entry, its demo index write, its rollup updates and its scope
+    versions always land in the same batch.
+
+    Returns:
+        For each batch, the indexes of the items it contains and the merged
+        rollup payloads keyed by rollup document ID.
+    """
+    batches: List[Tuple[List[int], Dict[str, Dict[str, Any]]]] = []
+    indexes: List[int] = []
+    pending: Dict[str, Dict[str, Any]] = {}
+    scopes: Set[str] = set()
+    for index, (uid, team_uid, entry) in enumerate(items):
+        updates = rollups.call_entry_updates(uid, team_uid, entry)
+        new_docs = sum(1 for doc_id in updates if doc_id not in pending)
+        new_scopes = set(rollups.stored_scopes_for(uid, team_uid)) - scopes
+        # Each entry writes its own document and its demo index entry.
+        writes = 2 * (len(indexes) + 1) + len(pending) + new_docs + len(scopes) + len(new_scopes)
+        if indexes and writes > max_writes:
+            batches.append((indexes, pending))
+            indexes, pending, scopes = [], {}, set()
+            new_scopes = set(rollups.stored_scopes_for(uid, team_uid))
+        indexes.append(index)
+        rollups.merge_call_updates(pending, updates)
+        scopes |= new_scopes
+    if indexes:
+        batches.append((indexes, pending))
+    return batches
+
+
+async def bulk_upsert_call_entries(items: List[Tuple[str, Optional[str], CallEntry]]) -> List[Optional[str]]:
+    """Upsert many call entries using chunked batch commits.
+
+    Args:
+        items: `(uid, team_uid, entry)` tuples.  Each `(uid, entry.date)` pair
+            must appear at most once.
+
+    Returns:
+        For each item, `None` on success or the error message of the batch
+        commit that failed.
+    """
+    async with write_buffer.write_through(call_doc_id(uid, entry.date) for uid, _, entry in items):
+        return await _write_entries(items)
+
+
+async def _write_entries(items: List[Tuple[str, Optional[str], CallEntry]]) -> List[Optional[str]]:
+    """`bulk_upsert_call_entries` without regard to the write-behind buffer."""
+    db = get_async_firestore_client()
+    errors: List[Optional[str]] = [None] * len(items)
+    semaphore = asyncio.Semaphore(BULK_COMMIT_CONCURRENCY)
+
+    async def commit(indexes: List[int], rollup_updates: Dict[str, Dict[str, Any]]) -> None:
+        batch = db.batch()
+        for index in indexes:
+            uid, team_uid, entry = items[index]
+            write_call_entry(batch, db, uid, team_uid, entry)
+            demo_index.write_call_entry(batch, db, uid, team_uid, entry)
+        for doc_id, payload in rollup_updates.items():
+            batch.set(db.collection(rollups.ROLLUPS_COLLECTION).document(doc_id), payload, merge=True)
+        scopes = {scope for index in indexes for scope in rollups.stored_scopes_for(items[index][0], items[index][1])}
+        versions.bump(batch, db, sorted(scopes))
+        async with semaphore:
+            try:
+                await batch.commit()
+            except Exception as exc:  # reported per item rather than failing the whole request
+                for index in indexes:
+                    errors[index] = f"Commit failed: {exc}"
+                return
+        for index in indexes:
+            _publish_entry(*items[index])
+
+    await asyncio.gather(*(commit(indexes, updates) for indexes, updates in plan_bulk_batches(items)))
+    return errors
+
+
+async def list_call_entries(
+    uids: Optional[List[str]],
+    from_date: Optional[date],
+    to_date: Optional[date],
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return one page of call entries for `uids` (or everyone when `None`).
+
+    Entries still in the write-behind buffer are included.
+
+    Returns:
+        The entries ordered by date and document ID, and the cursor for the
+        next page (`None` on the last page).
+    """
+    # Taken before the query, so an entry flushed meanwhile is in one or the other.
+    buffered = write_buffer.records(uids, from_date, to_date)
+    if CALL_STORAGE_LAYOUT == "monthly":
+        page = await _list_monthly(uids, from_date, to_date, cursor, limit, fields)
+    else:
+        db = get_async_firestore_client()
+        collection = db.collection(CALLS_COLLECTION)
+        base = apply_date_range(collection, from_date, to_date)
+        page = await fetch_page(collection, base, uids, cursor, limit, fields)
+    return _overlay(page, buffered, cursor, limit, fields) if buffered else page
+
+
+def _overlay(
+    page: Tuple[List[Dict[str, Any]], Optional[str]],
+    buffered: List[Dict[str, Any]],
+    cursor: Optional[str],
+    limit: int,
+    fields: Optional[List[str]],
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Merge buffered entries into a page of stored ones.
+
+    A buffered entry replaces its stored version and is added when it sorts
+    within the page.  Entries pushed past `limit` start the next page.
+    """
+    items, next_cursor = page
+    after = decode_cursor(cursor) if cursor else None
+    until = (items[-1]["date"], items[-1]["id"]) if next_cursor else None
+    merged = {item["id"]: item for item in items}
+    for record in buffered:
+        key = (record["date"], record["id"])
+        if (after is None or key > after) and (until is None or key <= until):
+            if fields is not None:
+                record = {"id": record["id"], **{name: record[name] for name in fields if name in record}}
+            merged[record["id"]] = record
+    items = sorted(merged.values(), key=lambda item: (item["date"], item["id"]))
+    if len(items) <= limit:
+        return items, next_cursor
+    items = items[:limit]
+    return items, encode_cursor(items[-1]["date"], items[-1]["id"])
+
+
+async def _first_month(collection: Any, uids: Optional[List[str]], from_month: Optional[str]) -> Optional[str]:
+    """Return the earliest month on or after `from_month` holding entries for `uids`."""
+    query = collection if from_month is None else collection.where("month", ">=", from_month)
+    results = await stream_concurrently(
+        [chunk.order_by("month").limit(1) for chunk in uid_queries(query, uids)]
+    )
+    months = [snaps[0].get("month") for snaps in results if snaps]
+    return min(months) if months else None
+
+
+async def _list_monthly(
+    uids: Optional[List[str]],
+    from_date: Optional[date],
+    to_date: Optional[date],
+    cursor: Optional[str],
+    limit: int,
+    fields: Optional[List[str]],
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """`list_call_entries` for the monthly layout.
+
+    Months are read one at a time, starting at the page's first day, until
+    the page is full.  A page therefore reads one document per employee for
+    each month it spans.  A month with no entries at all is skipped by
+    jumping to the next month that has any.
+    """
+    db = get_async_firestore_client()
+    collection = db.collection(MONTHLY_CALLS_COLLECTION)
+    after = decode_cursor(cursor) if cursor else None
+    first_day = from_date.isoformat() if from_date else None
+    if after and (first_day is None or after[0] > first_day):
+        first_day = after[0]
+    last_day = to_date.isoformat() if to_date else None
+    last_month = last_day[:7] if last_day else None
+
+    def wanted(record: Dict[str, Any]) -> bool:
+        if first_day is not None and record["date"] < first_day:
+            return False
+        if last_day is not None and record["date"] > last_day:
+            return False
+        return after is None or (record["date"], record["id"]) > after
+
+    month = first_day[:7] if first_day else await _first_month(collection, uids, None)
+    items: List[Dict[str, Any]] = []
+    while month is not None and (last_month is None or month <= last_month) and len(items) <= limit:
+        results = await stream_concurrently(uid_queries(collection.where("month", "==", month), uids))
+        if any(results):
+            for snaps in results:
+                for snap in snaps:
+                    items.extend(record for record in _month_records(snap.to_dict()) if wanted(record))
+            month = _next_month(month)
+        else:
+            month = await _first_month(collection, uids, _next_month(month))
+    items.sort(key=lambda item: (item["date"], item["id"]))
+    if fields is not None:
+        items = [{"id": item["id"], **{name: item[name] for name in fields if name in item}} for item in items]
+
+    if len(items) <= limit:
+        return items, None
+    page = items[:limit]
+    return page, encode_cursor(page[-1]["date"], page[-1]["id"])
+
+
+async def fetch_call_records(from_date: date, to_date: date) -> List[Dict[str, Any]]:
+    """Return every stored entry between `from_date` and `to_date`, whatever the layout.
+
+    Each record has the fields of a daily document plus its `id`.
+    """
+    db = get_async_firestore_client()
+    if CALL_STORAGE_LAYOUT != "monthly":
+        query = apply_date_range(db.collection(CALLS_COLLECTION), from_date, to_date)
+        return [{"id": snap.id, **snap.to_dict()} async for snap in query.stream()]
+    query = (
+        db.collection(MONTHLY_CALLS_COLLECTION)
+        .where("month", ">=", month_key(from_date))
+        .where("month", "<=", month_key(to_date))
+    )
+    first, last = from_date.isoformat(), to_date.isoformat()
+    return [
+        record
+        async for snap in query.stream()
+        for record in _month_records(snap.to_dict())
+        if first <= record["date"] <= last
+    ]
+
+
+async def stream_changed_documents(since: Optional[datetime]) -> AsyncIterator[Tuple[Any, List[Dict[str, Any]]]]:
+    """Yield the `updated_at` and entries of every call document written after `since`.
+
+    Reads the collection of the configured layout; `None` reads every
+    document.  In the monthly layout a changed month yields all of its
+    entries.  Each entry has the fields of a daily document plus its `id`.
+    """
+    db = get_async_firestore_client()
+    collection = MONTHLY_CALLS_COLLECTION if CALL_STORAGE_LAYOUT == "monthly" else CALLS_COLLECTION
+    query = db.collection(collection)
+    if since is not None:
+        query = query.where("updated_at", ">", since)
+    async for snap in query.stream():
+        doc = snap.to_dict()
+        if CALL_STORAGE_LAYOUT == "monthly":
+            yield doc.get("updated_at"), list(_month_records(doc))
+        else:
+            yield doc.get("updated_at"), [{"id": snap.id, **doc}]
+
+
+class CallWriteBuffer:
+    """Per-process write-behind buffer for call entry upserts (see module docstring).
+
+    Entries are keyed by document ID, so repeated upserts of the same day
+    overwrite each other in memory and only the latest is written.  One
+    flush runs at a time, which keeps an older entry from landing after a
+    newer one.
+    """
+
+    def __init__(
+        self, window_ms: float = CALL_WRITE_BEHIND_MS, max_pending: int = CALL_WRITE_BEHIND_MAX_PENDING
+    ) -> None:
+        self.window = window_ms / 1000
+        self.max_pending = max_pending
+        self._pending: Dict[str, Tuple[str, Optional[str], CallEntry]] = {}
+        # Entries of the flush in progress; still visible to reads.
+        self._writing: Dict[str, Tuple[str, Optional[str], CallEntry]] = {}
+        self._flushing = asyncio.Lock()
+        self._timer: Optional["asyncio.Task[None]"] = None
+        self.counters: Counter = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def put(self, uid: str, team_uid: Optional[str], entry: CallEntry) -> str:
+        """Buffer `entry` for `uid`, replacing any buffered entry for that day, and return its ID."""
+        doc_id = call_doc_id(uid, entry.date)
+        self.counters["buffered"] += 1
+        if doc_id in self._pending:
+            self.counters["coalesced"] += 1
+        self._pending[doc_id] = (uid, team_uid, entry)
+        if len(self._pending) >= self.max_pending:
+            # Back-pressure: when writes fall behind, callers wait for them.
+            await self.flush()
+        else:
+            self._schedule()
+        return doc_id
+
+    def _schedule(self) -> None:
+        if self._timer is None and self._pending:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Write every buffered entry and return how many were written.
+
+        Entries whose batch fails stay buffered and are retried by the next
+        flush, unless a newer entry for the same day was buffered meanwhile.
+        """
+        async with self._flushing:
+            self._writing, self._pending = self._pending, {}
+            if not self._writing:
+                return 0
+            try:
+                errors = await _write_entries(list(self._writing.values()))
+            except Exception as exc:  # retried rather than lost
+                errors = [f"Commit failed: {exc}"] * len(self._writing)
+            failed = [doc_id for doc_id, error in zip(self._writing, errors) if error]
+            for doc_id in failed:
+                self._pending.setdefault(doc_id, self._writing[doc_id])
+            written = len(self._writing) - len(failed)
+            self._writing = {}
+            self.counters["flushes"] += 1
+            self.counters["written"] += written
+            if failed:
+                self.counters["failed"] += len(failed)
+                logger.warning("%d buffered call entries were not written and will be retried", len(failed))
+            self._schedule()
+            return written
+
+    @asynccontextmanager
+    async def write_through(self, doc_ids: Iterable[str]) -> AsyncIterator[None]:
+        """Hold back flushes while the caller writes `doc_ids` directly.
+
+        Buffered entries for those documents are dropped, since the direct
+        write is newer.  Documents with nothing buffered do not wait.
+        """
+        doc_ids = set(doc_ids)
+        if doc_ids.isdisjoint(self._pending) and doc_ids.isdisjoint(self._writing):
+            yield
+            return
+        async with self._flushing:
+            for doc_id in doc_ids:
+                self._pending.pop(doc_id, None)
+            yield
+
+    def records(
+        self, uids: Optional[List[str]], from_date: Optional[date], to_date: Optional[date]
+    ) -> List[Dict[str, Any]]:
+        """Return the buffered entries of `uids` (everyone when `None`) in the range, shaped like daily documents."""
+        if not self._pending and not self._writing:
+            return []
+        wanted = None if uids is None else set(uids)
+        now = datetime.now(timezone.utc)
+        return [
+            {"id": doc_id, **call_entry_to_doc(uid, team_uid, entry), "updated_at": now}
+            for doc_id, (uid, team_uid, entry) in {**self._writing, **self._pending}.items()
+            if (wanted is None or uid in wanted)
+            and (from_date is None or entry.date >= from_date)
+            and (to_date is None or entry.date <= to_date)
+        ]
+
+    async def close(self) -> None:
+        """Cancel the pending timer and write everything still buffered."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            logger.error("%d buffered call entries could not be written before shutdown", len(self._pending))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "pending": len(self._pending) + len(self._writing),
+            **self.counters,
+        }
+
+
+write_buffer = CallWriteBuffer()
@@ -0,0 +1,190 @@
+"""Per-customer revenue index used for top-customer rankings.
+
+Two structures are maintained in the same batch or transaction as every
+payment write:
+
+* `customer_revenue/{mobile}` – one document per customer (keyed by the
+  normalised mobile number) holding the latest name, organisation, lifetime
+  total and a `months` map of revenue per `YYYY-MM`.
+* `customer_revenue_months/{scope}_{YYYY-MM}_{shard}` – month buckets per
+  rollup scope (see `app.services.rollups`), mapping each mobile number to
+  the revenue received from it in that month.
+* `customer_revenue_days/{scope}_{YYYY-MM-DD}_{shard}` – day buckets of the
+  same shape, for the days of months a range only partly covers.
+
+A team or organisation bucket keeps an entry for every customer of the
+month, which would outgrow Firestore's 1 MiB document limit and take a
+write from every payment.  Those buckets are therefore split into
+`BUCKET_SHARDS` documents by a hash of the mobile number, so each customer
+lives in exactly one shard; an employee's bucket is a single shard.  Day
+buckets are sharded the same way, as today's bucket takes as many writes
+as this month's.  The `customers` map must be exempted from single-field
+indexing (a field override on `customers` in both collections), or every
+entry counts against the index-entry limit.
+
+A top-customers query for a date range reads every shard of the bucket for
+every whole month in the range and merges them with the threshold algorithm
+in `app.ranking`.  The days of partial months at either end of the range
+are added up from the day buckets into one bucket per edge, so no query
+reads payments.  Sorted month shard contents are cached in process and
+only re-sorted when the shard document changes.
+"""
+
+from __future__ import annotations
+
+import os
+import zlib
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+from google.cloud import firestore
+
+from ..cache import TTLCache
+from ..firestore import get_async_firestore_client
+from ..ranking import Bucket, SortedBucket, sort_bucket, split_range, top_k_merge
+from . import rollups
+
+
+CUSTOMERS_COLLECTION = "customer_revenue"
+MONTH_BUCKETS_COLLECTION = "customer_revenue_months"
+DAY_BUCKETS_COLLECTION = "customer_revenue_days"
+
+# Documents each team and organisation month or day bucket is split over, by
+# mobile number.
+BUCKET_SHARDS = 16
+
+# Sorted shard contents keyed by shard document ID, with the update time of
+# the document they were built from.
+_sorted_buckets = TTLCache(
+    maxsize=int(os.getenv("CUSTOMER_BUCKET_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("CUSTOMER_BUCKET_CACHE_TTL", "3600")),
+)
+
+
+def normalize_mobile(mobile: str) -> str:
+    """Return `mobile` with formatting characters removed."""
+    return "".join(ch for ch in mobile if ch.isdigit() or ch == "+")
+
+
+def month_key(day: str) -> str:
+    """Return the `YYYY-MM` bucket for an ISO date string."""
+    return day[:7]
+
+
+def bucket_shards(scope: str) -> int:
+    """Return the number of documents the month and day buckets of `scope` are split over."""
+    return 1 if scope.startswith(rollups.employee_scope("")) else BUCKET_SHARDS
+
+
+def bucket_doc_id(scope: str, period: str, shard: int) -> str:
+    """Return the document ID of one shard of the month (`YYYY-MM`) or day bucket for `scope`."""
+    return f"{scope}_{period}_{shard}"
+
+
+def bucket_shard(scope: str, mobile: str) -> int:
+    """Return the shard of the buckets of `scope` holding `mobile`."""
+    return zlib.crc32(mobile.encode("utf-8")) % bucket_shards(scope)
+
+
+def write_payment_delta(writer: Any, db: Any, payment: Dict[str, Any], sign: int) -> None:
+    """Add index writes applying (`sign=1`) or reverting (`sign=-1`) a payment.
+
+    `payment` is the stored payment document.
+    """
+    mobile = normalize_mobile(payment["mobile"])
+    day = payment["date"]
+    month = month_key(day)
+    amount = firestore.Increment(sign * float(payment["amount_paid"]))
+    customer = {"mobile": mobile, "total": amount, "months": {month: amount}}
+    if sign > 0:
+        customer["customer_name"] = payment.get("customer_name")
+        customer["organization_name"] = payment.get("organization_name")
+    writer.set(db.collection(CUSTOMERS_COLLECTION).document(mobile), customer, merge=True)
+    for scope in rollups.scopes_for(payment["uid"], payment.get("team_uid")):
+        shard = bucket_shard(scope, mobile)
+        writer.set(
+            db.collection(MONTH_BUCKETS_COLLECTION).document(bucket_doc_id(scope, month, shard)),
+            {"scope": scope, "month": month, "customers": {mobile: amount}},
+            merge=True,
+        )
+        writer.set(
+            db.collection(DAY_BUCKETS_COLLECTION).document(bucket_doc_id(scope, day, shard)),
+            {"scope": scope, "date": day, "customers": {mobile: amount}},
+            merge=True,
+        )
+
+
+def _cached_sorted_bucket(doc_id: str, update_time: Any, customers: Bucket) -> Tuple[Bucket, SortedBucket]:
+    """Return the sorted form of a bucket shard, re-sorting only when it changed."""
+    cached = _sorted_buckets.get(doc_id)
+    if cached is not None and cached[0] == update_time:
+        return cached[1], cached[2]
+    ordered = sort_bucket(customers)
+    _sorted_buckets.set(doc_id, (update_time, customers, ordered))
+    return customers, ordered
+
+
+def _bucket_refs(db: Any, collection: str, scope: str, periods: List[str]) -> List[Any]:
+    """Return every shard of the buckets of `scope` (every part's, for a union scope) for `periods`."""
+    return [
+        db.collection(collection).document(bucket_doc_id(part, period, shard))
+        for period in periods
+        for part in rollups.scope_parts(scope)
+        for shard in range(bucket_shards(part))
+    ]
+
+
+async def top_customers(scope: str, from_date: date, to_date: date, limit: int) -> List[Dict[str, Any]]:
+    """Return the top `limit` customers by revenue for `scope` in the range.
+
+    Reads the month buckets of the whole months and the day buckets of the
+    partial months at the edges in one `get_all`.
+
+    Args:
+        scope: Rollup scope whose buckets are read (every part's, for a union
+            scope).
+        from_date: First day of the range.
+        to_date: Last day of the range.
+        limit: Number of customers to return.
+    """
+    db = get_async_firestore_client()
+    months, partial = split_range(from_date, to_date)
+    edge_days: Dict[str, int] = {}
+    for edge, (start, end) in enumerate(partial):
+        for offset in range((end - start).days + 1):
+            edge_days[(start + timedelta(days=offset)).isoformat()] = edge
+
+    buckets: List[Tuple[Bucket, SortedBucket]] = []
+    edges: List[Bucket] = [defaultdict(float) for _ in partial]
+    refs = _bucket_refs(db, MONTH_BUCKETS_COLLECTION, scope, months)
+    refs += _bucket_refs(db, DAY_BUCKETS_COLLECTION, scope, list(edge_days))
+    if refs:
+        async for snap in db.get_all(refs):
+            if not snap.exists:
+                continue
+            data = snap.to_dict()
+            customers = {k: float(v) for k, v in (data.get("customers") or {}).items()}
+            if "date" in data:
+                for mobile, amount in customers.items():
+                    edges[edge_days[data["date"]]][mobile] += amount
+            else:
+                buckets.append(_cached_sorted_bucket(snap.id, snap.update_time, customers))
+    buckets += [(dict(edge), sort_bucket(edge)) for edge in edges if edge]
+
+    ranked = top_k_merge(buckets, limit)
+    if not ranked:
+        return []
+    profiles: Dict[str, Dict[str, Any]] = {}
+    async for snap in db.get_all([db.collection(CUSTOMERS_COLLECTION).document(mobile) for mobile, _ in ranked]):
+        if snap.exists:
+            profiles[snap.id] = snap.to_dict()
+    return [
+        {
+            "mobile": mobile,
+            "customer_name": profiles.get(mobile, {}).get("customer_name"),
+            "organization_name": profiles.get(mobile, {}).get("organization_name"),
+            "revenue": round(revenue, 2),
+        }
+        for mobile, revenue in ranked
+    ]
@@ -0,0 +1,194 @@
+"""Flattened demo index and the demo-to-payment conversion funnel.
+
+Demos are nested in call entries (`CallEntry.demos`) and payments carry their
+own `customer_card_link`.  Two index collections are written in the same
+batch as the records they derive from, so the funnel never reads either:
+
+* `demo_index/{uid}_{date}` – the demos of one call entry, with the owning
+  employee, team, date and the card key of each demo.  Every call entry
+  write replaces it, or deletes it when the entry has no demos.
+* `card_payments/{card_key}` – the payments received on one customer card,
+  mapping each payment ID to its date, amount and employee.  Every payment
+  write updates its slot.
+
+A card key is a hash of the normalised card link, so a demo and the payments
+on the same card meet on one key.  `Demo` records no mobile number, so the
+card link is the only join key.
+
+A card demoed by an employee converts when it has a payment dated on or after
+that employee's first demo of it in the range; the days in between are its
+time to conversion.  A card demoed by several employees counts for each of
+them.  Entries and payments written before the index existed are indexed by
+`app.jobs.rebuild_demo_index`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from ..firestore import apply_date_range, get_async_firestore_client
+from ..models import CallEntry
+from . import rollups
+
+
+DEMO_INDEX_COLLECTION = "demo_index"
+CARD_PAYMENTS_COLLECTION = "card_payments"
+
+# Upper bounds (days, inclusive) of the time-to-conversion histogram buckets.
+TIME_TO_CONVERSION_BUCKETS = (0, 7, 30, 90)
+
+
+def card_key(card_link: str) -> str:
+    """Return the key of a demo or customer card link."""
+    normalised = card_link.strip().rstrip("/")
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
+
+def demo_index_doc(uid: str, team_uid: Optional[str], entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the index document for a stored call entry, or `None` if it has no demos."""
+    demos = [
+        {
+            "card": card_key(demo["demo_card_link"]),
+            "demo_card_link": demo["demo_card_link"],
+            "demo_time_minutes": demo["demo_time_minutes"],
+        }
+        for demo in entry.get("demos") or []
+    ]
+    if not demos:
+        return None
+    return {
+        "uid": uid,
+        "team_uid": team_uid,
+        "date": entry["date"],
+        "demos": demos,
+        "cards": sorted({demo["card"] for demo in demos}),
+    }
+
+
+def write_call_entry(writer: Any, db: Any, uid: str, team_uid: Optional[str], entry: CallEntry) -> None:
+    """Add the write replacing the index of a call entry to `writer` (a batch or transaction)."""
+    day = entry.date.isoformat()
+    ref = db.collection(DEMO_INDEX_COLLECTION).document(f"{uid}_{day}")
+    doc = demo_index_doc(uid, team_uid, {**entry.dict(), "date": day})
+    if doc is None:
+        writer.delete(ref)
+    else:
+        writer.set(ref, doc)
+
+
+def write_payment_delta(writer: Any, db: Any, payment_id: str, payment: Dict[str, Any], sign: int) -> None:
+    """Add the write adding (`sign=1`) or removing (`sign=-1`) a payment on its card.
+
+    `payment` is the stored payment document.
+    """
+    link = payment["customer_card_link"]
+    ref = db.collection(CARD_PAYMENTS_COLLECTION).document(card_key(link))
+    if sign > 0:
+        slot = {"date": payment["date"], "amount_paid": float(payment["amount_paid"]), "uid": payment["uid"]}
+        writer.set(ref, {"card_link": link, "payments": {payment_id: slot}}, merge=True)
+    else:
+        writer.set(ref, {"payments": {payment_id: firestore.DELETE_FIELD}}, merge=True)
+
+
+def _histogram_labels() -> List[str]:
+    labels, low = [], 0
+    for high in TIME_TO_CONVERSION_BUCKETS:
+        labels.append(str(high) if low == high else f"{low}-{high}")
+        low = high + 1
+    return labels + [f"{low}+"]
+
+
+def _funnel(demos: int, cards: int, days: List[int], revenue: float) -> Dict[str, Any]:
+    """Summarise the conversions of a set of demoed cards."""
+    days = sorted(days)
+    histogram = dict.fromkeys(_histogram_labels(), 0)
+    labels = list(histogram)
+    for value in days:
+        bucket = next((n for n, high in enumerate(TIME_TO_CONVERSION_BUCKETS) if value <= high), len(labels) - 1)
+        histogram[labels[bucket]] += 1
+
+    def percentile(q: float) -> Optional[int]:
+        return days[max(0, math.ceil(q * len(days)) - 1)] if days else None
+
+    return {
+        "demos": demos,
+        "demoed_cards": cards,
+        "converted_cards": len(days),
+        "conversion_rate": round(len(days) / cards, 4) if cards else 0.0,
+        "converted_revenue": round(revenue, 2),
+        "time_to_conversion_days": {
+            "median": percentile(0.5),
+            "p90": percentile(0.9),
+            "mean": round(sum(days) / len(days), 2) if days else None,
+            "histogram": histogram,
+        },
+    }
+
+
+async def conversion_funnel(scope: str, from_date: date, to_date: date) -> Dict[str, Any]:
+    """Return demo-to-payment conversion for the demos of `scope` in the range.
+
+    Reads the demo index entries in the range, then the payments of every
+    demoed card in one `get_all`.
+
+    Args:
+        scope: Rollup scope (see `app.services.rollups`) whose demos count;
+            a union scope is read one part at a time.
+        from_date: First day of the range.
+        to_date: Last day of the range.
+
+    Returns:
+        The overall funnel and one funnel per employee who gave a demo.
+        Payments on or after the demo count, however long after the range.
+    """
+    db = get_async_firestore_client()
+    demo_counts: Dict[str, int] = defaultdict(int)
+    first_demo: Dict[Tuple[str, str], str] = {}
+    # The parts of a union scope never share an entry; each is one query.
+    for part in rollups.scope_parts(scope):
+        query = apply_date_range(db.collection(DEMO_INDEX_COLLECTION), from_date, to_date)
+        if part != rollups.ALL_SCOPE:
+            kind, _, value = part.partition(":")
+            query = query.where("uid" if kind == "emp" else "team_uid", "==", value)
+        async for snap in query.stream():
+            entry = snap.to_dict()
+            demo_counts[entry["uid"]] += len(entry.get("demos") or [])
+            for card in entry.get("cards") or []:
+                key = (entry["uid"], card)
+                if key not in first_demo or entry["date"] < first_demo[key]:
+                    first_demo[key] = entry["date"]
+
+    payments: Dict[str, List[Tuple[str, float]]] = {}
+    cards = sorted({card for _, card in first_demo})
+    if cards:
+        refs = [db.collection(CARD_PAYMENTS_COLLECTION).document(card) for card in cards]
+        async for snap in db.get_all(refs):
+            if snap.exists:
+                slots = (snap.to_dict().get("payments") or {}).values()
+                payments[snap.id] = sorted((slot["date"], float(slot["amount_paid"])) for slot in slots)
+
+    def summarise(demos: int, demoed: Dict[str, str]) -> Dict[str, Any]:
+        days: List[int] = []
+        revenue = 0.0
+        for card, day in demoed.items():
+            later = [(paid, amount) for paid, amount in payments.get(card, []) if paid >= day]
+            if later:
+                days.append((date.fromisoformat(later[0][0]) - date.fromisoformat(day)).days)
+                revenue += sum(amount for _, amount in later)
+        return _funnel(demos, len(demoed), days, revenue)
+
+    by_employee: Dict[str, Dict[str, str]] = defaultdict(dict)
+    overall: Dict[str, str] = {}
+    for (uid, card), day in first_demo.items():
+        by_employee[uid][card] = day
+        overall[card] = min(day, overall.get(card, day))
+    return {
+        **summarise(sum(demo_counts.values()), overall),
+        "employees": [{"uid": uid, **summarise(demo_counts[uid], by_employee[uid])} for uid in sorted(by_employee)],
+    }
@@ -0,0 +1,71 @@
+"""Incentive computation and data access.
+
+Each payment has exactly one incentive, stored in the `incentives` collection
+under the same document ID as the payment.  The service-specific base
+percentage and the global incentive percentage come from the `config/master`
+document maintained on the admin master page, served from the in-process
+cache in `app.services.master_data`.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from ..firestore import apply_date_range, get_async_firestore_client
+from ..models import Incentive, Payment
+from ..pagination import DEFAULT_PAGE_SIZE, fetch_page
+
+
+INCENTIVES_COLLECTION = "incentives"
+
+# Fields that may be requested with `fields=` when listing incentives.
+INCENTIVE_FIELDS = set(Incentive.__fields__) | {"uid", "updated_at"}
+
+
+def compute_incentive_amount(amount_paid: float, base_percent: float, global_percent: float) -> float:
+    """Return the incentive for a payment.
+
+    The service's base percentage of the amount paid forms the incentive pool,
+    of which the global incentive percentage is paid out.
+    """
+    return round(amount_paid * base_percent / 100 * global_percent / 100, 2)
+
+
+def build_incentive_doc(
+    payment_id: str, uid: str, payment: Payment, base_percent: float, global_percent: float
+) -> Dict[str, Any]:
+    """Build the incentive document for a payment."""
+    return {
+        "payment_id": payment_id,
+        "uid": uid,
+        "date": payment.date.isoformat(),
+        "service": payment.service,
+        "amount_paid": payment.amount_paid,
+        "base_percent": base_percent,
+        "global_percent": global_percent,
+        "incentive_amount": compute_incentive_amount(payment.amount_paid, base_percent, global_percent),
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+
+
+async def list_incentives(
+    uids: Optional[List[str]],
+    from_date: Optional[date],
+    to_date: Optional[date],
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return one page of incentives for `uids` (or everyone when `None`).
+
+    Returns:
+        The incentives ordered by date and document ID, and the cursor for the
+        next page (`None` on the last page).
+    """
+    db = get_async_firestore_client()
+    collection = db.collection(INCENTIVES_COLLECTION)
+    base = apply_date_range(collection, from_date, to_date)
+    return await fetch_page(collection, base, uids, cursor, limit, fields)
@@ -0,0 +1,115 @@
+"""In-process cache of the master configuration.
+
+The `config/master` document holds the configured services with their base
+incentive percentages and the global incentive percentage.  Every payment
+write needs them, so rather than reading the document on each request it is
+loaded once per process and served from memory.
+
+Freshness is maintained by a version check: once the cached copy is older
+than `MASTER_DATA_TTL` seconds, the next caller still gets the cached copy
+immediately while the document is re-read in the background, and the cache
+is only rebuilt when the document's `update_time` has changed.  Edits made
+on the admin master page therefore reach every instance within about
+`MASTER_DATA_TTL` seconds, without any request waiting on Firestore.  Code
+that must see the latest percentages (incentive recalculation) asks for
+`max_age=0`, and `invalidate_master_data` drops the cache outright.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from ..firestore import get_async_firestore_client
+
+
+CONFIG_COLLECTION = "config"
+MASTER_CONFIG_DOC = "master"
+
+# Seconds a loaded configuration is served before it is re-checked.
+MASTER_DATA_TTL = float(os.getenv("MASTER_DATA_TTL", "30"))
+
+
+class MasterData:
+    """Immutable snapshot of the master configuration."""
+
+    def __init__(self, config: Dict[str, Any], version: Any = None) -> None:
+        self.base_percents: Dict[str, float] = {
+            name: float(spec["base_percent"]) for name, spec in (config.get("services") or {}).items()
+        }
+        self.global_percent = float(config.get("global_percent", 0))
+        self.version = version
+
+    @property
+    def services(self) -> Tuple[str, ...]:
+        """Configured service names, sorted."""
+        return tuple(sorted(self.base_percents))
+
+    def validate_service(self, service: str) -> None:
+        """Raise a 400 error if `service` is not configured."""
+        if service not in self.base_percents:
+            raise HTTPException(status_code=400, detail=f"Unknown service: {service}")
+
+    def percentages(self, service: str) -> Tuple[float, float]:
+        """Return `(base_percent, global_percent)` for `service`.
+
+        Raises:
+            HTTPException: If the service is not configured.
+        """
+        self.validate_service(service)
+        return self.base_percents[service], self.global_percent
+
+
+_cached: Optional[MasterData] = None
+_loaded_at = 0.0
+_refresh: Optional["asyncio.Task[MasterData]"] = None
+
+
+async def _load() -> MasterData:
+    global _cached, _loaded_at
+    db = get_async_firestore_client()
+    snap = await db.collection(CONFIG_COLLECTION).document(MASTER_CONFIG_DOC).get()
+    version = snap.update_time if snap.exists else None
+    if _cached is None or _cached.version is None or _cached.version != version:
+        _cached = MasterData(snap.to_dict() if snap.exists else {}, version)
+    _loaded_at = time.monotonic()
+    return _cached
+
+
+def _start_refresh() -> "asyncio.Task[MasterData]":
+    """Start a reload unless one is already running on this event loop."""
+    global _refresh
+    loop = asyncio.get_running_loop()
+    if _refresh is None or _refresh.done() or _refresh.get_loop() is not loop:
+        _refresh = loop.create_task(_load())
+    return _refresh
+
+
+async def get_master_data(max_age: Optional[float] = None) -> MasterData:
+    """Return the master configuration, normally without a Firestore round trip.
+
+    Args:
+        max_age: Oldest acceptable copy in seconds.  When given and the cached
+            copy is older, the caller waits for a reload; otherwise a stale
+            copy is returned and refreshed in the background.
+    """
+    age = time.monotonic() - _loaded_at
+    if _cached is None or (max_age is not None and age > max_age):
+        return await _start_refresh()
+    if age > MASTER_DATA_TTL:
+        task = _start_refresh()
+        # Surface nothing here: a failed background refresh leaves the
+        # previous copy in place and is retried by the next caller.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return _cached
+
+
+def invalidate_master_data() -> None:
+    """Drop the cached configuration so the next caller reloads it."""
+    global _cached, _loaded_at
+    _cached = None
+    _loaded_at = 0.0
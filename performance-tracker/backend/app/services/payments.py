@@ -0,0 +1,366 @@
+"""Payment data access.
+
+A payment, its incentive, the affected daily rollups, the customer revenue
+index, its card in the demo index, the version of the employee's monthly
+statement and the versions of its scopes are always written together in a
+single batch commit (see `app.services.write_plan`) so that they can never
+drift apart.  Creating a payment is one round trip.  Updates and deletions
+read the stored payment and incentive first, so that the deltas revert
+exactly what was applied, and commit with preconditions that fail if either
+changed since that read.
+A deleted payment leaves a short-lived tombstone in `payment_tombstones`.
+
+Every write accepts an optional client-supplied idempotency key, so a
+retried request never applies its changes twice.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from google.api_core import exceptions
+from google.cloud import firestore
+
+from .. import events
+from ..firestore import apply_date_range, get_async_firestore_client, stream_concurrently, uid_queries
+from ..models import Payment
+from ..pagination import DEFAULT_PAGE_SIZE, fetch_page
+from . import customer_revenue, demo_index, rollups, statements, versions
+from .incentives import INCENTIVES_COLLECTION, build_incentive_doc
+from .master_data import get_master_data
+from .write_plan import WritePlan
+
+
+PAYMENTS_COLLECTION = "payments"
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+TOMBSTONES_COLLECTION = "payment_tombstones"
+
+# How long an idempotency record is honoured.  Configure a Firestore TTL
+# policy on `idempotency_keys.expires_at` to have expired records removed.
+IDEMPOTENCY_TTL = timedelta(hours=24)
+
+# How long the tombstone of a deleted payment is kept, so that incremental
+# readers such as `app.services.analytics_store` see the deletion.  Configure
+# a Firestore TTL policy on `payment_tombstones.expires_at` as well.
+TOMBSTONE_TTL = timedelta(days=30)
+
+# Read-then-commit attempts before a contended update or delete gives up.
+MAX_WRITE_ATTEMPTS = 5
+
+# Fields compared to tell a retried create from a key reused for another payment.
+_COMPARED_FIELDS = ("uid", "date", "mobile", "service", "amount_paid")
+
+# Fields that may be requested with `fields=` when listing payments.
+PAYMENT_FIELDS = set(Payment.__fields__) | {"uid", "team_uid", "created_at", "updated_at"}
+
+
+def payment_to_doc(uid: str, team_uid: Optional[str], payment: Payment) -> Dict[str, Any]:
+    """Convert a `Payment` into its Firestore document representation."""
+    data = payment.dict()
+    data["date"] = payment.date.isoformat()
+    data["uid"] = uid
+    data["team_uid"] = team_uid
+    data["updated_at"] = firestore.SERVER_TIMESTAMP
+    return data
+
+
+async def get_payment(payment_id: str) -> Optional[Dict[str, Any]]:
+    """Return the stored payment document, or `None` if it does not exist."""
+    db = get_async_firestore_client()
+    snap = await db.collection(PAYMENTS_COLLECTION).document(payment_id).get()
+    return snap.to_dict() if snap.exists else None
+
+
+class PaymentConflict(Exception):
+    """A write could not be applied because of a conflicting request."""
+
+
+def scoped_idempotency_key(actor_uid: str, key: Optional[str]) -> Optional[str]:
+    """Namespace a client-supplied idempotency key by the caller's UID."""
+    return f"{actor_uid}:{key}" if key else None
+
+
+def _key_hash(idempotency_key: str) -> str:
+    return hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+
+
+def idempotent_payment_id(idempotency_key: str) -> str:
+    """Return the payment ID a create with `idempotency_key` always uses."""
+    return _key_hash(idempotency_key)[:20]
+
+
+def _idempotency_record(operation: str, payment_id: str) -> Dict[str, Any]:
+    return {
+        "operation": operation,
+        "payment_id": payment_id,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "expires_at": datetime.now(timezone.utc) + IDEMPOTENCY_TTL,
+    }
+
+
+def _tombstone() -> Dict[str, Any]:
+    return {"updated_at": firestore.SERVER_TIMESTAMP, "expires_at": datetime.now(timezone.utc) + TOMBSTONE_TTL}
+
+
+def _summary(payment: Dict[str, Any], incentive_amount: float) -> Dict[str, Any]:
+    return {
+        "date": payment["date"],
+        "service": payment.get("service"),
+        "customer_type": payment.get("customer_type"),
+        "amount_paid": float(payment.get("amount_paid", 0.0)),
+        "incentive_amount": float(incentive_amount),
+    }
+
+
+def _publish_change(
+    payment_id: str,
+    uid: str,
+    team_uid: Optional[str],
+    before: Optional[Dict[str, Any]],
+    after: Optional[Dict[str, Any]],
+) -> None:
+    """Publish `payment` and `incentive` events for a committed change."""
+    empty = {"amount_paid": 0.0, "incentive_amount": 0.0}
+    old, new = before or empty, after or empty
+    delta = {
+        "count": (after is not None) - (before is not None),
+        "amount": round(new["amount_paid"] - old["amount_paid"], 2),
+        "incentive": round(new["incentive_amount"] - old["incentive_amount"], 2),
+    }
+    operation = "created" if before is None else "deleted" if after is None else "updated"
+    payment_event = {"op": operation, "payment_id": payment_id, "before": before, "after": after, "delta": delta}
+    events.publish("payment", uid, team_uid, payment_event)
+    if delta["incentive"] or operation != "updated":
+        incentive_event = {
+            "payment_id": payment_id,
+            "date": (after or before)["date"],
+            "incentive_amount": new["incentive_amount"],
+            "delta": {"amount": delta["incentive"]},
+        }
+        events.publish("incentive", uid, team_uid, incentive_event)
+
+
+async def create_payment(
+    uid: str, team_uid: Optional[str], payment: Payment, idempotency_key: Optional[str] = None
+) -> str:
+    """Persist a new payment for `uid` together with its incentive and aggregates.
+
+    Everything is written in one batch commit, the only Firestore round trip.
+    With an idempotency key the payment ID is derived from the key and the
+    payment is written with a `create` precondition, so a retried request
+    fails that precondition instead of writing anything twice and returns
+    the ID of the original payment.
+
+    Args:
+        uid: Employee who owns the payment.
+        team_uid: Manager whose team the employee belongs to, if any.
+        payment: The payment to store.
+        idempotency_key: Caller-scoped key (see `scoped_idempotency_key`).
+
+    Raises:
+        PaymentConflict: If the key was already used for a different payment.
+    """
+    base_percent, global_percent = (await get_master_data()).percentages(payment.service)
+    db = get_async_firestore_client()
+    payments = db.collection(PAYMENTS_COLLECTION)
+    payment_ref = payments.document(idempotent_payment_id(idempotency_key)) if idempotency_key else payments.document()
+    data = payment_to_doc(uid, team_uid, payment)
+    data["created_at"] = firestore.SERVER_TIMESTAMP
+    incentive = build_incentive_doc(payment_ref.id, uid, payment, base_percent, global_percent)
+
+    plan = WritePlan()
+    plan.create(payment_ref, data)
+    plan.set(db.collection(INCENTIVES_COLLECTION).document(payment_ref.id), incentive)
+    rollups.write_payment_delta(plan, db, data, incentive["incentive_amount"], 1)
+    customer_revenue.write_payment_delta(plan, db, data, 1)
+    demo_index.write_payment_delta(plan, db, payment_ref.id, data, 1)
+    statements.mark_stale(plan, db, uid, data["date"])
+    versions.bump_record(plan, db, uid, team_uid)
+    try:
+        await plan.commit(db)
+    except exceptions.AlreadyExists:
+        if not idempotency_key:
+            raise
+        existing = await get_payment(payment_ref.id)
+        stored = {key: existing.get(key) for key in _COMPARED_FIELDS} if existing else None
+        if stored != {key: data[key] for key in _COMPARED_FIELDS}:
+            raise PaymentConflict("Idempotency key was already used for a different payment")
+        return payment_ref.id
+    _publish_change(payment_ref.id, uid, team_uid, None, _summary(data, incentive["incentive_amount"]))
+    return payment_ref.id
+
+
+async def _apply_change(
+    operation: str,
+    payment_id: str,
+    payment: Optional[Payment],
+    allowed_uids: Optional[Sequence[str]],
+    idempotency_key: Optional[str],
+) -> None:
+    """Update (`payment` given) or delete a payment with optimistic concurrency.
+
+    The stored payment, its incentive and the idempotency record are read in
+    one `get_all`, then every mutation is committed in one batch whose
+    preconditions require the payment and incentive to be unchanged since
+    that read.  If another request got in between, the read is repeated.
+    """
+    if payment is not None:
+        base_percent, global_percent = (await get_master_data()).percentages(payment.service)
+    db = get_async_firestore_client()
+    payment_ref = db.collection(PAYMENTS_COLLECTION).document(payment_id)
+    incentive_ref = db.collection(INCENTIVES_COLLECTION).document(payment_id)
+    refs = [payment_ref, incentive_ref]
+    key_ref = None
+    if idempotency_key:
+        key_ref = db.collection(IDEMPOTENCY_COLLECTION).document(_key_hash(idempotency_key))
+        refs.append(key_ref)
+
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        snaps = {snap.reference.path: snap async for snap in db.get_all(refs)}
+        if key_ref is not None and snaps[key_ref.path].exists:
+            record = snaps[key_ref.path].to_dict()
+            if (record.get("operation"), record.get("payment_id")) != (operation, payment_id):
+                raise PaymentConflict("Idempotency key was already used for a different request")
+            return  # A retry of a request that already committed.
+        payment_snap, incentive_snap = snaps[payment_ref.path], snaps[incentive_ref.path]
+        if not payment_snap.exists:
+            raise KeyError(payment_id)
+        old_payment = payment_snap.to_dict()
+        if allowed_uids is not None and old_payment.get("uid") not in allowed_uids:
+            raise PermissionError(payment_id)
+        old_incentive = incentive_snap.to_dict() if incentive_snap.exists else {}
+
+        plan = WritePlan()
+        payment_unchanged = db.write_option(last_update_time=payment_snap.update_time)
+        incentive_unchanged = (
+            db.write_option(last_update_time=incentive_snap.update_time) if incentive_snap.exists else None
+        )
+        rollups.write_payment_delta(plan, db, old_payment, old_incentive.get("incentive_amount", 0.0), -1)
+        customer_revenue.write_payment_delta(plan, db, old_payment, -1)
+        demo_index.write_payment_delta(plan, db, payment_id, old_payment, -1)
+        statements.mark_stale(plan, db, old_payment["uid"], old_payment["date"])
+        versions.bump_record(plan, db, old_payment["uid"], old_payment.get("team_uid"))
+        if payment is None:
+            plan.delete(payment_ref, option=payment_unchanged)
+            if incentive_snap.exists:
+                plan.delete(incentive_ref, option=incentive_unchanged)
+            plan.set(db.collection(TOMBSTONES_COLLECTION).document(payment_id), _tombstone())
+        else:
+            uid = old_payment["uid"]
+            data = payment_to_doc(uid, old_payment.get("team_uid"), payment)
+            incentive = build_incentive_doc(payment_id, uid, payment, base_percent, global_percent)
+            # `update` with every field replaces the document like `set`
+            # (keeping `created_at`) but, unlike `set`, accepts a precondition.
+            plan.update(payment_ref, data, option=payment_unchanged)
+            if incentive_snap.exists:
+                plan.update(incentive_ref, incentive, option=incentive_unchanged)
+            else:
+                plan.create(incentive_ref, incentive)
+            rollups.write_payment_delta(plan, db, data, incentive["incentive_amount"], 1)
+            customer_revenue.write_payment_delta(plan, db, data, 1)
+            demo_index.write_payment_delta(plan, db, payment_id, data, 1)
+            statements.mark_stale(plan, db, uid, data["date"])
+        if key_ref is not None:
+            plan.create(key_ref, _idempotency_record(operation, payment_id))
+        try:
+            await plan.commit(db)
+        except (exceptions.FailedPrecondition, exceptions.AlreadyExists, exceptions.NotFound):
+            continue
+        before = _summary(old_payment, old_incentive.get("incentive_amount", 0.0))
+        after = None if payment is None else _summary(data, incentive["incentive_amount"])
+        _publish_change(payment_id, old_payment["uid"], old_payment.get("team_uid"), before, after)
+        return
+    raise PaymentConflict("Payment is being modified concurrently; retry the request")
+
+
+async def update_payment(
+    payment_id: str,
+    payment: Payment,
+    allowed_uids: Optional[Sequence[str]] = None,
+    idempotency_key: Optional[str] = None,
+) -> None:
+    """Replace a payment and recalculate its incentive and aggregates.
+
+    Costs one read and one commit.  The owning employee, team and creation
+    time of the stored payment are preserved.
+
+    Args:
+        payment_id: Payment to replace.
+        payment: The new payment values.
+        allowed_uids: Employees whose payments the caller may change, or
+            `None` for no restriction.
+        idempotency_key: Caller-scoped key (see `scoped_idempotency_key`).
+
+    Raises:
+        KeyError: If the payment does not exist.
+        PermissionError: If the payment belongs to an employee outside `allowed_uids`.
+        PaymentConflict: If the key was used for another request, or
+            concurrent writers kept invalidating the read.
+    """
+    await _apply_change("update", payment_id, payment, allowed_uids, idempotency_key)
+
+
+async def delete_payment(
+    payment_id: str, allowed_uids: Optional[Sequence[str]] = None, idempotency_key: Optional[str] = None
+) -> None:
+    """Delete a payment and its linked incentive, reverting their aggregates.
+
+    Costs one read and one commit; see `update_payment` for the arguments.
+
+    Raises:
+        KeyError: If the payment does not exist.
+        PermissionError: If the payment belongs to an employee outside `allowed_uids`.
+        PaymentConflict: As for `update_payment`.
+    """
+    await _apply_change("delete", payment_id, None, allowed_uids, idempotency_key)
+
+
+def _payment_query(
+    collection: Any,
+    from_date: Optional[date],
+    to_date: Optional[date],
+    service: Optional[str] = None,
+    customer_type: Optional[str] = None,
+) -> Any:
+    """Return the payments query with all filters except the UID filter applied."""
+    query = apply_date_range(collection, from_date, to_date)
+    if service:
+        query = query.where("service", "==", service)
+    if customer_type:
+        query = query.where("customer_type", "==", customer_type.lower())
+    return query
+
+
+async def list_payments(
+    uids: Optional[List[str]],
+    from_date: Optional[date],
+    to_date: Optional[date],
+    service: Optional[str] = None,
+    customer_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return one page of payments matching the filters for `uids` (or everyone when `None`).
+
+    Returns:
+        The payments ordered by date and document ID, and the cursor for the
+        next page (`None` on the last page).
+    """
+    db = get_async_firestore_client()
+    collection = db.collection(PAYMENTS_COLLECTION)
+    base = _payment_query(collection, from_date, to_date, service, customer_type)
+    return await fetch_page(collection, base, uids, cursor, limit, fields)
+
+
+async def stream_payments(
+    uids: Optional[List[str]], from_date: Optional[date], to_date: Optional[date]
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield every payment for `uids` (or everyone when `None`) in the range, in no particular order."""
+    db = get_async_firestore_client()
+    base = _payment_query(db.collection(PAYMENTS_COLLECTION), from_date, to_date)
+    for snaps in await stream_concurrently(uid_queries(base, uids)):
+        for snap in snaps:
+            yield {"id": snap.id, **snap.to_dict()}
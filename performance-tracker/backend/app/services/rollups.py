@@ -0,0 +1,299 @@
+"""Pre-aggregated daily analytics rollups.
+
+One rollup document is kept per scope per day in the `rollups_daily`
+collection, with the document ID `{scope}_{YYYY-MM-DD}`.  A scope is one of:
+
+* `emp:{uid}` – a single employee,
+* `team:{manager_uid}` – a manager's team, including the manager,
+* `all` – the whole organisation.
+
+A record's team is its owner's manager, so the records of a manager who
+reports to another manager roll up under their manager's team, not their
+own.  What such a manager sees as their team (`team_read_scope`) is the
+union scope `team:{uid}+emp:{uid}`; readers split a union into its parts
+with `scope_parts` and add the parts up, which is exact because the parts
+never share a record.
+
+Every record would otherwise write the same `all` document for its day, and
+Firestore throttles sustained writes to one document.  The organisation
+rollup is therefore split into `ALL_SHARDS` scopes (`all:0`, `all:1`, ...).
+A record is counted in the one its owner's UID hashes to, and `read_daily`
+reads every shard for the `all` scope.  Totals are additive, so shards merge
+like days.
+
+Rollups are updated in the same batch or transaction as the call entry or
+payment that changes them, so an employee or team overview over any date
+range reads at most one small document per day.  Call totals are stored per
+employee (`calls.{uid}`) and simply overwritten on each upsert, which keeps
+call writes idempotent; payment and incentive totals are maintained with
+`Increment` deltas.
+
+Team membership is captured on each record (`team_uid`) at write time.  After
+employees are remapped to a different manager the team rollups can be rebuilt
+with `app.jobs.rebuild_rollups`.
+"""
+
+from __future__ import annotations
+
+import zlib
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from google.cloud import firestore
+
+from ..firestore import get_async_firestore_client
+from ..models import CallEntry
+
+
+ROLLUPS_COLLECTION = "rollups_daily"
+ALL_SCOPE = "all"
+
+# Scopes the organisation-wide rollup is spread over (see module docstring).
+# Changing it requires `app.jobs.rebuild_rollups`.
+ALL_SHARDS = 16
+
+# Upper bound on the number of days a single overview may span.
+MAX_OVERVIEW_DAYS = 400
+
+
+def employee_scope(uid: str) -> str:
+    """Return the rollup scope of a single employee."""
+    return f"emp:{uid}"
+
+
+def team_scope(manager_uid: str) -> str:
+    """Return the rollup scope of a manager's team."""
+    return f"team:{manager_uid}"
+
+
+def all_shard(uid: str) -> str:
+    """Return the organisation rollup shard records owned by `uid` are counted in."""
+    return f"{ALL_SCOPE}:{zlib.crc32(uid.encode('utf-8')) % ALL_SHARDS}"
+
+
+def union_scope(*scopes: str) -> str:
+    """Return the scope covering the records of every one of `scopes`, which must not overlap."""
+    return "+".join(scopes)
+
+
+def scope_parts(scope: str) -> List[str]:
+    """Return the scopes a union scope is made of (just `scope` for any other scope)."""
+    return scope.split("+")
+
+
+def team_read_scope(manager_uid: str, reports_to: Optional[str]) -> str:
+    """Return the scope of a manager's team as `resolve_scope` sees it, including the manager.
+
+    Args:
+        manager_uid: UID of the manager.
+        reports_to: The manager's own `manager_uid`, if they have one; their
+            records then belong to that manager's team.
+    """
+    if reports_to:
+        return union_scope(team_scope(manager_uid), employee_scope(manager_uid))
+    return team_scope(manager_uid)
+
+
+def stored_scopes(scope: str) -> List[str]:
+    """Return the scopes whose rollups together make up `scope`."""
+    stored: List[str] = []
+    for part in scope_parts(scope):
+        if part == ALL_SCOPE:
+            stored += [f"{ALL_SCOPE}:{shard}" for shard in range(ALL_SHARDS)]
+        else:
+            stored.append(part)
+    return stored
+
+
+def scopes_for(uid: str, team_uid: Optional[str]) -> List[str]:
+    """Return every scope a record owned by `uid` belongs to."""
+    scopes = [employee_scope(uid), ALL_SCOPE]
+    if team_uid:
+        scopes.append(team_scope(team_uid))
+    return scopes
+
+
+def stored_scopes_for(uid: str, team_uid: Optional[str]) -> List[str]:
+    """Return the scopes whose rollups a record owned by `uid` is counted in."""
+    return [all_shard(uid) if scope == ALL_SCOPE else scope for scope in scopes_for(uid, team_uid)]
+
+
+def rollup_doc_id(scope: str, day: str) -> str:
+    """Return the rollup document ID for `scope` on the ISO date `day`."""
+    return f"{scope}_{day}"
+
+
+def call_totals(entry: Dict[str, Any]) -> Dict[str, int]:
+    """Return the per-employee call totals stored in a rollup for a call document."""
+    return {
+        "answered": int(entry.get("answered_calls", 0)),
+        "unanswered": int(entry.get("unanswered_calls", 0)),
+        "total_call_time_minutes": int(entry.get("total_call_time_minutes", 0)),
+        "demos": len(entry.get("demos") or []),
+    }
+
+
+def call_entry_updates(uid: str, team_uid: Optional[str], entry: CallEntry) -> Dict[str, Dict[str, Any]]:
+    """Return the rollup merge payloads for a call entry upsert, keyed by rollup document ID."""
+    totals = call_totals(entry.dict())
+    day = entry.date.isoformat()
+    return {
+        rollup_doc_id(scope, day): {"scope": scope, "date": day, "calls": {uid: totals}}
+        for scope in stored_scopes_for(uid, team_uid)
+    }
+
+
+def merge_call_updates(target: Dict[str, Dict[str, Any]], updates: Dict[str, Dict[str, Any]]) -> None:
+    """Fold call rollup payloads from `updates` into `target` so each rollup is written once."""
+    for doc_id, payload in updates.items():
+        if doc_id in target:
+            target[doc_id]["calls"].update(payload["calls"])
+        else:
+            target[doc_id] = {**payload, "calls": dict(payload["calls"])}
+
+
+def write_call_entry(writer: Any, db: Any, uid: str, team_uid: Optional[str], entry: CallEntry) -> None:
+    """Add rollup writes for a call entry upsert to `writer` (a batch or transaction)."""
+    for doc_id, payload in call_entry_updates(uid, team_uid, entry).items():
+        writer.set(db.collection(ROLLUPS_COLLECTION).document(doc_id), payload, merge=True)
+
+
+def write_payment_delta(writer: Any, db: Any, payment: Dict[str, Any], incentive_amount: float, sign: int) -> None:
+    """Add rollup writes applying (`sign=1`) or reverting (`sign=-1`) a payment.
+
+    `payment` is the stored payment document and must contain `uid`, `date`,
+    `service`, `customer_type`, `amount_paid` and optionally `team_uid`.
+    """
+    amount = sign * float(payment["amount_paid"])
+    count = firestore.Increment(sign)
+    day = payment["date"]
+    delta = {
+        "payments": {"count": count, "amount": firestore.Increment(amount)},
+        "incentives": {"amount": firestore.Increment(sign * float(incentive_amount))},
+        "services": {payment["service"]: {"count": count, "amount": firestore.Increment(amount)}},
+        "customer_types": {payment["customer_type"]: {"count": count, "amount": firestore.Increment(amount)}},
+    }
+    for scope in stored_scopes_for(payment["uid"], payment.get("team_uid")):
+        writer.set(
+            db.collection(ROLLUPS_COLLECTION).document(rollup_doc_id(scope, day)),
+            {"scope": scope, "date": day, **delta},
+            merge=True,
+        )
+
+
+def empty_overview() -> Dict[str, Any]:
+    """Return an overview with all totals set to zero."""
+    return {
+        "total_calls": 0,
+        "total_answered": 0,
+        "total_unanswered": 0,
+        "total_call_time_minutes": 0,
+        "total_demos": 0,
+        "payment_count": 0,
+        "total_payments": 0.0,
+        "total_incentives": 0.0,
+        "service_breakdown": {},
+        "customer_type_breakdown": {},
+    }
+
+
+def merge_rollups(rollups: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine daily rollup documents into a single overview."""
+    overview = empty_overview()
+    services: Dict[str, Dict[str, float]] = defaultdict(lambda: {"count": 0, "amount": 0.0})
+    customer_types: Dict[str, Dict[str, float]] = defaultdict(lambda: {"count": 0, "amount": 0.0})
+    for rollup in rollups:
+        for totals in (rollup.get("calls") or {}).values():
+            overview["total_answered"] += totals.get("answered", 0)
+            overview["total_unanswered"] += totals.get("unanswered", 0)
+            overview["total_call_time_minutes"] += totals.get("total_call_time_minutes", 0)
+            overview["total_demos"] += totals.get("demos", 0)
+        payments = rollup.get("payments") or {}
+        overview["payment_count"] += payments.get("count", 0)
+        overview["total_payments"] += payments.get("amount", 0.0)
+        overview["total_incentives"] += (rollup.get("incentives") or {}).get("amount", 0.0)
+        for target, source in ((services, "services"), (customer_types, "customer_types")):
+            for key, totals in (rollup.get(source) or {}).items():
+                target[key]["count"] += totals.get("count", 0)
+                target[key]["amount"] += totals.get("amount", 0.0)
+    overview["total_calls"] = overview["total_answered"] + overview["total_unanswered"]
+    overview["total_payments"] = round(overview["total_payments"], 2)
+    overview["total_incentives"] = round(overview["total_incentives"], 2)
+    overview["service_breakdown"] = {k: v for k, v in services.items() if v["count"]}
+    overview["customer_type_breakdown"] = {k: v for k, v in customer_types.items() if v["count"]}
+    return overview
+
+
+def days_in_range(from_date: date, to_date: date) -> List[str]:
+    """Return the ISO dates from `from_date` to `to_date` inclusive."""
+    return [(from_date + timedelta(days=n)).isoformat() for n in range((to_date - from_date).days + 1)]
+
+
+async def read_daily(scope: str, from_date: date, to_date: date) -> List[Dict[str, Any]]:
+    """Return the existing daily rollups of `scope` in the range, in one round trip.
+
+    For the organisation scope this is one rollup per shard per day, and for
+    a union scope one per part per day.
+    """
+    db = get_async_firestore_client()
+    refs = [
+        db.collection(ROLLUPS_COLLECTION).document(rollup_doc_id(stored, day))
+        for day in days_in_range(from_date, to_date)
+        for stored in stored_scopes(scope)
+    ]
+    return [snap.to_dict() async for snap in db.get_all(refs) if snap.exists]
+
+
+async def read_overview(scope: str, from_date: date, to_date: date) -> Dict[str, Any]:
+    """Return the merged overview for `scope` by reading its rollups for each day."""
+    return merge_rollups(await read_daily(scope, from_date, to_date))
+
+
+def build_rollups(
+    calls: Iterable[Dict[str, Any]],
+    payments: Iterable[Dict[str, Any]],
+    incentive_amounts: Dict[str, float],
+) -> Dict[str, Dict[str, Any]]:
+    """Recompute rollup documents from raw call and payment documents.
+
+    Args:
+        calls: Stored call entry documents (with `uid`, `date`, `team_uid`).
+        payments: Stored payment documents including their `id`.
+        incentive_amounts: Incentive amount per payment ID.
+
+    Returns:
+        Rollup documents keyed by rollup document ID.
+    """
+    rollups: Dict[str, Dict[str, Any]] = {}
+
+    def rollup(scope: str, day: str) -> Dict[str, Any]:
+        doc_id = rollup_doc_id(scope, day)
+        if doc_id not in rollups:
+            rollups[doc_id] = {
+                "scope": scope,
+                "date": day,
+                "calls": {},
+                "payments": {"count": 0, "amount": 0.0},
+                "incentives": {"amount": 0.0},
+                "services": {},
+                "customer_types": {},
+            }
+        return rollups[doc_id]
+
+    for call in calls:
+        for scope in stored_scopes_for(call["uid"], call.get("team_uid")):
+            rollup(scope, call["date"])["calls"][call["uid"]] = call_totals(call)
+
+    for payment in payments:
+        amount = float(payment["amount_paid"])
+        for scope in stored_scopes_for(payment["uid"], payment.get("team_uid")):
+            doc = rollup(scope, payment["date"])
+            doc["payments"]["count"] += 1
+            doc["payments"]["amount"] += amount
+            doc["incentives"]["amount"] += incentive_amounts.get(payment["id"], 0.0)
+            for field, key in (("services", payment["service"]), ("customer_types", payment["customer_type"])):
+                totals = doc[field].setdefault(key, {"count": 0, "amount": 0.0})
+                totals["count"] += 1
+                totals["amount"] += amount
+    return rollups
@@ -0,0 +1,185 @@
+"""Storage and freshness of monthly incentive statements.
+
+Statements (rendered by `app.statements`) are stored in the `statements`
+collection, one document per employee and month (`{uid}_{YYYY-MM}`), holding
+the totals and the CSV and HTML, so downloading one is a single read.
+
+Every write that changes a payment or its incentive also increments
+`version` on the statement document of that employee and month, in the same
+batch (see `mark_stale`).  A statement records the version it was rendered
+from as `generated_version`, so it is current while the two are equal.
+`app.jobs.generate_statements` renders every statement of a month that is
+missing or out of date, and a download of an out-of-date statement
+re-renders just that one.  A current statement is never rendered again.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from .. import statements as rendering
+from ..firestore import apply_date_range, get_async_firestore_client, stream_concurrently, uid_queries
+from .incentives import INCENTIVES_COLLECTION
+from .users import USERS_COLLECTION
+
+
+STATEMENTS_COLLECTION = "statements"
+
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+# Fields returned when listing statements; the rendered files are left out.
+_LISTED_FIELDS = ["uid", "month", "name", "version", "generated_version", "generated_at", "totals"]
+
+_PAYMENT_FIELDS = ["uid", "date", "customer_name", "mobile", "service", "amount_paid"]
+_INCENTIVE_FIELDS = ["uid", "base_percent", "global_percent", "incentive_amount"]
+
+
+def statement_doc_id(uid: str, month: str) -> str:
+    """Return the document ID of the statement of `uid` for `month` (`YYYY-MM`)."""
+    return f"{uid}_{month}"
+
+
+def month_range(month: str) -> Tuple[date, date]:
+    """Return the first and last day of `month` (`YYYY-MM`)."""
+    first = date.fromisoformat(f"{month}-01")
+    return first, (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def mark_stale(writer: Any, db: Any, uid: str, day: str) -> None:
+    """Add the write invalidating the statement of `uid` for the month of `day` (ISO date)."""
+    month = day[:7]
+    ref = db.collection(STATEMENTS_COLLECTION).document(statement_doc_id(uid, month))
+    writer.set(ref, {"uid": uid, "month": month, "version": firestore.Increment(1)}, merge=True)
+
+
+def is_current(statement: Dict[str, Any]) -> bool:
+    """Return whether a stored statement was rendered from the latest version of its payments."""
+    return statement.get("generated_version") == statement.get("version", 0)
+
+
+async def fetch_month(month: str, uids: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Fetch the payments and incentives of `month` for `uids` (or everyone when `None`).
+
+    Uses one date range query on each collection (per chunk of UIDs) instead
+    of a query per employee.
+
+    Returns:
+        The `payments` (a list) and `incentives` (keyed by payment ID) of
+        every employee with payments in the month, keyed by UID.
+    """
+    # Imported here because `app.services.payments` imports this module.
+    from .payments import PAYMENTS_COLLECTION
+
+    db = get_async_firestore_client()
+    from_date, to_date = month_range(month)
+    payment_query = apply_date_range(db.collection(PAYMENTS_COLLECTION), from_date, to_date).select(_PAYMENT_FIELDS)
+    incentive_query = apply_date_range(db.collection(INCENTIVES_COLLECTION), from_date, to_date).select(
+        _INCENTIVE_FIELDS
+    )
+    payment_queries = uid_queries(payment_query, uids)
+    results = await stream_concurrently(payment_queries + uid_queries(incentive_query, uids))
+
+    records: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"payments": [], "incentives": {}})
+    for snaps in results[: len(payment_queries)]:
+        for snap in snaps:
+            payment = snap.to_dict()
+            records[payment["uid"]]["payments"].append({"id": snap.id, **payment})
+    for snaps in results[len(payment_queries) :]:
+        for snap in snaps:
+            incentive = snap.to_dict()
+            if incentive.get("uid") in records:
+                records[incentive["uid"]]["incentives"][snap.id] = incentive
+    return dict(records)
+
+
+async def fetch_states(month: str, uids: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Return the stored statements of `month` without their rendered files, keyed by UID."""
+    db = get_async_firestore_client()
+    query = db.collection(STATEMENTS_COLLECTION).where("month", "==", month).select(_LISTED_FIELDS)
+    return {
+        snap.get("uid"): snap.to_dict() for snaps in await stream_concurrently(uid_queries(query, uids)) for snap in snaps
+    }
+
+
+async def employee_names(uids: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Return the display name of each of `uids`, read in one round trip."""
+    db = get_async_firestore_client()
+    refs = [db.collection(USERS_COLLECTION).document(uid) for uid in uids]
+    if not refs:
+        return {}
+    return {snap.id: (snap.to_dict() or {}).get("name") async for snap in db.get_all(refs)}
+
+
+def statement_input(uid: str, name: Optional[str], month: str, records: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Return the input of `app.statements.render_statement` for one employee."""
+    records = records or {"payments": [], "incentives": {}}
+    return {"uid": uid, "name": name, "month": month, **records}
+
+
+def write_statement(writer: Any, db: Any, month: str, name: Optional[str], version: int, rendered: Dict[str, Any]) -> None:
+    """Add the write storing a rendered statement, as of `version`, to `writer`.
+
+    The write merges, leaving `version` alone, so a payment change committed
+    while the statement was being rendered still marks it out of date.
+    """
+    ref = db.collection(STATEMENTS_COLLECTION).document(statement_doc_id(rendered["uid"], month))
+    writer.set(
+        ref,
+        {
+            "uid": rendered["uid"],
+            "month": month,
+            "name": name,
+            "generated_version": version,
+            "generated_at": firestore.SERVER_TIMESTAMP,
+            "totals": rendered["totals"],
+            "csv": rendered["csv"],
+            "html": rendered["html"],
+        },
+        merge=True,
+    )
+
+
+async def list_statements(uids: Optional[List[str]], month: str) -> List[Dict[str, Any]]:
+    """Return the statements of `month` for `uids` (or everyone when `None`), without their files.
+
+    Each statement carries `current`, telling whether it must be re-rendered
+    before it reflects the latest payments.
+    """
+    states = await fetch_states(month, uids)
+    return [{**states[uid], "current": is_current(states[uid])} for uid in sorted(states)]
+
+
+async def get_statement(uid: str, month: str) -> Dict[str, Any]:
+    """Return the current statement of `uid` for `month`, rendering it only if out of date.
+
+    A current statement costs one read.  Otherwise the employee's payments
+    and incentives for the month are fetched and rendered in process, and the
+    result is stored for the next download.
+    """
+    db = get_async_firestore_client()
+    snap = await db.collection(STATEMENTS_COLLECTION).document(statement_doc_id(uid, month)).get()
+    stored = snap.to_dict() if snap.exists else {}
+    if stored and is_current(stored):
+        return stored
+    version = stored.get("version", 0)
+    records = (await fetch_month(month, [uid])).get(uid)
+    name = (await employee_names([uid])).get(uid)
+    rendered = rendering.render_statement(statement_input(uid, name, month, records))
+    batch = db.batch()
+    write_statement(batch, db, month, name, version, rendered)
+    await batch.commit()
+    return {
+        **stored,
+        "uid": uid,
+        "month": month,
+        "name": name,
+        "version": version,
+        "generated_version": version,
+        "totals": rendered["totals"],
+        "csv": rendered["csv"],
+        "html": rendered["html"],
+    }
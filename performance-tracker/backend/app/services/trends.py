@@ -0,0 +1,210 @@
+"""Revenue trend time series.
+
+Trends are built from the daily rollups (see `app.services.rollups`), which
+already hold each day's payment count and amount per service and per customer
+type.  A year therefore costs at most 366 small document reads, however many
+payments it contains.
+
+The series are bucketed by day, ISO week (starting Monday) or calendar month
+and gap-filled with NumPy: every day in the range is mapped to its bucket,
+and the per-category totals are summed with one `bincount` over flat
+`(category, bucket)` indexes rather than with per-row dictionary updates.
+The first and last buckets of a week or month series may cover only part of
+their period when the range does not start or end on a bucket boundary.
+
+With `ANALYTICS_ENGINE=duckdb` the buckets are instead summed by SQL over
+the embedded mirror (see `app.services.analytics_store`) and only gap-filled
+here.
+
+`get_trends` memoizes results per `(scope, range, granularity)` for
+`TRENDS_CACHE_TTL` seconds, so dashboards refreshing the same chart do not
+re-query the mirror.  Trends from the rollups are cached per scope version
+by the router instead (see `app.conditional`), which never serves a chart
+older than the last write.
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import date
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Sequence, Tuple
+
+from ..cache import TTLCache
+from . import analytics_store, rollups
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+GRANULARITIES = ("day", "week", "month")
+GRANULARITY_PATTERN = "^(day|week|month)$"
+
+# Category under which the overall totals are reported.
+TOTAL = "total"
+
+_trends_cache = TTLCache(
+    maxsize=int(os.getenv("TRENDS_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("TRENDS_CACHE_TTL", "60")),
+)
+
+
+def bucket_days(from_date: date, to_date: date, granularity: str) -> Tuple[List[str], np.ndarray]:
+    """Map every day of the range to a bucket.
+
+    Returns:
+        The ISO start date of each bucket, and for each day of the range
+        (`from_date` first) the index of its bucket.
+    """
+    import numpy as np
+
+    days = np.arange(np.datetime64(from_date, "D"), np.datetime64(to_date, "D") + 1)
+    if granularity == "week":
+        # 1970-01-01 was a Thursday, so (days since epoch + 3) % 7 is the ISO weekday - 1.
+        keys = days - (days.astype("int64") + 3) % 7
+    elif granularity == "month":
+        keys = days.astype("datetime64[M]").astype("datetime64[D]")
+    elif granularity == "day":
+        keys = days
+    else:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    starts, day_to_bucket = np.unique(keys, return_inverse=True)
+    return [str(start) for start in starts], day_to_bucket
+
+
+def bucket_series(
+    day_offsets: Sequence[int],
+    categories: Sequence[int],
+    counts: Sequence[float],
+    amounts: Sequence[float],
+    n_categories: int,
+    day_to_bucket: np.ndarray,
+    n_buckets: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum per-row counts and amounts into gap-filled `(category, bucket)` matrices.
+
+    Args:
+        day_offsets: Day of each row, as days since the start of the range.
+        categories: Category index of each row.
+        counts: Count contributed by each row.
+        amounts: Amount contributed by each row.
+        n_categories: Number of categories.
+        day_to_bucket: Bucket index of each day of the range (see `bucket_days`).
+        n_buckets: Number of buckets.
+
+    Returns:
+        Count and amount matrices of shape `(n_categories, n_buckets)`.
+    """
+    import numpy as np
+
+    flat = np.asarray(categories, dtype=np.int64) * n_buckets + day_to_bucket[np.asarray(day_offsets, dtype=np.int64)]
+    size = n_categories * n_buckets
+    count_matrix = np.bincount(flat, weights=np.asarray(counts, dtype=float), minlength=size)
+    amount_matrix = np.bincount(flat, weights=np.asarray(amounts, dtype=float), minlength=size)
+    return count_matrix.reshape(n_categories, n_buckets), amount_matrix.reshape(n_categories, n_buckets)
+
+
+def trends_from_rollups(
+    daily_rollups: Iterable[Dict[str, Any]], from_date: date, to_date: date, granularity: str
+) -> Dict[str, Any]:
+    """Build the trend series for a range from its daily rollup documents."""
+    starts, day_to_bucket = bucket_days(from_date, to_date, granularity)
+    origin = from_date.toordinal()
+    index: Dict[Tuple[str, str], int] = {("", TOTAL): 0}
+    day_offsets: List[int] = []
+    categories: List[int] = []
+    counts: List[float] = []
+    amounts: List[float] = []
+    for rollup in daily_rollups:
+        offset = date.fromisoformat(rollup["date"]).toordinal() - origin
+        payments = rollup.get("payments") or {}
+        rows = [(("", TOTAL), payments)]
+        for group in ("services", "customer_types"):
+            rows += [((group, name), totals) for name, totals in (rollup.get(group) or {}).items()]
+        for key, totals in rows:
+            day_offsets.append(offset)
+            categories.append(index.setdefault(key, len(index)))
+            counts.append(totals.get("count", 0))
+            amounts.append(totals.get("amount", 0.0))
+
+    count_matrix, amount_matrix = bucket_series(
+        day_offsets, categories, counts, amounts, len(index), day_to_bucket, len(starts)
+    )
+    return _series(granularity, starts, index, count_matrix, amount_matrix)
+
+
+def trends_from_totals(
+    totals: Iterable[Tuple[str, str, Any, int, float]], from_date: date, to_date: date, granularity: str
+) -> Dict[str, Any]:
+    """Build the trend series for a range from per-bucket totals.
+
+    Args:
+        totals: `(bucket start, group, name, count, amount)` rows as returned
+            by `analytics_store.AnalyticsStore.trend_totals`; missing buckets
+            are filled with zeros.
+    """
+    import numpy as np
+
+    starts, _ = bucket_days(from_date, to_date, granularity)
+    position = {start: n for n, start in enumerate(starts)}
+    index: Dict[Tuple[str, str], int] = {("", TOTAL): 0}
+    buckets: List[int] = []
+    categories: List[int] = []
+    counts: List[float] = []
+    amounts: List[float] = []
+    for start, group, name, count, amount in totals:
+        buckets.append(position[start])
+        categories.append(index.setdefault((group, name) if group else ("", TOTAL), len(index)))
+        counts.append(count)
+        amounts.append(amount)
+
+    # The totals are already bucketed, so each "day" is its own bucket.
+    count_matrix, amount_matrix = bucket_series(
+        buckets, categories, counts, amounts, len(index), np.arange(len(starts)), len(starts)
+    )
+    return _series(granularity, starts, index, count_matrix, amount_matrix)
+
+
+def _series(
+    granularity: str,
+    starts: List[str],
+    index: Dict[Tuple[str, str], int],
+    count_matrix: np.ndarray,
+    amount_matrix: np.ndarray,
+) -> Dict[str, Any]:
+    """Shape the `(category, bucket)` matrices into the trends response."""
+    import numpy as np
+
+    count_matrix = count_matrix.astype(np.int64).tolist()
+    amount_matrix = np.round(amount_matrix, 2).tolist()
+    series: Dict[str, Any] = {"services": {}, "customer_types": {}}
+    for (group, name), row in sorted(index.items(), key=lambda item: item[0]):
+        values = {"count": count_matrix[row], "amount": amount_matrix[row]}
+        if name == TOTAL and not group:
+            series[TOTAL] = values
+        elif any(values["count"]):
+            series[group][name] = values
+    return {"granularity": granularity, "buckets": starts, **series}
+
+
+async def compute_trends(scope: str, from_date: date, to_date: date, granularity: str) -> Dict[str, Any]:
+    """Return the revenue trends of `scope` from the configured analytics engine."""
+    if analytics_store.enabled():
+        totals = await analytics_store.store.trend_totals(scope, from_date, to_date, granularity)
+        return trends_from_totals(totals, from_date, to_date, granularity)
+    daily = await rollups.read_daily(scope, from_date, to_date)
+    return trends_from_rollups(daily, from_date, to_date, granularity)
+
+
+async def get_trends(scope: str, from_date: date, to_date: date, granularity: str) -> Dict[str, Any]:
+    """Return the revenue trends of `scope`, memoized per scope, range and granularity."""
+    key = (scope, from_date, to_date, granularity)
+    cached = _trends_cache.get(key)
+    if cached is None:
+        cached = await compute_trends(scope, from_date, to_date, granularity)
+        _trends_cache.set(key, cached)
+    return cached
+
+
+def get_trends_cache_stats() -> Dict[str, Any]:
+    """Return hit/miss statistics for the trends cache."""
+    return _trends_cache.stats()
@@ -0,0 +1,141 @@
+"""User profile and team membership data access.
+
+Team membership (the employees mapped to each manager) is read on almost
+every manager request to scope queries, but only changes when an admin remaps
+users, so it is cached in process.  The `/users` endpoints drop the cache on
+every change; other instances pick the change up within `TEAM_CACHE_TTL`
+seconds.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from ..auth import _initialize_firebase_app, get_user_profile
+from ..cache import TTLCache
+from ..firestore import get_async_firestore_client, run_blocking
+
+
+USERS_COLLECTION = "users"
+
+# Employee UIDs keyed by manager UID.
+_team_cache = TTLCache(
+    maxsize=int(os.getenv("TEAM_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("TEAM_CACHE_TTL", "300")),
+)
+
+
+def _create_firebase_user(email: str, password: str, display_name: Optional[str]) -> str:
+    """Create a Firebase Auth account (blocking) and return its UID."""
+    from firebase_admin import auth as firebase_auth
+
+    _initialize_firebase_app()
+    record = firebase_auth.create_user(email=email, password=password, display_name=display_name)
+    return record.uid
+
+
+async def create_auth_user(email: str, password: str, display_name: Optional[str] = None) -> str:
+    """Create a Firebase Auth account on the blocking pool and return its UID.
+
+    Raises:
+        HTTPException: If an account with `email` already exists.
+    """
+    from firebase_admin import auth as firebase_auth
+
+    try:
+        return await run_blocking(_create_firebase_user, email, password, display_name)
+    except firebase_auth.EmailAlreadyExistsError as exc:
+        raise HTTPException(status_code=409, detail="A user with this email already exists") from exc
+
+
+async def set_profile(uid: str, fields: Dict[str, Any]) -> None:
+    """Merge `fields` into the Firestore profile of `uid`."""
+    db = get_async_firestore_client()
+    await db.collection(USERS_COLLECTION).document(uid).set(fields, merge=True)
+
+
+async def get_team_uids(manager_uid: str) -> List[str]:
+    """Return the UIDs of the employees mapped to `manager_uid`, served from cache when possible."""
+    team = _team_cache.get(manager_uid)
+    if team is None:
+        db = get_async_firestore_client()
+        query = db.collection(USERS_COLLECTION).where("manager_uid", "==", manager_uid)
+        query = query.select([FieldPath.document_id()])
+        team = tuple(sorted([snap.id async for snap in query.stream()]))
+        _team_cache.set(manager_uid, team)
+    return list(team)
+
+
+def invalidate_team_membership() -> None:
+    """Drop every cached team so the next request re-reads the mapping.
+
+    Called whenever a user is created or their role or manager changes.  The
+    whole cache is dropped because a remap affects both the old and the new
+    manager, and the old one is not reliably known from a cached profile.
+    """
+    _team_cache.clear()
+
+
+def get_team_cache_stats() -> Dict[str, Any]:
+    """Return hit/miss statistics for the team membership cache."""
+    return _team_cache.stats()
+
+
+async def resolve_scope(current_user: Dict[str, Any], employee_uid: Optional[str] = None) -> Optional[List[str]]:
+    """Return the employee UIDs whose data the caller may read.
+
+    Employees are always restricted to their own data and `employee_uid` is
+    ignored.  Managers may read their own data and that of their team; when
+    `employee_uid` is given it must be one of those.  Admins may read anything;
+    `None` is returned to indicate that no UID filter applies.
+
+    Raises:
+        HTTPException: If a manager requests data outside their team.
+    """
+    uid = current_user.get("uid")
+    role = current_user.get("role")
+    if role == "ADMIN":
+        return [employee_uid] if employee_uid else None
+    if role == "MANAGER":
+        team = [uid] + await get_team_uids(uid)
+        if employee_uid:
+            if employee_uid not in team:
+                raise HTTPException(status_code=403, detail="Employee is not part of your team")
+            return [employee_uid]
+        return team
+    return [uid]
+
+
+async def resolve_target_uid(current_user: Dict[str, Any], employee_uid: Optional[str] = None) -> str:
+    """Return the UID a write should be attributed to.
+
+    Callers act on their own behalf unless `employee_uid` names someone else,
+    which is only permitted for admins and for managers acting on their team.
+
+    Raises:
+        HTTPException: If the caller may not write on behalf of `employee_uid`.
+    """
+    uid = current_user.get("uid")
+    if not employee_uid or employee_uid == uid:
+        return uid
+    if current_user.get("role") not in {"MANAGER", "ADMIN"}:
+        raise HTTPException(status_code=403, detail="Only managers or admins can write on behalf of other users")
+    scope = await resolve_scope(current_user, employee_uid)
+    return scope[0] if scope else employee_uid
+
+
+async def get_team_uid(current_user: Dict[str, Any], uid: str) -> Optional[str]:
+    """Return the manager whose team `uid` belongs to.
+
+    Managers are considered part of their own team.  The caller's own profile
+    is used when `uid` is the caller; other profiles come from the profile
+    cache.
+    """
+    profile = current_user if uid == current_user.get("uid") else await get_user_profile(uid)
+    if profile.get("manager_uid"):
+        return profile["manager_uid"]
+    return uid if profile.get("role") == "MANAGER" else None
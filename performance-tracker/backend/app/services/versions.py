@@ -0,0 +1,75 @@
+"""Data versions per scope, for conditional requests and response caching.
+
+`scope_versions/{scope}` holds a counter for each rollup scope (see
+`app.services.rollups`) and for the WhatsApp records.  It is incremented in
+the same batch or transaction as every payment, call entry and WhatsApp
+write, for each scope the record belongs to, so a scope's version changes
+whenever anything a response over that scope reads may have changed.  Jobs
+that rewrite many records at once (incentive recalculation, rollup rebuild)
+increment the `global` version instead, which every response depends on.
+
+Like its rollup, the organisation-wide version is split over the `all:{n}`
+shard scopes, so no single counter takes a write from every record.  A
+record bumps the shard its owner's UID hashes to, and responses over the
+whole organisation read them all.
+
+`app.conditional` turns the versions read for a request into an ETag and a
+response cache key.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from google.cloud import firestore
+
+from ..firestore import get_async_firestore_client
+from . import rollups
+
+
+VERSIONS_COLLECTION = "scope_versions"
+
+# Version of the WhatsApp customers and payments, which have no owner.
+WHATSAPP_SCOPE = "whatsapp"
+
+# Version bumped by bulk jobs; part of every response's version.
+GLOBAL_SCOPE = "global"
+
+
+def bump(writer: Any, db: Any, scopes: Iterable[str]) -> None:
+    """Add the writes incrementing the version of each of `scopes` to `writer` (a batch or transaction)."""
+    for scope in scopes:
+        writer.set(db.collection(VERSIONS_COLLECTION).document(scope), {"version": firestore.Increment(1)}, merge=True)
+
+
+def bump_record(writer: Any, db: Any, uid: str, team_uid: Optional[str]) -> None:
+    """Add the writes incrementing the versions of every scope a record owned by `uid` belongs to."""
+    bump(writer, db, rollups.stored_scopes_for(uid, team_uid))
+
+
+def request_scopes(current_user: Dict[str, Any], employee_uid: Optional[str], uids: Optional[List[str]]) -> List[str]:
+    """Return the scopes covering the records of `uids`, as resolved by `resolve_scope`.
+
+    A manager's own records belong to their manager's team when they have one,
+    so a manager's team requests also depend on the manager's own scope.
+    """
+    if uids is None:
+        return [rollups.ALL_SCOPE]
+    if current_user.get("role") == "MANAGER" and not employee_uid:
+        return [rollups.team_scope(current_user["uid"]), rollups.employee_scope(current_user["uid"])]
+    return [rollups.employee_scope(uid) for uid in uids]
+
+
+async def read_versions(scopes: Iterable[str]) -> Dict[str, int]:
+    """Return the current version of each of `scopes` and of the global scope, in one round trip.
+
+    The organisation-wide scope is returned as the versions of its shards.
+    """
+    db = get_async_firestore_client()
+    names = sorted({counter for scope in [*scopes, GLOBAL_SCOPE] for counter in rollups.stored_scopes(scope)})
+    refs = [db.collection(VERSIONS_COLLECTION).document(scope) for scope in names]
+    versions = dict.fromkeys(names, 0)
+    async for snap in db.get_all(refs):
+        if snap.exists:
+            versions[snap.id] = int(snap.get("version") or 0)
+    return versions
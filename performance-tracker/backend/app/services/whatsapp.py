@@ -0,0 +1,151 @@
+"""WhatsApp monthly customer and payment data access.
+
+Customers are stored in `whatsapp_customers` keyed by mobile number and their
+monthly payments in `whatsapp_payments`.
+
+Each customer carries a materialised `next_due_date` (ISO string): the next
+date on which a monthly payment is expected.  It is set when the customer is
+created, advanced by one billing cycle whenever a payment is recorded, and
+always derived from the customer's `fixed_due_day` rather than from the
+previous due date, so a 31st due day rolls to 28/29 February and back to
+31 March instead of drifting.  Listing due customers is therefore a single
+indexed range query on `next_due_date`.
+"""
+
+from __future__ import annotations
+
+import calendar
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from google.cloud import firestore
+
+from .. import events
+from ..firestore import get_async_firestore_client
+from . import versions
+
+
+CUSTOMERS_COLLECTION = "whatsapp_customers"
+PAYMENTS_COLLECTION = "whatsapp_payments"
+
+
+def due_date_in_month(year: int, month: int, fixed_due_day: int) -> date:
+    """Return the due date in the given month, rolled back to the month end if needed."""
+    last_day = calendar.monthrange(year, month)[1]
+    return date(year, month, min(fixed_due_day, last_day))
+
+
+def add_months(year: int, month: int, months: int) -> tuple:
+    """Return the `(year, month)` that lies `months` calendar months after the given one."""
+    index = year * 12 + (month - 1) + months
+    return index // 12, index % 12 + 1
+
+
+def first_due_on_or_after(day: date, fixed_due_day: int) -> date:
+    """Return the first due date that falls on or after `day`."""
+    due = due_date_in_month(day.year, day.month, fixed_due_day)
+    if due >= day:
+        return due
+    return due_date_in_month(*add_months(day.year, day.month, 1), fixed_due_day)
+
+
+def next_due_after_payment(current_due: date, fixed_due_day: int) -> date:
+    """Return the due date of the billing cycle following `current_due`."""
+    return due_date_in_month(*add_months(current_due.year, current_due.month, 1), fixed_due_day)
+
+
+async def upsert_customer(customer: Dict[str, Any], today: Optional[date] = None) -> Dict[str, Any]:
+    """Create or update a customer profile keyed by `mobile`.
+
+    New customers are first due on the next occurrence of their due day.
+    When an existing customer's due day changes, the outstanding due date
+    moves to the new day within the same month.
+
+    Returns:
+        The stored customer fields, including `next_due_date`.
+    """
+    db = get_async_firestore_client()
+    ref = db.collection(CUSTOMERS_COLLECTION).document(customer["mobile"])
+    fixed_due_day = int(customer["fixed_due_day"])
+
+    @firestore.async_transactional
+    async def apply(transaction: Any) -> Dict[str, Any]:
+        snap = await ref.get(transaction=transaction)
+        existing = snap.to_dict() if snap.exists else {}
+        if existing.get("next_due_date"):
+            current = date.fromisoformat(existing["next_due_date"])
+            next_due = due_date_in_month(current.year, current.month, fixed_due_day)
+        else:
+            next_due = first_due_on_or_after(today or date.today(), fixed_due_day)
+        data = {**customer, "next_due_date": next_due.isoformat(), "updated_at": firestore.SERVER_TIMESTAMP}
+        transaction.set(ref, data, merge=True)
+        versions.bump(transaction, db, [versions.WHATSAPP_SCOPE])
+        return {**customer, "next_due_date": next_due.isoformat()}
+
+    return await apply(db.transaction())
+
+
+async def record_payment(payment: Dict[str, Any]) -> Dict[str, Any]:
+    """Persist a monthly payment and advance the customer's next due date.
+
+    The payment and the customer update are committed in one transaction.
+
+    Returns:
+        The new payment ID, the due date it settled and the next due date.
+
+    Raises:
+        KeyError: If the customer does not exist.
+    """
+    db = get_async_firestore_client()
+    customer_ref = db.collection(CUSTOMERS_COLLECTION).document(payment["mobile"])
+    payment_ref = db.collection(PAYMENTS_COLLECTION).document()
+
+    @firestore.async_transactional
+    async def apply(transaction: Any) -> Dict[str, Any]:
+        snap = await customer_ref.get(transaction=transaction)
+        if not snap.exists:
+            raise KeyError(payment["mobile"])
+        customer = snap.to_dict()
+        fixed_due_day = int(customer["fixed_due_day"])
+        if customer.get("next_due_date"):
+            settled = date.fromisoformat(customer["next_due_date"])
+        else:
+            settled = first_due_on_or_after(date.fromisoformat(payment["date_paid"]), fixed_due_day)
+        next_due = next_due_after_payment(settled, fixed_due_day)
+
+        transaction.set(
+            payment_ref,
+            {**payment, "due_date": settled.isoformat(), "created_at": firestore.SERVER_TIMESTAMP},
+        )
+        transaction.update(
+            customer_ref,
+            {
+                "next_due_date": next_due.isoformat(),
+                "last_paid_date": payment["date_paid"],
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            },
+        )
+        versions.bump(transaction, db, [versions.WHATSAPP_SCOPE])
+        return {"payment_id": payment_ref.id, "due_date": settled.isoformat(), "next_due_date": next_due.isoformat()}
+
+    result = await apply(db.transaction())
+    events.publish(
+        "whatsapp_payment",
+        None,
+        None,
+        {"mobile": payment["mobile"], "amount": payment.get("amount"), "date_paid": payment["date_paid"], **result},
+    )
+    return result
+
+
+async def list_due(start: Optional[date], end: date) -> List[Dict[str, Any]]:
+    """Return customers whose next due date lies between `start` and `end` inclusive.
+
+    A `start` of `None` also includes every overdue customer.
+    """
+    db = get_async_firestore_client()
+    query = db.collection(CUSTOMERS_COLLECTION)
+    if start is not None:
+        query = query.where("next_due_date", ">=", start.isoformat())
+    query = query.where("next_due_date", "<=", end.isoformat()).order_by("next_due_date")
+    return [{**snap.to_dict(), "due_date": snap.get("next_due_date")} async for snap in query.stream()]
@@ -0,0 +1,79 @@
+"""Coalescing write plans committed in a single round trip.
+
+A `WritePlan` accepts the same `set`/`create`/`update`/`delete` calls as a
+Firestore batch, so the existing writers (`rollups.write_payment_delta`,
+`customer_revenue.write_payment_delta`, ...) can add to it unchanged.  Merge
+writes that target the same document are combined into one write, with
+`Increment` transforms on the same field summed.  Updating a payment without
+moving it to another day therefore costs one write per rollup document
+instead of two (one reverting the old values and one applying the new ones),
+and the whole plan is committed as one batch.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+
+def _combine(old: Any, new: Any) -> Any:
+    """Return the effect of merging `new` on top of `old` in one write."""
+    if isinstance(old, firestore.Increment) and isinstance(new, firestore.Increment):
+        return firestore.Increment(old._value + new._value)
+    if isinstance(old, dict) and isinstance(new, dict):
+        combined = dict(old)
+        for key, value in new.items():
+            combined[key] = _combine(combined[key], value) if key in combined else value
+        return combined
+    return new
+
+
+class WritePlan:
+    """Document mutations collected for one commit.
+
+    Only merge writes may target a document more than once; any other repeat
+    raises `ValueError`, since silently dropping one of the writes would
+    corrupt data.
+    """
+
+    def __init__(self) -> None:
+        # Document path -> (method, reference, data, keyword arguments).
+        self._writes: Dict[str, Tuple[str, Any, Any, Dict[str, Any]]] = {}
+
+    def _add(self, method: str, reference: Any, data: Any, **kwargs: Any) -> None:
+        existing = self._writes.get(reference.path)
+        if existing is None:
+            self._writes[reference.path] = (method, reference, data, kwargs)
+            return
+        if method == "set" and kwargs.get("merge") and existing[0] == "set" and existing[3].get("merge"):
+            self._writes[reference.path] = (method, reference, _combine(existing[2], data), kwargs)
+            return
+        raise ValueError(f"Conflicting writes to {reference.path}")
+
+    def set(self, reference: Any, document_data: Dict[str, Any], merge: bool = False) -> None:
+        self._add("set", reference, document_data, merge=merge)
+
+    def create(self, reference: Any, document_data: Dict[str, Any]) -> None:
+        self._add("create", reference, document_data)
+
+    def update(self, reference: Any, field_updates: Dict[str, Any], option: Optional[Any] = None) -> None:
+        self._add("update", reference, field_updates, option=option)
+
+    def delete(self, reference: Any, option: Optional[Any] = None) -> None:
+        self._add("delete", reference, None, option=option)
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def apply(self, writer: Any) -> None:
+        """Add every planned write to `writer` (a batch or transaction)."""
+        for method, reference, data, kwargs in self._writes.values():
+            args: List[Any] = [reference] if data is None else [reference, data]
+            getattr(writer, method)(*args, **{key: value for key, value in kwargs.items() if value is not None})
+
+    async def commit(self, db: Any) -> None:
+        """Commit the plan as one batch (a single round trip)."""
+        batch = db.batch()
+        self.apply(batch)
+        await batch.commit()
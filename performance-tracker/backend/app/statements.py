@@ -0,0 +1,137 @@
+"""Rendering of monthly incentive statements.
+
+A statement lists one employee's payments in a month next to their
+incentives and totals them by service.  This module only turns the fetched
+records into CSV and HTML; it imports nothing but the standard library so
+that `app.jobs.generate_statements` can run it in worker processes without
+loading the API.  Storage and freshness live in `app.services.statements`.
+"""
+
+from __future__ import annotations
+
+import csv
+import html
+import io
+from typing import Any, Dict, List
+
+STATEMENT_FORMAT_PATTERN = "^(csv|html)$"
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "html": "text/html; charset=utf-8"}
+
+COLUMNS = [
+    "payment_id",
+    "date",
+    "customer_name",
+    "mobile",
+    "service",
+    "amount_paid",
+    "base_percent",
+    "global_percent",
+    "incentive_amount",
+]
+
+
+def _rows(statement: Dict[str, Any]) -> List[Dict[str, Any]]:
+    incentives = statement["incentives"]
+    rows = []
+    for payment in sorted(statement["payments"], key=lambda p: (p["date"], p["id"])):
+        incentive = incentives.get(payment["id"], {})
+        rows.append(
+            {
+                "payment_id": payment["id"],
+                "date": payment["date"],
+                "customer_name": payment.get("customer_name"),
+                "mobile": payment.get("mobile"),
+                "service": payment.get("service"),
+                "amount_paid": round(float(payment.get("amount_paid", 0.0)), 2),
+                "base_percent": incentive.get("base_percent"),
+                "global_percent": incentive.get("global_percent"),
+                "incentive_amount": round(float(incentive.get("incentive_amount", 0.0)), 2),
+            }
+        )
+    return rows
+
+
+def _totals(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    by_service: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        totals = by_service.setdefault(row["service"], {"count": 0, "amount_paid": 0.0, "incentive_amount": 0.0})
+        totals["count"] += 1
+        totals["amount_paid"] += row["amount_paid"]
+        totals["incentive_amount"] += row["incentive_amount"]
+    for totals in by_service.values():
+        totals["amount_paid"] = round(totals["amount_paid"], 2)
+        totals["incentive_amount"] = round(totals["incentive_amount"], 2)
+    return {
+        "count": len(rows),
+        "amount_paid": round(sum(row["amount_paid"] for row in rows), 2),
+        "incentive_amount": round(sum(row["incentive_amount"] for row in rows), 2),
+        "by_service": dict(sorted(by_service.items())),
+    }
+
+
+def _csv(rows: List[Dict[str, Any]], totals: Dict[str, Any]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow([row[column] for column in COLUMNS])
+    writer.writerow([])
+    writer.writerow(["service", "count", "amount_paid", "incentive_amount"])
+    for service, service_totals in totals["by_service"].items():
+        writer.writerow([service, service_totals["count"], service_totals["amount_paid"], service_totals["incentive_amount"]])
+    writer.writerow(["TOTAL", totals["count"], totals["amount_paid"], totals["incentive_amount"]])
+    return buffer.getvalue()
+
+
+def _html_row(cells: List[Any], tag: str = "td") -> str:
+    return "<tr>" + "".join(f"<{tag}>{html.escape('' if cell is None else str(cell))}</{tag}>" for cell in cells) + "</tr>"
+
+
+def _html(statement: Dict[str, Any], rows: List[Dict[str, Any]], totals: Dict[str, Any]) -> str:
+    title = f"Incentive statement {statement['month']}: {statement.get('name') or statement['uid']}"
+    summary = [_html_row(["service", "count", "amount_paid", "incentive_amount"], "th")]
+    for service, service_totals in totals["by_service"].items():
+        summary.append(
+            _html_row([service, service_totals["count"], service_totals["amount_paid"], service_totals["incentive_amount"]])
+        )
+    summary.append(_html_row(["TOTAL", totals["count"], totals["amount_paid"], totals["incentive_amount"]], "th"))
+    return "\n".join(
+        [
+            "<!DOCTYPE html>",
+            f"<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head><body>",
+            f"<h1>{html.escape(title)}</h1>",
+            "<table>",
+            _html_row(COLUMNS, "th"),
+            *(_html_row([row[column] for column in COLUMNS]) for row in rows),
+            "</table>",
+            "<h2>Totals by service</h2>",
+            "<table>",
+            *summary,
+            "</table>",
+            "</body></html>",
+            "",
+        ]
+    )
+
+
+def render_statement(statement: Dict[str, Any]) -> Dict[str, Any]:
+    """Render one statement.
+
+    Args:
+        statement: `uid`, `name`, `month`, the employee's `payments` in the
+            month (each with its `id`) and their `incentives` keyed by
+            payment ID.
+
+    Returns:
+        The `uid`, the `totals` (overall and by service) and the statement as
+        `csv` and `html`.
+    """
+    rows = _rows(statement)
+    totals = _totals(rows)
+    return {"uid": statement["uid"], "totals": totals, "csv": _csv(rows, totals), "html": _html(statement, rows, totals)}
+
+
+def render_statements(statements: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Render a chunk of statements; the unit of work sent to a worker process."""
+    return [render_statement(statement) for statement in statements]
@@ -0,0 +1,81 @@
+"""Startup warm-up run from the application's lifespan hook.
+
+On a cold instance the first authenticated request used to pay for loading
+the Firebase Admin SDK and service account credentials, opening the
+Firestore gRPC channel (including an OAuth token exchange), and downloading
+Google's token-signing certificates.  `warm_up` does all of that before the
+instance starts accepting traffic.  The Firebase steps run on the blocking
+pool while the Firestore round trip is in flight, so the import and network
+work overlap.
+
+Every step is best effort: a failure or timeout is logged and the instance
+still starts, leaving that step to happen lazily on the first request as
+before.  Set `WARMUP_ON_STARTUP=0` to skip warm-up entirely.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from . import auth
+from .firestore import run_blocking
+
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") != "0"
+
+# Upper bound on each warm-up step, in seconds.
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+
+
+def _warm_firebase() -> None:
+    """Initialise Firebase Admin and prefetch the ID token signing certificates (blocking)."""
+    from firebase_admin import auth as firebase_auth
+
+    app = auth._initialize_firebase_app()
+    # The verifier fetches the certificates through a cache-control aware
+    # session, so fetching them once here means the first real verification
+    # is served from cache.  This reaches into SDK internals and is skipped
+    # if they change.
+    verifier = getattr(firebase_auth._get_client(app), "_token_verifier", None)
+    id_token_verifier = getattr(verifier, "id_token_verifier", None)
+    if verifier is not None and id_token_verifier is not None:
+        verifier.request(url=id_token_verifier.cert_url)
+
+
+async def _warm_firestore() -> None:
+    """Open the Firestore channel by loading the master-data cache."""
+    from .services.master_data import get_master_data
+
+    await get_master_data(max_age=0)
+
+
+async def _timed(name: str, step: Callable[[], Awaitable[Any]], timings: Dict[str, Any]) -> None:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(step(), timeout=WARMUP_TIMEOUT)
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    except Exception as exc:  # warm-up must never stop the instance from starting
+        timings[name] = f"failed: {exc!r}"
+        logger.warning("warm-up step %s failed: %r", name, exc)
+
+
+async def warm_up() -> Dict[str, Any]:
+    """Run every warm-up step concurrently.
+
+    Returns:
+        Milliseconds taken per step, or the failure of steps that failed.
+    """
+    timings: Dict[str, Any] = {}
+    steps = [_timed("firestore", _warm_firestore, timings)]
+    # Nothing to warm when tokens are verified by a stand-in (see `create_app`).
+    if auth._token_verifier is auth._verify_with_firebase:
+        steps.append(_timed("firebase", lambda: run_blocking(_warm_firebase), timings))
+    await asyncio.gather(*steps)
+    logger.info("warm-up finished: %s", timings)
+    return timings
@@ -0,0 +1,5 @@
+"""Benchmark scripts for the backend.
+
+Each module can be run directly, e.g. `python -m benchmarks.bench_async_io`
+from the `backend` directory.
+"""
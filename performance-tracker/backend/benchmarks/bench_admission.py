@@ -0,0 +1,134 @@
+"""Month-end burst with and without admission control.
+
+Seeds the in-memory backend and fires a burst of expensive requests
+(employees' overviews and payment exports) all at once, together with cheap
+requests (`/users/me` and a page of call entries).  The fake Firestore is
+given a limited capacity: each round trip takes `--latency-ms`, stretched in
+proportion to the number of round trips in flight beyond `--capacity`,
+roughly as a contended backend behaves before it starts returning quota
+errors.
+
+For each mode the benchmark reports, per request kind, the number of
+successful and rejected (429) requests and the p50/p99 latency of the
+successful ones, plus the peak number of Firestore round trips in flight.
+
+Usage::
+
+    python -m benchmarks.bench_admission --burst 300 --cheap 200 --capacity 32 --latency-ms 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import httpx
+
+from app import admission
+from app.fakes import FakeTokenVerifier, InMemoryFirestore
+from app.main import create_app
+
+from .seed import seed
+
+
+class _ContendedFirestore(InMemoryFirestore):
+    """In-memory Firestore whose round trips slow down past a concurrency capacity."""
+
+    def __init__(self, capacity: int) -> None:
+        super().__init__()
+        self.capacity = capacity
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def _round_trip(self) -> None:
+        self.stats["round_trips"] += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency * max(1.0, self.in_flight / self.capacity))
+        finally:
+            self.in_flight -= 1
+
+
+def _percentile(values: List[float], q: int) -> float:
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+async def _run(args: argparse.Namespace, enabled: bool) -> None:
+    db = _ContendedFirestore(args.capacity)
+    admission.admission = admission.AdmissionController()
+    app = create_app(firestore_client=db, token_verifier=FakeTokenVerifier(), admission_control=enabled)
+    data = await seed(args.managers, args.employees, args.days, whatsapp_customers=0)
+    db.latency = args.latency_ms / 1000
+    months = f"from={data.start.isoformat()}&to={data.end.isoformat()}"
+    rng = random.Random(args.seed)
+    employees = list(data.employees)
+
+    requests: List[Tuple[str, str, str]] = []
+    for _ in range(args.burst):
+        uid = rng.choice(employees)
+        url = rng.choice([f"/analytics/overview?{months}", f"/payments/export?{months}&format=ndjson"])
+        requests.append(("expensive", url, uid))
+    for _ in range(args.cheap):
+        uid = rng.choice(employees)
+        requests.append(("cheap", rng.choice(["/users/me", f"/calls/?{months}&limit=20"]), uid))
+    rng.shuffle(requests)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[Tuple[str, int], int] = defaultdict(int)
+
+    async def one(client: httpx.AsyncClient, kind: str, url: str, uid: str) -> None:
+        started = time.perf_counter()
+        response = await client.get(url, headers={"Authorization": f"Bearer {uid}"})
+        statuses[kind, response.status_code] += 1
+        if response.status_code == 200:
+            latencies[kind].append(time.perf_counter() - started)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, *request) for request in requests))
+        elapsed = time.perf_counter() - started
+
+    mode = "on" if enabled else "off"
+    for kind in ("cheap", "expensive"):
+        ok = statuses[kind, 200]
+        rejected = statuses[kind, 429]
+        print(
+            f"{mode:<5} {kind:<10} {ok:>6} {rejected:>6} {_percentile(latencies[kind], 50) * 1000:>9.1f} "
+            f"{_percentile(latencies[kind], 99) * 1000:>9.1f}"
+        )
+    print(f"{mode:<5} peak Firestore round trips in flight: {db.peak_in_flight}, burst took {elapsed:.2f}s")
+    if enabled:
+        stats = admission.admission.stats()
+        print(f"{mode:<5} counters: {stats['counters']}, queue waits: {stats['queue_wait_seconds']['count']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=300, help="Expensive requests fired at once")
+    parser.add_argument("--cheap", type=int, default=200, help="Cheap requests fired alongside")
+    parser.add_argument("--capacity", type=int, default=32, help="Round trips in flight before latency degrades")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Uncontended Firestore round trip")
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    print(f"{'mode':<5} {'kind':<10} {'200':>6} {'429':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for enabled in (False, True):
+        asyncio.run(_run(args, enabled))
+
+
+if __name__ == "__main__":
+    main()
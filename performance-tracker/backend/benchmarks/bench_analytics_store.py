@@ -0,0 +1,143 @@
+"""Analytics from Firestore rollups vs. the embedded DuckDB mirror.
+
+Seeds an `InMemoryFirestore` with a year of data and answers the overview,
+weekly trends and top customers for the whole organisation, one team and
+one employee, both ways:
+
+* **rollups**: the default Firestore-side aggregation, reading the daily
+  rollups and the customer revenue index (`app.services.rollups`,
+  `app.services.trends`, `app.services.customer_revenue`);
+* **duckdb**: SQL over the mirror (`app.services.analytics_store`), already
+  synced.
+
+Both answers are checked to match.  The benchmark then reports the cost of
+the initial sync and of an incremental sync after a few writes, which is what
+a query pays when the mirror is older than `ANALYTICS_MAX_STALENESS`.
+
+Usage::
+
+    python -m benchmarks.bench_analytics_store --employees 40 --days 365 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import time
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from app.fakes import InMemoryFirestore
+from app.firestore import use_firestore_client
+from app.models import Payment
+from app.services import analytics_store, customer_revenue, rollups, trends
+from app.services import payments as payment_service
+
+from .seed import seed
+
+
+END = date(2024, 12, 31)
+
+
+def _same(a: Any, b: Any) -> bool:
+    if isinstance(a, dict):
+        return isinstance(b, dict) and a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return math.isclose(a, b, abs_tol=0.011)
+    return a == b
+
+
+def _revenues(customers: List[Dict[str, Any]]) -> List[float]:
+    return [round(customer["revenue"], 2) for customer in customers]
+
+
+async def _timed(db: InMemoryFirestore, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, Dict[str, int], float]:
+    db.reset_stats()
+    started = time.perf_counter()
+    result = await call()
+    return result, db.stats.copy(), (time.perf_counter() - started) * 1000
+
+
+async def _run(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    start = END - timedelta(days=args.days - 1)
+    started = time.perf_counter()
+    data = await seed(args.managers, args.employees, args.days, args.payments_per_day, whatsapp_customers=0, end=END)
+    print(f"seeded {args.employees} employees x {args.days} days in {time.perf_counter() - started:.1f}s")
+    db.latency = args.latency_ms / 1000
+    # Let the seeded writes fall outside the sync overlap window.
+    await asyncio.sleep(analytics_store.ANALYTICS_SYNC_OVERLAP.total_seconds())
+
+    store = analytics_store.AnalyticsStore(":memory:", max_staleness=math.inf)
+    sync, stats, ms = await _timed(db, store.sync)
+    rows = sync["payments"] + sync["incentives"] + sync["calls"]
+    print(f"initial sync: {rows:,} rows, {stats['reads']:,} reads, {stats['round_trips']} round trips, {ms:.0f} ms\n")
+
+    team = data.managers[0]
+    employee = next(iter(data.employees))
+    scopes = [rollups.ALL_SCOPE, rollups.team_scope(team), rollups.employee_scope(employee)]
+
+    print(f"{'query':<14} {'scope':<12} {'rollups ms':>11} {'reads':>7} {'trips':>6} {'duckdb ms':>10} {'match':>6}")
+    for scope in scopes:
+        queries = {
+            "overview": (
+                lambda: rollups.read_overview(scope, start, END),
+                lambda: store.overview(scope, start, END),
+                lambda a, b: _same(a, b),
+            ),
+            "weekly trends": (
+                lambda: _rollup_trends(scope, start),
+                lambda: _store_trends(store, scope, start),
+                lambda a, b: _same(a, b),
+            ),
+            "top customers": (
+                lambda: customer_revenue.top_customers(scope, start, END, 10),
+                lambda: store.top_customers(scope, start, END, 10),
+                lambda a, b: _revenues(a) == _revenues(b),
+            ),
+        }
+        for name, (firestore_side, mirror, check) in queries.items():
+            expected, stats, rollup_ms = await _timed(db, firestore_side)
+            actual, _, duckdb_ms = await _timed(db, mirror)
+            print(
+                f"{name:<14} {scope:<12} {rollup_ms:>11.1f} {stats['reads']:>7} {stats['round_trips']:>6} "
+                f"{duckdb_ms:>10.1f} {str(check(expected, actual)):>6}"
+            )
+
+    for payment_id in data.payment_ids[: args.changes]:
+        stored = await payment_service.get_payment(payment_id)
+        fields = {key: stored[key] for key in Payment.__fields__ if key in stored}
+        await payment_service.update_payment(payment_id, Payment(**{**fields, "amount_paid": 1234.5}))
+    sync, stats, ms = await _timed(db, store.sync)
+    print(
+        f"\nincremental sync after {args.changes} payment updates: {sync['payments']} payments re-read, "
+        f"{stats['reads']:,} reads, {stats['round_trips']} round trips, {ms:.0f} ms"
+    )
+
+
+async def _rollup_trends(scope: str, start: date) -> Dict[str, Any]:
+    return trends.trends_from_rollups(await rollups.read_daily(scope, start, END), start, END, "week")
+
+
+async def _store_trends(store: analytics_store.AnalyticsStore, scope: str, start: date) -> Dict[str, Any]:
+    return trends.trends_from_totals(await store.trend_totals(scope, start, END, "week"), start, END, "week")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--payments-per-day", type=float, default=2.0)
+    parser.add_argument("--changes", type=int, default=50, help="Payments updated before the incremental sync")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Concurrent-request throughput: blocking vs. asynchronous Firestore client.
+
+Seeds an `InMemoryFirestore` with `benchmarks.seed`, builds the real FastAPI
+app around it and drives a mix of authenticated reads through
+`httpx.AsyncClient`, so every request goes through `get_current_user`, the
+token verifier on the `run_blocking` pool and the services' Firestore calls.
+Each Firestore round trip takes `--rtt-ms` and each token verification
+`--verify-ms` of blocking work.  The app is measured twice over the same
+data:
+
+* **blocking**: the round trips block the event loop, as a synchronous
+  client called from the coroutines would;
+* **async**: the round trips are awaited, as with the `AsyncClient` the app
+  uses.
+
+The token, profile, team and response caches are emptied before each run, so
+both runs verify the same tokens and make the same round trips.
+
+Usage::
+
+    python -m benchmarks.bench_async_io --requests 400 --concurrency 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from app import auth, conditional
+from app.fakes import FakeTokenVerifier, InMemoryFirestore
+from app.main import create_app
+from app.services import trends
+from app.services.users import invalidate_team_membership
+
+from .seed import Dataset, seed
+
+
+class BlockingFirestore(InMemoryFirestore):
+    """The in-memory store with round trips that block the calling thread."""
+
+    async def _round_trip(self) -> None:
+        self.stats["round_trips"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class SlowTokenVerifier(FakeTokenVerifier):
+    """A fake verifier spending `seconds` of blocking work on every token, like the Firebase Admin SDK."""
+
+    def __init__(self, seconds: float) -> None:
+        super().__init__()
+        self.seconds = seconds
+
+    def __call__(self, id_token: str) -> Dict[str, Any]:
+        time.sleep(self.seconds)
+        return super().__call__(id_token)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight at once")
+    parser.add_argument("--verify-ms", type=float, default=3.0, help="Token verification time")
+    parser.add_argument("--rtt-ms", type=float, default=15.0, help="Firestore round-trip time")
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=30)
+    return parser.parse_args()
+
+
+def _requests(data: Dataset, count: int) -> List[Tuple[str, Dict[str, str]]]:
+    """Return `count` `(url, headers)` pairs cycling through employees, managers and endpoints."""
+    months = f"from={data.start.isoformat()}&to={data.end.isoformat()}"
+    employees = itertools.cycle(data.employees)
+    managers = itertools.cycle(data.managers)
+    kinds = itertools.cycle(
+        [
+            ("/users/me", employees),
+            (f"/calls/?{months}&limit=50", employees),
+            (f"/payments/?{months}&limit=50", managers),
+            (f"/analytics/overview?{months}", managers),
+        ]
+    )
+    requests = []
+    for _ in range(count):
+        url, users = next(kinds)
+        requests.append((url, {"Authorization": f"Bearer {next(users)}"}))
+    return requests
+
+
+def _reset_caches() -> None:
+    auth._token_cache.clear()
+    auth._profile_cache.clear()
+    invalidate_team_membership()
+    conditional._responses.clear()
+    trends._trends_cache.clear()
+
+
+async def _run(db: InMemoryFirestore, args: argparse.Namespace) -> Dict[str, Any]:
+    verifier = SlowTokenVerifier(args.verify_ms / 1000)
+    app = create_app(db, verifier, admission_control=False)
+    data = await seed(args.managers, args.employees, args.days, whatsapp_customers=0)
+    _reset_caches()
+    db.latency = args.rtt_ms / 1000
+    db.reset_stats()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    errors = 0
+
+    async def one(client: httpx.AsyncClient, url: str, headers: Dict[str, str]) -> None:
+        nonlocal errors
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+        if response.status_code >= 400:
+            errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, url, headers) for url, headers in _requests(data, args.requests)))
+        elapsed = time.perf_counter() - started
+    return {
+        "elapsed": elapsed,
+        "rps": args.requests / elapsed,
+        "round_trips": db.stats["round_trips"] / args.requests,
+        "verifications": verifier.calls,
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    args = _parse_args()
+    results = {}
+    print(f"{'client':>8} {'seconds':>8} {'req/s':>8} {'rt/req':>7} {'verified':>9} {'errors':>7}")
+    for name, client_class in (("blocking", BlockingFirestore), ("async", InMemoryFirestore)):
+        result = results[name] = asyncio.run(_run(client_class(), args))
+        print(
+            f"{name:>8} {result['elapsed']:>8.3f} {result['rps']:>8.1f} {result['round_trips']:>7.1f} "
+            f"{result['verifications']:>9} {result['errors']:>7}"
+        )
+    print(f" speedup: {results['async']['rps'] / results['blocking']['rps']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
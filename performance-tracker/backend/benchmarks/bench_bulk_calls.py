@@ -0,0 +1,66 @@
+"""Bulk call-entry upsert vs. N single upserts.
+
+Models a manager backfilling a week for their team.  The single-entry path
+costs one HTTP round trip and one batch commit (entry plus its three rollup
+writes) per entry, sent sequentially as the dashboard does.  The bulk path
+costs one HTTP round trip and ceil(writes / 500) commits, issued with the
+same concurrency as `app.services.calls.BULK_COMMIT_CONCURRENCY`, with rollup
+writes for the same day coalesced.  Round trips are simulated with
+`asyncio.sleep`; write counts are exact.
+
+Usage::
+
+    python -m benchmarks.bench_bulk_calls --employees 40 --days 7
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import time
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--http-ms", type=float, default=40.0, help="Client to API round trip")
+    parser.add_argument("--commit-ms", type=float, default=25.0, help="Firestore batch commit round trip")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent bulk commits")
+    return parser.parse_args()
+
+
+async def _singles(args: argparse.Namespace, entries: int) -> int:
+    for _ in range(entries):
+        await asyncio.sleep(args.http_ms / 1000)
+        await asyncio.sleep(args.commit_ms / 1000)
+    return entries * 4  # call document + employee, team and organisation rollups
+
+
+async def _bulk(args: argparse.Namespace, entries: int) -> int:
+    writes = entries + entries + 2 * args.days  # calls + per-employee rollups + shared team/org rollups per day
+    batches = math.ceil(writes / 500)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def commit() -> None:
+        async with semaphore:
+            await asyncio.sleep(args.commit_ms / 1000)
+
+    await asyncio.sleep(args.http_ms / 1000)
+    await asyncio.gather(*(commit() for _ in range(batches)))
+    return writes
+
+
+def main() -> None:
+    args = _parse_args()
+    entries = args.employees * args.days
+    for name, runner in (("single", _singles), ("bulk", _bulk)):
+        start = time.perf_counter()
+        writes = asyncio.run(runner(args, entries))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>6}: {entries} entries in {elapsed:7.3f}s, {writes} document writes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Read cost of listing call entries in the daily and monthly storage layouts.
+
+Seeds an `InMemoryFirestore` with per-day call entries, copies them into month
+documents with `app.jobs.migrate_call_layout`, and then lists a manager's
+whole team over the seeded range in each layout, paging until the last page.
+It reports document reads, round trips and wall time per listing, checks
+that both layouts return the same entries, and measures the cost of one
+upsert in each layout.
+
+Usage::
+
+    python -m benchmarks.bench_call_layout --employees 40 --days 90 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from app.fakes import InMemoryFirestore
+from app.firestore import use_firestore_client
+from app.jobs.migrate_call_layout import migrate_call_layout
+from app.models import CallEntry
+from app.services import calls as call_service
+from app.services.users import get_team_uids
+
+from .seed import seed
+
+
+async def _list_all(uids: List[str], data: Any, limit: int) -> List[Dict[str, Any]]:
+    entries: List[Dict[str, Any]] = []
+    cursor: Optional[str] = None
+    while True:
+        page, cursor = await call_service.list_call_entries(uids, data.start, data.end, cursor, limit)
+        entries.extend(page)
+        if cursor is None:
+            return entries
+
+
+async def _main(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    data = await seed(1, args.employees, args.days, payments_per_day=0, whatsapp_customers=0)
+    migrated = await migrate_call_layout()
+    print(f"{args.employees} employees x {args.days} days; migration: {migrated}")
+    uids = [data.managers[0]] + await get_team_uids(data.managers[0])
+    db.latency = args.latency_ms / 1000
+
+    print(f"{'layout':<8} {'page':>5} {'reads':>7} {'round trips':>12} {'ms':>9} {'entries':>8}")
+    listings = {}
+    for layout in ("daily", "monthly"):
+        call_service.CALL_STORAGE_LAYOUT = layout
+        for limit in args.page_sizes:
+            db.reset_stats()
+            started = time.perf_counter()
+            entries = await _list_all(uids, data, limit)
+            elapsed = (time.perf_counter() - started) * 1000
+            listings[layout, limit] = [{k: v for k, v in entry.items() if k != "updated_at"} for entry in entries]
+            print(
+                f"{layout:<8} {limit:>5} {db.stats['reads']:>7} {db.stats['round_trips']:>12} "
+                f"{elapsed:>9.1f} {len(entries):>8}"
+            )
+    identical = all(listings["daily", limit] == listings["monthly", limit] for limit in args.page_sizes)
+    print(f"same entries in both layouts: {identical}")
+
+    entry = CallEntry(date=data.end, answered_calls=5, unanswered_calls=1, total_call_time_minutes=20, demos=[])
+    for layout in ("daily", "monthly"):
+        call_service.CALL_STORAGE_LAYOUT = layout
+        db.reset_stats()
+        await call_service.upsert_call_entry(uids[-1], data.managers[0], entry)
+        print(f"upsert ({layout}): {db.stats['writes']} writes, {db.stats['round_trips']} round trip")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    parser.add_argument("--page-size", dest="page_sizes", type=int, action="append", help="Repeatable")
+    args = parser.parse_args()
+    args.page_sizes = args.page_sizes or [100, 500]
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
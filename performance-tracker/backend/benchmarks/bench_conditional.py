@@ -0,0 +1,99 @@
+"""Dashboard re-fetches with and without scope-versioned caching.
+
+Seeds the in-memory backend and replays a manager's dashboard (the 90-day
+overview, weekly trends and the first page of incentives) through the API
+several times:
+
+* **uncached**: the response cache is emptied before every request, so each
+  one runs its queries (plus the version read);
+* **cache miss**: the first request with the cache in use, which stores
+  the response;
+* **cache hit**: a repeat request without `If-None-Match`, answered from the
+  in-process response cache;
+* **304**: a repeat request sending the previous ETag;
+* **after write**: the first request after a payment in the manager's team,
+  which must run its queries again.
+
+Reports Firestore reads, round trips and latency per dashboard load.
+
+Usage::
+
+    python -m benchmarks.bench_conditional --employees 40 --days 90 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+from typing import Dict, List
+
+import httpx
+
+from app import conditional
+from app.fakes import FakeTokenVerifier, InMemoryFirestore
+from app.main import create_app
+from app.models import Payment
+from app.services import payments as payment_service
+
+from .seed import seed
+
+
+async def _run(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    app = create_app(firestore_client=db, token_verifier=FakeTokenVerifier(), admission_control=False)
+    data = await seed(args.managers, args.employees, args.days, whatsapp_customers=0)
+    db.latency = args.latency_ms / 1000
+    manager = data.managers[0]
+    employee = next(uid for uid, team in data.employees.items() if team == manager)
+    start = data.end - timedelta(days=89)
+    window = f"from={start.isoformat()}&to={data.end.isoformat()}"
+    urls = [f"/analytics/overview?{window}", f"/analytics/trends?{window}&granularity=week", "/incentives/?limit=50"]
+    headers = {"Authorization": f"Bearer {manager}"}
+    etags: Dict[str, str] = {}
+
+    async def load(client: httpx.AsyncClient, mode: str) -> List[int]:
+        db.reset_stats()
+        started = time.perf_counter()
+        statuses = []
+        for url in urls:
+            if mode == "uncached":
+                conditional._responses.clear()
+            extra = {"If-None-Match": etags[url]} if mode == "304" and url in etags else {}
+            response = await client.get(url, headers={**headers, **extra})
+            etags[url] = response.headers.get("etag", "")
+            statuses.append(response.status_code)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{mode:<12} {db.stats['reads']:>7} {db.stats['round_trips']:>6} {elapsed:>9.1f}  {statuses}")
+        return statuses
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"{'mode':<12} {'reads':>7} {'trips':>6} {'ms':>9}  statuses")
+        for _ in range(args.repeat):
+            await load(client, "uncached")
+        await load(client, "cache miss")
+        for mode in ("cache hit", "304"):
+            for _ in range(args.repeat):
+                await load(client, mode)
+        stored = await payment_service.get_payment(data.payment_ids[0])
+        fields = {key: stored[key] for key in Payment.__fields__ if key in stored}
+        await payment_service.create_payment(employee, manager, Payment(**{**fields, "date": data.end}))
+        await load(client, "after write")
+        await load(client, "304")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=2, help="Dashboard loads per mode")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
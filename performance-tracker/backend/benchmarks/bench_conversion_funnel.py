@@ -0,0 +1,129 @@
+"""Conversion funnel from the demo index vs. a join over the raw records.
+
+Seeds an `InMemoryFirestore` whose demos are given on the same customer cards
+as the payments, then computes the demo-to-payment funnel for the whole
+organisation, one team and one employee, both ways:
+
+* **raw**: what the funnel would cost without the index: read every call
+  entry and every payment (demos can convert long after the range), join them
+  on the card link in Python;
+* **index**: `app.services.demo_index.conversion_funnel`, reading the demo
+  index entries in the range and the payments of the demoed cards.
+
+Both answers are checked to match, and the reads, round trips and time of
+each are reported.
+
+Usage::
+
+    python -m benchmarks.bench_conversion_funnel --employees 40 --days 90 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.fakes import InMemoryFirestore
+from app.firestore import use_firestore_client
+from app.services import calls as call_service
+from app.services import demo_index, rollups
+from app.services import payments as payment_service
+
+from .seed import seed
+
+
+END = date(2024, 12, 31)
+
+
+async def _raw_funnel(uids: Optional[List[str]], from_date: date, to_date: date) -> Dict[str, Any]:
+    """Join the call entries and payments directly, as the funnel would without the index."""
+    records = await call_service.fetch_call_records(from_date, to_date)
+    first_demo: Dict[Tuple[str, str], str] = {}
+    demo_counts: Dict[str, int] = defaultdict(int)
+    for record in records:
+        if uids is not None and record["uid"] not in uids:
+            continue
+        for demo in record.get("demos") or []:
+            demo_counts[record["uid"]] += 1
+            key = (record["uid"], demo_index.card_key(demo["demo_card_link"]))
+            first_demo[key] = min(record["date"], first_demo.get(key, record["date"]))
+
+    payments: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+    async for payment in payment_service.stream_payments(None, None, None):
+        payments[demo_index.card_key(payment["customer_card_link"])].append(
+            (payment["date"], float(payment["amount_paid"]))
+        )
+
+    def summarise(demos: int, demoed: Dict[str, str]) -> Dict[str, Any]:
+        days, revenue = [], 0.0
+        for card, day in demoed.items():
+            later = sorted(paid for paid in payments.get(card, []) if paid[0] >= day)
+            if later:
+                days.append((date.fromisoformat(later[0][0]) - date.fromisoformat(day)).days)
+                revenue += sum(amount for _, amount in later)
+        return demo_index._funnel(demos, len(demoed), days, revenue)
+
+    by_employee: Dict[str, Dict[str, str]] = defaultdict(dict)
+    overall: Dict[str, str] = {}
+    for (uid, card), day in first_demo.items():
+        by_employee[uid][card] = day
+        overall[card] = min(day, overall.get(card, day))
+    return {
+        **summarise(sum(demo_counts.values()), overall),
+        "employees": [{"uid": uid, **summarise(demo_counts[uid], by_employee[uid])} for uid in sorted(by_employee)],
+    }
+
+
+async def _timed(db: InMemoryFirestore, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, Dict[str, int], float]:
+    db.reset_stats()
+    started = time.perf_counter()
+    result = await call()
+    return result, db.stats.copy(), (time.perf_counter() - started) * 1000
+
+
+async def _run(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    data = await seed(args.managers, args.employees, args.days, args.payments_per_day, whatsapp_customers=0, end=END)
+    db.latency = args.latency_ms / 1000
+    start = END - timedelta(days=args.range_days - 1)
+
+    team = data.managers[0]
+    team_uids = [uid for uid, manager in data.employees.items() if manager == team] + [team]
+    employee = next(iter(data.employees))
+    scopes: List[Tuple[str, Optional[List[str]]]] = [
+        (rollups.ALL_SCOPE, None),
+        (rollups.team_scope(team), team_uids),
+        (rollups.employee_scope(employee), [employee]),
+    ]
+
+    print(f"{'scope':<12} {'mode':<6} {'ms':>9} {'reads':>8} {'trips':>6} {'rate':>7} {'match':>6}")
+    for scope, uids in scopes:
+        expected, raw_stats, raw_ms = await _timed(db, lambda: _raw_funnel(uids, start, END))
+        actual, stats, ms = await _timed(db, lambda: demo_index.conversion_funnel(scope, start, END))
+        match = str(actual == expected)
+        for mode, result, run_stats, run_ms in (("raw", expected, raw_stats, raw_ms), ("index", actual, stats, ms)):
+            print(
+                f"{scope:<12} {mode:<6} {run_ms:>9.1f} {run_stats['reads']:>8,} {run_stats['round_trips']:>6} "
+                f"{result['conversion_rate']:>7.2%} {match:>6}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90, help="Days of seeded data")
+    parser.add_argument("--range-days", type=int, default=30, help="Days of demos in the funnel")
+    parser.add_argument("--payments-per-day", type=float, default=2.0)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Per-endpoint latency and throughput against the in-process backend.
+
+Seeds an `InMemoryFirestore` with `benchmarks.seed`, builds the real FastAPI
+app around it with fake token verification, and drives every router through
+`httpx.AsyncClient` over an ASGI transport, so no network, credentials or
+emulator are needed.  Each Firestore round trip can be delayed with
+`--latency-ms` to approximate a deployed backend; the number of round trips
+per request is reported alongside p50/p95/p99 latency and requests/second.
+
+Usage::
+
+    python -m benchmarks.bench_endpoints --requests 200 --concurrency 16 --latency-ms 5
+    python -m benchmarks.bench_endpoints --only overview --only list_calls
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+
+from app.fakes import FakeTokenVerifier, InMemoryFirestore
+from app.main import create_app
+
+from .seed import Dataset, seed
+
+
+RequestFactory = Callable[[random.Random], Tuple[str, str, Dict[str, Any]]]
+
+
+def _scenarios(data: Dataset) -> Dict[str, RequestFactory]:
+    """Map scenario names to factories returning `(method, url, kwargs)`."""
+    employees = list(data.employees)
+    months = f"from={data.start.isoformat()}&to={data.end.isoformat()}"
+    counter = itertools.count()
+
+    def auth(uid: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {uid}"}
+
+    def call_entry(rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+        uid = rng.choice(employees)
+        body = {"date": data.end.isoformat(), "answered_calls": rng.randint(0, 90), "unanswered_calls": 3,
+                "total_call_time_minutes": 120, "demos": []}
+        return "POST", "/calls/", {"json": body, "headers": auth(uid)}
+
+    def payment(rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+        uid = rng.choice(employees)
+        mobile = rng.choice(data.mobiles)
+        body = {"date": data.end.isoformat(), "customer_name": "Bench", "mobile": mobile, "customer_type": "repeat",
+                "service": "RCS", "product_type": "RCS", "amount_paid": 1000 + next(counter),
+                "customer_card_link": f"https://crm.example.com/{mobile}"}
+        return "POST", "/payments/", {"json": body, "headers": auth(uid)}
+
+    return {
+        "me": lambda rng: ("GET", "/users/me", {"headers": auth(rng.choice(employees))}),
+        "upsert_call": call_entry,
+        "list_calls": lambda rng: ("GET", f"/calls/?{months}&limit=50", {"headers": auth(rng.choice(data.managers))}),
+        "create_payment": payment,
+        "list_payments": lambda rng: (
+            "GET", f"/payments/?{months}&limit=50", {"headers": auth(rng.choice(data.managers))}
+        ),
+        "list_incentives": lambda rng: ("GET", "/incentives/?limit=50", {"headers": auth(rng.choice(employees))}),
+        "overview": lambda rng: ("GET", f"/analytics/overview?{months}", {"headers": auth(rng.choice(data.managers))}),
+        "overview_admin": lambda rng: ("GET", f"/analytics/overview?{months}", {"headers": auth(data.admin)}),
+        "top_customers": lambda rng: (
+            "GET", f"/analytics/top-customers?{months}&limit=10", {"headers": auth(data.admin)}
+        ),
+        "whatsapp_due": lambda rng: (
+            "GET", "/whatsapp/due?window=week&include_overdue=true", {"headers": auth(rng.choice(data.managers))}
+        ),
+        "export_payments": lambda rng: (
+            "GET", f"/payments/export?{months}&format=ndjson", {"headers": auth(rng.choice(employees))}
+        ),
+    }
+
+
+async def _run_scenario(
+    client: httpx.AsyncClient, db: InMemoryFirestore, factory: RequestFactory, requests: int, concurrency: int
+) -> Dict[str, Any]:
+    rng = random.Random(1)
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        nonlocal errors
+        method, url, kwargs = factory(rng)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors += 1
+
+    db.reset_stats()
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "p50": cuts[49] * 1000,
+        "p95": cuts[94] * 1000,
+        "p99": cuts[98] * 1000,
+        "rps": requests / elapsed,
+        "round_trips": db.stats["round_trips"] / requests,
+        "errors": errors,
+    }
+
+
+async def _main(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    # Rate limits would reject most of a single-user load test.
+    app = create_app(firestore_client=db, token_verifier=FakeTokenVerifier(), admission_control=False)
+    started = time.perf_counter()
+    data = await seed(args.managers, args.employees, args.days)
+    print(f"seeded {len(data.employees)} employees x {args.days} days in {time.perf_counter() - started:.1f}s")
+    db.latency = args.latency_ms / 1000
+
+    scenarios = _scenarios(data)
+    selected = args.only or list(scenarios)
+    transport = httpx.ASGITransport(app=app)
+    print(f"{'endpoint':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'rt/req':>7} {'errors':>6}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in selected:
+            result = await _run_scenario(client, db, scenarios[name], args.requests, args.concurrency)
+            print(
+                f"{name:<16} {result['p50']:>8.2f} {result['p95']:>8.2f} {result['p99']:>8.2f} "
+                f"{result['rps']:>8.1f} {result['round_trips']:>7.1f} {result['errors']:>6}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated Firestore round trip")
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--only", action="append", help="Run only this scenario (repeatable)")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Throughput and memory of the streaming CSV import.
+
+Generates a payments CSV of each requested size on the fly and streams it
+through `app.jobs.import_csv` into an `InMemoryFirestore` with a simulated
+round trip latency.  Reports rows per second, Firestore round trips, and the import's
+transient memory: the peak traced allocation minus what is still allocated
+afterwards (mostly the stored documents).  With a streaming import the
+transient memory stays roughly the same however many rows the file has.
+
+Usage::
+
+    python -m benchmarks.bench_import --rows 5000 --rows 20000 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import io
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import AsyncIterator
+
+from app.fakes import InMemoryFirestore
+from app.firestore import use_firestore_client
+from app.jobs import import_csv
+
+from .seed import SERVICES, seed
+
+
+COLUMNS = [
+    "uid",
+    "date",
+    "customer_name",
+    "mobile",
+    "customer_type",
+    "service",
+    "product_type",
+    "amount_paid",
+    "customer_card_link",
+]
+
+
+async def _csv_blocks(rows: int, employees: int, rng_seed: int, rows_per_block: int = 500) -> AsyncIterator[bytes]:
+    rng = random.Random(rng_seed)
+    services = list(SERVICES)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for n in range(rows):
+        service = rng.choice(services)
+        mobile = f"9{rng.randrange(50_000):09d}"
+        writer.writerow(
+            [
+                f"emp{rng.randrange(employees):03d}",
+                (date(2023, 1, 1) + timedelta(days=rng.randrange(365))).isoformat(),
+                f"Customer {mobile[-4:]}",
+                mobile,
+                rng.choice(["new", "repeat"]),
+                service,
+                service,
+                round(rng.uniform(500, 50_000), 2),
+                f"https://crm.example.com/{mobile}",
+            ]
+        )
+        if (n + 1) % rows_per_block == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+async def _run(args: argparse.Namespace, rows: int) -> None:
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    await seed(2, args.employees, 1, payments_per_day=0, whatsapp_customers=0)
+    db.latency = args.latency_ms / 1000
+    db.reset_stats()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    job_id = await import_csv.start_job("payments")
+    job = await import_csv.run_job(job_id, import_csv.iter_csv_records(_csv_blocks(rows, args.employees, args.seed)))
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{rows:>8} {job['written']:>8} {rows / elapsed:>9.0f} {db.stats['round_trips']:>12} "
+        f"{(peak - current) / 2**20:>14.1f} {current / 2**20:>9.1f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, action="append", help="Rows per file (repeatable)")
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    print(f"{'rows':>8} {'written':>8} {'rows/s':>9} {'round trips':>12} {'transient MiB':>14} {'kept MiB':>9}")
+    for rows in args.rows or [5_000, 20_000]:
+        asyncio.run(_run(args, rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Payment write latency: the previous transactional path against the write plan.
+
+Seeds an `InMemoryFirestore`, then creates, updates and deletes payments
+through `app.services.payments` and through a copy of the implementation it
+replaced, in which the router first read the payment to check its scope and
+updates and deletions then ran in a Firestore transaction (begin, two reads,
+commit) with separate revert and apply writes for every aggregate.  Each
+Firestore round trip is delayed by `--latency-ms`; latency, round trips and
+document writes per operation are reported for both.
+
+Usage::
+
+    python -m benchmarks.bench_payment_writes --ops 200 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List
+
+from google.cloud import firestore
+
+from app.fakes import InMemoryFirestore
+from app.firestore import get_async_firestore_client, use_firestore_client
+from app.models import Payment
+from app.services import customer_revenue, rollups
+from app.services import payments as payment_service
+from app.services.incentives import INCENTIVES_COLLECTION, build_incentive_doc
+from app.services.master_data import get_master_data
+from app.services.payments import PAYMENTS_COLLECTION, payment_to_doc
+
+from .seed import seed
+
+
+# --- The implementation replaced by the write plan -------------------------
+
+
+async def _legacy_create(uid: str, team_uid: str, payment: Payment) -> str:
+    base_percent, global_percent = (await get_master_data()).percentages(payment.service)
+    db = get_async_firestore_client()
+    payment_ref = db.collection(PAYMENTS_COLLECTION).document()
+    data = payment_to_doc(uid, team_uid, payment)
+    data["created_at"] = firestore.SERVER_TIMESTAMP
+    incentive = build_incentive_doc(payment_ref.id, uid, payment, base_percent, global_percent)
+    batch = db.batch()
+    batch.set(payment_ref, data)
+    batch.set(db.collection(INCENTIVES_COLLECTION).document(payment_ref.id), incentive)
+    rollups.write_payment_delta(batch, db, data, incentive["incentive_amount"], 1)
+    customer_revenue.write_payment_delta(batch, db, data, 1)
+    await batch.commit()
+    return payment_ref.id
+
+
+async def _legacy_read(transaction: Any, payment_ref: Any, incentive_ref: Any) -> tuple:
+    payment_snap = await payment_ref.get(transaction=transaction)
+    if not payment_snap.exists:
+        raise KeyError(payment_ref.id)
+    incentive_snap = await incentive_ref.get(transaction=transaction)
+    return payment_snap.to_dict(), (incentive_snap.to_dict() if incentive_snap.exists else {})
+
+
+async def _legacy_update(payment_id: str, payment: Payment) -> None:
+    await payment_service.get_payment(payment_id)  # the router's scope check
+    base_percent, global_percent = (await get_master_data()).percentages(payment.service)
+    db = get_async_firestore_client()
+    payment_ref = db.collection(PAYMENTS_COLLECTION).document(payment_id)
+    incentive_ref = db.collection(INCENTIVES_COLLECTION).document(payment_id)
+
+    @firestore.async_transactional
+    async def apply(transaction: Any) -> None:
+        old_payment, old_incentive = await _legacy_read(transaction, payment_ref, incentive_ref)
+        uid = old_payment["uid"]
+        data = payment_to_doc(uid, old_payment.get("team_uid"), payment)
+        data["created_at"] = old_payment.get("created_at")
+        incentive = build_incentive_doc(payment_id, uid, payment, base_percent, global_percent)
+        transaction.set(payment_ref, data)
+        transaction.set(incentive_ref, incentive)
+        rollups.write_payment_delta(transaction, db, old_payment, old_incentive.get("incentive_amount", 0.0), -1)
+        rollups.write_payment_delta(transaction, db, data, incentive["incentive_amount"], 1)
+        customer_revenue.write_payment_delta(transaction, db, old_payment, -1)
+        customer_revenue.write_payment_delta(transaction, db, data, 1)
+
+    await apply(db.transaction())
+
+
+async def _legacy_delete(payment_id: str) -> None:
+    await payment_service.get_payment(payment_id)  # the router's scope check
+    db = get_async_firestore_client()
+    payment_ref = db.collection(PAYMENTS_COLLECTION).document(payment_id)
+    incentive_ref = db.collection(INCENTIVES_COLLECTION).document(payment_id)
+
+    @firestore.async_transactional
+    async def apply(transaction: Any) -> None:
+        old_payment, old_incentive = await _legacy_read(transaction, payment_ref, incentive_ref)
+        transaction.delete(payment_ref)
+        transaction.delete(incentive_ref)
+        rollups.write_payment_delta(transaction, db, old_payment, old_incentive.get("incentive_amount", 0.0), -1)
+        customer_revenue.write_payment_delta(transaction, db, old_payment, -1)
+
+    await apply(db.transaction())
+
+
+# --- Measurement ------------------------------------------------------------
+
+
+async def _measure(
+    db: InMemoryFirestore, operations: List[Callable[[], Awaitable[Any]]], concurrency: int
+) -> Dict[str, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(operation: Callable[[], Awaitable[Any]]) -> Any:
+        async with semaphore:
+            started = time.perf_counter()
+            result = await operation()
+            latencies.append(time.perf_counter() - started)
+            return result
+
+    db.reset_stats()
+    results = await asyncio.gather(*(one(operation) for operation in operations))
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "results": results,
+        "p50": cuts[49] * 1000,
+        "p95": cuts[94] * 1000,
+        "round_trips": db.stats["round_trips"] / len(operations),
+        "writes": db.stats["writes"] / len(operations),
+    }
+
+
+async def _main(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    data = await seed(args.managers, args.employees, args.days)
+    await get_master_data(max_age=0)
+    db.latency = args.latency_ms / 1000
+    rng = random.Random(1)
+
+    def payment(amount: float) -> Payment:
+        mobile = rng.choice(data.mobiles)
+        return Payment(
+            date=date.fromordinal(data.end.toordinal() - rng.randrange(args.days)), customer_name="Bench",
+            mobile=mobile, customer_type="repeat", service="RCS", product_type="RCS", amount_paid=amount,
+            customer_card_link=f"https://crm.example.com/{mobile}",
+        )
+
+    variants = {
+        "before": (
+            lambda uid, p, i: _legacy_create(uid, data.employees[uid], p),
+            lambda payment_id, p, i: _legacy_update(payment_id, p),
+            lambda payment_id, i: _legacy_delete(payment_id),
+        ),
+        "after": (
+            lambda uid, p, i: payment_service.create_payment(uid, data.employees[uid], p, f"{uid}:create-{i}"),
+            lambda payment_id, p, i: payment_service.update_payment(payment_id, p, None, f"bench:update-{i}"),
+            lambda payment_id, i: payment_service.delete_payment(payment_id, None, f"bench:delete-{i}"),
+        ),
+    }
+
+    print(f"{'variant':<8} {'operation':<8} {'p50 ms':>8} {'p95 ms':>8} {'rt/op':>6} {'writes/op':>10}")
+    for variant, (create, update, delete) in variants.items():
+        uids = [rng.choice(list(data.employees)) for _ in range(args.ops)]
+        created = await _measure(
+            db, [lambda i=i: create(uids[i], payment(1000 + i), i) for i in range(args.ops)], args.concurrency
+        )
+        ids = created["results"]
+        updated = await _measure(
+            db, [lambda i=i: update(ids[i], payment(2000 + i), i) for i in range(args.ops)], args.concurrency
+        )
+        deleted = await _measure(db, [lambda i=i: delete(ids[i], i) for i in range(args.ops)], args.concurrency)
+        for name, result in (("create", created), ("update", updated), ("delete", deleted)):
+            print(
+                f"{variant:<8} {name:<8} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+                f"{result['round_trips']:>6.1f} {result['writes']:>10.1f}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=200, help="Payments created, updated and deleted per variant")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    parser.add_argument("--managers", type=int, default=2)
+    parser.add_argument("--employees", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Cold-start time: import, warm-up and first authenticated response.
+
+Each run starts a fresh interpreter, imports `app.main`, runs the lifespan
+startup (warm-up) and then sends one authenticated `GET /users/me` through an
+ASGI transport, timing each phase.  Runs are repeated with warm-up disabled
+(`WARMUP_ON_STARTUP=0`) to show what the first request costs without it.
+
+By default the in-memory backend and fake token verifier are used, which
+isolates import and app construction cost.  Pass `--real --token <ID token>`
+with credentials configured to measure against Firebase and Firestore.
+
+Usage::
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --real --token "$ID_TOKEN"
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+
+_CHILD = r"""
+import asyncio, json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+import httpx
+
+async def run():
+    application = app.main.app
+    async with application.router.lifespan_context(application):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/users/me", headers={"Authorization": "Bearer " + sys.argv[1]})
+        done = time.perf_counter()
+    heavy = [name for name in ("numpy", "firebase_admin") if name in sys.modules]
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "warmup_ms": (ready - imported) * 1000,
+        "first_request_ms": (done - ready) * 1000,
+        "total_ms": (done - started) * 1000,
+        "status": response.status_code,
+        "loaded": heavy,
+    }))
+
+asyncio.run(run())
+"""
+
+
+def _run_child(token: str, env: Dict[str, str]) -> Dict[str, float]:
+    result = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", _CHILD, token],
+        cwd=Path(__file__).resolve().parent.parent,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--real", action="store_true", help="Use the configured Firebase/Firestore backends")
+    parser.add_argument("--token", default="admin:ADMIN", help="Bearer token for the first request")
+    args = parser.parse_args()
+
+    base_env = dict(os.environ)
+    if not args.real:
+        base_env.update(DATA_BACKEND="memory", AUTH_BACKEND="fake")
+
+    print(f"{'mode':<12} {'import ms':>10} {'warm-up ms':>11} {'first req ms':>13} {'total ms':>9}  status  loaded")
+    for mode, warm in (("warm-up", "1"), ("no warm-up", "0")):
+        runs: List[Dict[str, float]] = [
+            _run_child(args.token, {**base_env, "WARMUP_ON_STARTUP": warm}) for _ in range(args.runs)
+        ]
+        median = {key: statistics.median(run[key] for run in runs) for key in
+                  ("import_ms", "warmup_ms", "first_request_ms", "total_ms")}
+        print(
+            f"{mode:<12} {median['import_ms']:>10.1f} {median['warmup_ms']:>11.1f} "
+            f"{median['first_request_ms']:>13.1f} {median['total_ms']:>9.1f}  {runs[-1]['status']:>6}  "
+            f"{','.join(runs[-1]['loaded']) or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Monthly statements: one employee at a time vs. the batch job.
+
+Seeds an `InMemoryFirestore` and produces every employee's incentive
+statement for the last month:
+
+* **per employee**: what building the statements from the list endpoints
+  costs: page through each employee's payments and incentives
+  (`list_payments`, `list_incentives`) and render in process;
+* **batch**: `app.jobs.generate_statements` with `--force`, on one process
+  and on `--workers` processes;
+* **rerun**: the batch job again after `--changes` payment updates, which
+  only re-renders the affected statements;
+* **download**: reading one stored statement.
+
+Usage::
+
+    python -m benchmarks.bench_statements --employees 200 --days 31 --workers 4 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from app import statements as rendering
+from app.fakes import InMemoryFirestore
+from app.firestore import use_firestore_client
+from app.jobs.generate_statements import generate_statements
+from app.models import Payment
+from app.pagination import MAX_PAGE_SIZE
+from app.services import incentives as incentive_service
+from app.services import payments as payment_service
+from app.services import statements
+
+from .seed import seed
+
+
+END = date(2024, 12, 31)
+MONTH = END.isoformat()[:7]
+
+
+async def _per_employee(uids: List[str]) -> int:
+    from_date, to_date = statements.month_range(MONTH)
+    names = await statements.employee_names(uids)
+    for uid in uids:
+        payments: List[Dict[str, Any]] = []
+        incentives: Dict[str, Dict[str, Any]] = {}
+        cursor = None
+        while True:
+            page, cursor = await payment_service.list_payments([uid], from_date, to_date, None, None, cursor, MAX_PAGE_SIZE)
+            payments += page
+            if not cursor:
+                break
+        while True:
+            page, cursor = await incentive_service.list_incentives([uid], from_date, to_date, cursor, MAX_PAGE_SIZE)
+            incentives.update((incentive["id"], incentive) for incentive in page)
+            if not cursor:
+                break
+        records = {"payments": payments, "incentives": incentives}
+        rendering.render_statement(statements.statement_input(uid, names.get(uid), MONTH, records))
+    return len(uids)
+
+
+async def _timed(db: InMemoryFirestore, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, Dict[str, int], float]:
+    db.reset_stats()
+    started = time.perf_counter()
+    result = await call()
+    return result, db.stats.copy(), (time.perf_counter() - started) * 1000
+
+
+async def _run(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    data = await seed(args.managers, args.employees, args.days, args.payments_per_day, whatsapp_customers=0, end=END)
+    db.latency = args.latency_ms / 1000
+    uids = sorted(data.employees)
+
+    runs = [
+        ("per employee", lambda: _per_employee(uids)),
+        ("batch, 1 process", lambda: generate_statements(MONTH, force=True, workers=1)),
+        (f"batch, {args.workers} processes", lambda: generate_statements(MONTH, force=True, workers=args.workers)),
+    ]
+    print(f"{'run':<22} {'rendered':>9} {'ms':>9} {'reads':>8} {'trips':>6}")
+    for name, call in runs:
+        result, stats, ms = await _timed(db, call)
+        rendered = result if isinstance(result, int) else result["rendered"]
+        print(f"{name:<22} {rendered:>9} {ms:>9.1f} {stats['reads']:>8,} {stats['round_trips']:>6}")
+
+    for payment_id in data.payment_ids[-args.changes :]:
+        stored = await payment_service.get_payment(payment_id)
+        fields = {key: stored[key] for key in Payment.__fields__ if key in stored}
+        await payment_service.update_payment(payment_id, Payment(**{**fields, "amount_paid": 1234.5}))
+    result, stats, ms = await _timed(db, lambda: generate_statements(MONTH, workers=args.workers))
+    rerun = f"rerun, {args.changes} changes"
+    print(f"{rerun:<22} {result['rendered']:>9} {ms:>9.1f} {stats['reads']:>8,} {stats['round_trips']:>6}")
+    _, stats, ms = await _timed(db, lambda: statements.get_statement(uids[0], MONTH))
+    print(f"{'download':<22} {0:>9} {ms:>9.1f} {stats['reads']:>8,} {stats['round_trips']:>6}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--managers", type=int, default=10)
+    parser.add_argument("--employees", type=int, default=200)
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--payments-per-day", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes for the batch job")
+    parser.add_argument("--changes", type=int, default=5, help="Payments updated before the rerun")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Top customers by revenue: monthly index vs. scan-and-sort.
+
+Generates synthetic payments spread over a year for a heavy-tailed customer
+base, then answers top-customer queries two ways, both for random date
+ranges and for the endpoint's default range (the last 30 days, which is
+mostly partial months):
+
+* **scan**: filter every payment by date, sum per mobile and sort, which is
+  what serving `/analytics/top-customers` from the payments collection costs;
+* **index**: merge the pre-sorted monthly revenue buckets with the threshold
+  algorithm from `app.ranking`, adding up the daily buckets for the partial
+  months at the edges of the range, as `app.services.customer_revenue` does.
+
+Usage::
+
+    python -m benchmarks.bench_top_customers --payments 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+from app.ranking import sort_bucket, split_range, top_k_merge
+
+
+START = date(2024, 1, 1)
+DAYS = 366
+# Range of a top-customers request without `from` (`app.routers.analytics`).
+DEFAULT_RANGE_DAYS = 30
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=1_000_000)
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def _generate(args: argparse.Namespace) -> List[Tuple[str, str, float]]:
+    rng = random.Random(args.seed)
+    payments = []
+    for _ in range(args.payments):
+        customer = int(rng.paretovariate(1.2)) % args.customers
+        day = START + timedelta(days=rng.randrange(DAYS))
+        payments.append((day.isoformat(), f"+91{9000000000 + customer}", round(rng.uniform(500, 50_000), 2)))
+    payments.sort()
+    return payments
+
+
+def _scan(payments, from_day: str, to_day: str, limit: int) -> List[Tuple[str, float]]:
+    totals: Dict[str, float] = defaultdict(float)
+    for day, mobile, amount in payments:
+        if from_day <= day <= to_day:
+            totals[mobile] += amount
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+
+
+def _build_index(payments) -> Tuple[Dict[str, tuple], Dict[str, Dict[str, float]]]:
+    months: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    days: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for day, mobile, amount in payments:
+        months[day[:7]][mobile] += amount
+        days[day][mobile] += amount
+    return {month: (dict(bucket), sort_bucket(bucket)) for month, bucket in months.items()}, days
+
+
+def _indexed(months_index, days_index, from_date: date, to_date: date, limit: int) -> List[Tuple[str, float]]:
+    months, partial = split_range(from_date, to_date)
+    buckets = [months_index[m] for m in months if m in months_index]
+    for start, end in partial:
+        edge: Dict[str, float] = defaultdict(float)
+        for offset in range((end - start).days + 1):
+            for mobile, amount in days_index.get((start + timedelta(days=offset)).isoformat(), {}).items():
+                edge[mobile] += amount
+        buckets.append((dict(edge), sort_bucket(edge)))
+    return top_k_merge(buckets, limit)
+
+
+def _compare(payments, index, ranges: List[Tuple[date, date]], limit: int) -> Tuple[float, float]:
+    """Return the mean scan and index times in ms per query over `ranges`, checking the results match."""
+    scan_time = index_time = 0.0
+    for from_date, to_date in ranges:
+        t0 = time.perf_counter()
+        expected = _scan(payments, from_date.isoformat(), to_date.isoformat(), limit)
+        scan_time += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        actual = _indexed(*index, from_date, to_date, limit)
+        index_time += time.perf_counter() - t0
+        assert [round(v, 2) for _, v in actual] == [round(v, 2) for _, v in expected], "index result mismatch"
+    return scan_time / len(ranges) * 1000, index_time / len(ranges) * 1000
+
+
+def main() -> None:
+    args = _parse_args()
+    t0 = time.perf_counter()
+    payments = _generate(args)
+    print(f"generated {len(payments):,} payments in {time.perf_counter() - t0:.1f}s")
+    t0 = time.perf_counter()
+    index = _build_index(payments)
+    print(f"built index ({len(index[0])} monthly, {len(index[1])} daily buckets) in {time.perf_counter() - t0:.1f}s")
+
+    rng = random.Random(args.seed + 1)
+    random_ranges = []
+    for _ in range(args.queries):
+        a, b = sorted(rng.sample(range(DAYS), 2))
+        random_ranges.append((START + timedelta(days=a), START + timedelta(days=b)))
+    default_ranges = []
+    for _ in range(args.queries):
+        end = START + timedelta(days=rng.randrange(DEFAULT_RANGE_DAYS - 1, DAYS))
+        default_ranges.append((end - timedelta(days=DEFAULT_RANGE_DAYS - 1), end))
+
+    for name, ranges in (("random ranges", random_ranges), (f"last {DEFAULT_RANGE_DAYS} days", default_ranges)):
+        scan_ms, index_ms = _compare(payments, index, ranges, args.limit)
+        print(f"{name}:")
+        print(f"  scan-and-sort: {scan_ms:8.1f} ms/query")
+        print(f"          index: {index_ms:8.1f} ms/query")
+        print(f"        speedup: {scan_ms / index_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Trend bucketing: NumPy vs. dictionary loops, and the cost of `/analytics/trends`.
+
+Two parts:
+
+* **bucketing**: generates a year of synthetic payments and buckets them by
+  day, week and month, split by service and customer type, once with
+  per-payment dictionary updates followed by a gap-filling pass and once with
+  `app.services.trends.bucket_series`.  Both results are checked to match.
+* **service**: seeds an `InMemoryFirestore` with a year of data and answers
+  the organisation-wide trends from the daily rollups, cold and memoized,
+  next to the cost of fetching and bucketing the raw payments instead.
+
+Usage::
+
+    python -m benchmarks.bench_trends --payments 500000 --employees 10 --latency-ms 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from app.fakes import InMemoryFirestore
+from app.firestore import use_firestore_client
+from app.services import payments as payment_service
+from app.services import rollups, trends
+
+from .seed import SERVICES, seed
+
+
+START = date(2024, 1, 1)
+END = date(2024, 12, 31)
+CUSTOMER_TYPES = ["new", "repeat"]
+
+Payments = List[Tuple[date, str, str, float]]
+
+
+def _generate(count: int, rng_seed: int) -> Payments:
+    rng = random.Random(rng_seed)
+    days = (END - START).days + 1
+    services = list(SERVICES)
+    return [
+        (
+            START + timedelta(days=rng.randrange(days)),
+            rng.choice(services),
+            rng.choice(CUSTOMER_TYPES),
+            round(rng.uniform(500, 50_000), 2),
+        )
+        for _ in range(count)
+    ]
+
+
+def _bucket_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _dict_loop(payments: Payments, granularity: str) -> Dict[str, Any]:
+    totals: Dict[Tuple[str, str], Dict[date, List[float]]] = defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+    for day, service, customer_type, amount in payments:
+        key = _bucket_start(day, granularity)
+        for category in (("", trends.TOTAL), ("services", service), ("customer_types", customer_type)):
+            cell = totals[category][key]
+            cell[0] += 1
+            cell[1] += amount
+    buckets = sorted({_bucket_start(START + timedelta(days=n), granularity) for n in range((END - START).days + 1)})
+    result: Dict[str, Any] = {"buckets": [b.isoformat() for b in buckets], "services": {}, "customer_types": {}}
+    for (group, name), cells in sorted(totals.items()):
+        empty = [0, 0.0]
+        values = {
+            "count": [cells.get(b, empty)[0] for b in buckets],
+            "amount": [round(cells.get(b, empty)[1], 2) for b in buckets],
+        }
+        if group:
+            result[group][name] = values
+        else:
+            result[name] = values
+    return result
+
+
+def _vectorised(arrays: Dict[str, Any], granularity: str) -> Dict[str, Any]:
+    starts, day_to_bucket = trends.bucket_days(START, END, granularity)
+    services, types = arrays["services"], arrays["customer_types"]
+    n = len(arrays["day"])
+    categories = np.concatenate(
+        [np.zeros(n, dtype=np.int64), 1 + arrays["service"], 1 + len(services) + arrays["customer_type"]]
+    )
+    counts, amounts = trends.bucket_series(
+        np.tile(arrays["day"], 3),
+        categories,
+        np.ones(3 * n),
+        np.tile(arrays["amount"], 3),
+        1 + len(services) + len(types),
+        day_to_bucket,
+        len(starts),
+    )
+    counts = counts.astype(np.int64).tolist()
+    amounts = np.round(amounts, 2).tolist()
+    names = [("", trends.TOTAL)] + [("services", s) for s in services] + [("customer_types", t) for t in types]
+    result: Dict[str, Any] = {"buckets": starts, "services": {}, "customer_types": {}}
+    for row, (group, name) in enumerate(names):
+        values = {"count": counts[row], "amount": amounts[row]}
+        if group:
+            result[group][name] = values
+        else:
+            result[name] = values
+    return result
+
+
+def _to_arrays(payments: Payments) -> Dict[str, Any]:
+    services = sorted({p[1] for p in payments})
+    types = sorted({p[2] for p in payments})
+    service_index = {name: i for i, name in enumerate(services)}
+    type_index = {name: i for i, name in enumerate(types)}
+    origin = START.toordinal()
+    n = len(payments)
+    return {
+        "day": np.fromiter((p[0].toordinal() - origin for p in payments), dtype=np.int64, count=n),
+        "service": np.fromiter((service_index[p[1]] for p in payments), dtype=np.int64, count=n),
+        "customer_type": np.fromiter((type_index[p[2]] for p in payments), dtype=np.int64, count=n),
+        "amount": np.fromiter((p[3] for p in payments), dtype=float, count=n),
+        "services": services,
+        "customer_types": types,
+    }
+
+
+def _same(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    def series(result: Dict[str, Any]) -> Dict[Tuple[str, str], Any]:
+        flat = {("", trends.TOTAL): result[trends.TOTAL]}
+        for group in ("services", "customer_types"):
+            flat.update({(group, name): values for name, values in result[group].items()})
+        return flat
+
+    left, right = series(a), series(b)
+    return (
+        a["buckets"] == b["buckets"]
+        and left.keys() == right.keys()
+        and all(left[k]["count"] == right[k]["count"] for k in left)
+        and all(np.allclose(left[k]["amount"], right[k]["amount"], atol=0.011) for k in left)
+    )
+
+
+def _bucketing(args: argparse.Namespace) -> None:
+    payments = _generate(args.payments, args.seed)
+    print(f"bucketing {len(payments):,} payments over {START}..{END}")
+    # Converting the fetched records to arrays is paid once per query, whatever the granularity.
+    started = time.perf_counter()
+    arrays = _to_arrays(payments)
+    convert_ms = (time.perf_counter() - started) * 1000
+    print(f"converting to arrays: {convert_ms:.1f} ms")
+    print(f"{'granularity':<12} {'buckets':>8} {'dict loop ms':>13} {'numpy ms':>9} {'+convert':>9} {'match':>6}")
+    for granularity in trends.GRANULARITIES:
+        started = time.perf_counter()
+        expected = _dict_loop(payments, granularity)
+        loop_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        actual = _vectorised(arrays, granularity)
+        numpy_ms = (time.perf_counter() - started) * 1000
+        print(
+            f"{granularity:<12} {len(actual['buckets']):>8} {loop_ms:>13.1f} {numpy_ms:>9.1f} "
+            f"{numpy_ms + convert_ms:>9.1f} {str(_same(expected, actual)):>6}"
+        )
+
+
+async def _service(args: argparse.Namespace) -> None:
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    days = (END - START).days + 1
+    started = time.perf_counter()
+    await seed(2, args.employees, days, args.payments_per_day, whatsapp_customers=0, end=END)
+    print(f"\nseeded {args.employees} employees x {days} days in {time.perf_counter() - started:.1f}s")
+    db.latency = args.latency_ms / 1000
+
+    print(f"{'granularity':<12} {'path':<10} {'reads':>7} {'round trips':>12} {'ms':>9} {'match':>6}")
+    for granularity in trends.GRANULARITIES:
+        trends._trends_cache.clear()
+        rows = []
+        for path in ("cold", "memoized"):
+            db.reset_stats()
+            started = time.perf_counter()
+            result = await trends.get_trends(rollups.ALL_SCOPE, START, END, granularity)
+            rows.append((path, db.stats.copy(), (time.perf_counter() - started) * 1000, result))
+
+        db.reset_stats()
+        started = time.perf_counter()
+        payments = [
+            (date.fromisoformat(p["date"]), p["service"], p["customer_type"], float(p["amount_paid"]))
+            async for p in payment_service.stream_payments(None, START, END)
+        ]
+        raw = _vectorised(_to_arrays(payments), granularity)
+        rows.append(("payments", db.stats.copy(), (time.perf_counter() - started) * 1000, raw))
+
+        for path, stats, elapsed, result in rows:
+            print(
+                f"{granularity:<12} {path:<10} {stats['reads']:>7} {stats['round_trips']:>12} "
+                f"{elapsed:>9.1f} {str(_same(raw, result)):>6}"
+            )
+    print(f"trends cache: {trends.get_trends_cache_stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=500_000, help="Synthetic payments for the bucketing part")
+    parser.add_argument("--employees", type=int, default=10)
+    parser.add_argument("--payments-per-day", type=float, default=1.0, help="Per employee, for the service part")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    _bucketing(args)
+    asyncio.run(_service(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Call entry upserts written through vs. written behind, under a call-center burst.
+
+Every employee saves their entry for today `--updates` times at random
+moments within `--burst-seconds`, as the dashboard does after each few calls.
+Each upsert also writes the team rollup and scope version and a shard of the
+organisation's, each shared by many employees, so in write-through mode those
+few documents take one write per upsert.  Firestore throttles sustained
+writes to a single document; the benchmark models that as a minimum gap of
+`--doc-gap-ms` between commits touching the same document, on top of
+`--latency-ms` per round trip.  In write-behind mode (`CALL_WRITE_BEHIND_MS`)
+upserts return once buffered and each flush writes every document once.
+
+Reports Firestore commits and writes, the most writes any one document took,
+and p50/p99 upsert latency.
+
+Usage::
+
+    python -m benchmarks.bench_write_behind --employees 40 --updates 5 --window-ms 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, List
+
+from app.fakes import InMemoryFirestore
+from app.fakes.firestore import WriteBatch
+from app.firestore import use_firestore_client
+from app.models import CallEntry
+from app.services import calls
+
+
+TODAY = date(2024, 6, 28)
+
+
+class _ThrottledBatch(WriteBatch):
+    """Batch whose commit waits until every document it touches may be written again."""
+
+    async def commit(self) -> List[Any]:
+        client = self._client
+        paths = {reference.path for _, reference, _, _ in self._writes}
+        while True:
+            now = time.perf_counter()
+            ready = max((client.next_write.get(path, 0.0) for path in paths), default=now)
+            if ready <= now:
+                break
+            await asyncio.sleep(ready - now)
+        for path in paths:
+            client.next_write[path] = now + client.doc_gap
+            client.doc_writes[path] += 1
+        return await super().commit()
+
+
+class _ThrottledFirestore(InMemoryFirestore):
+    def __init__(self, latency: float, doc_gap: float) -> None:
+        super().__init__(latency)
+        self.doc_gap = doc_gap
+        self.next_write: Dict[str, float] = {}
+        self.doc_writes: Counter = Counter()
+
+    def batch(self) -> WriteBatch:
+        return _ThrottledBatch(self)
+
+
+async def _burst(args: argparse.Namespace, window_ms: float) -> None:
+    db = _ThrottledFirestore(args.latency_ms / 1000, args.doc_gap_ms / 1000)
+    use_firestore_client(db)
+    calls.write_buffer = calls.CallWriteBuffer(window_ms=window_ms)
+    rng = random.Random(7)
+    employees = [(f"emp{index:03d}", f"mgr{index % args.managers:02d}") for index in range(args.employees)]
+    latencies: List[float] = []
+    expected: Dict[str, int] = {}
+
+    async def employee(uid: str, team_uid: str) -> None:
+        moments = sorted(rng.uniform(0, args.burst_seconds) for _ in range(args.updates))
+        started = time.perf_counter()
+        answered = 0
+        for moment in moments:
+            await asyncio.sleep(max(0.0, started + moment - time.perf_counter()))
+            answered += rng.randint(1, 4)
+            entry = CallEntry(
+                date=TODAY, answered_calls=answered, unanswered_calls=0, total_call_time_minutes=answered * 3
+            )
+            begun = time.perf_counter()
+            await calls.upsert_call_entry(uid, team_uid, entry)
+            latencies.append((time.perf_counter() - begun) * 1000)
+        expected[calls.call_doc_id(uid, TODAY)] = answered
+
+    started = time.perf_counter()
+    await asyncio.gather(*(employee(uid, team_uid) for uid, team_uid in employees))
+    await calls.write_buffer.close()
+    elapsed = time.perf_counter() - started
+
+    stored, _ = await calls.list_call_entries(None, TODAY, TODAY, limit=len(employees))
+    consistent = {entry["id"]: entry["answered_calls"] for entry in stored} == expected
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    mode = f"write-behind {window_ms:g} ms" if window_ms else "write-through"
+    print(
+        f"{mode:<22} {len(latencies):>8} {db.stats['round_trips']:>8} {db.stats['writes']:>7} "
+        f"{max(db.doc_writes.values()):>9} {statistics.median(latencies):>8.1f} {p99:>8.1f} {elapsed:>7.1f}s"
+        f"  {'ok' if consistent else 'MISMATCH'}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--updates", type=int, default=5, help="Upserts per employee")
+    parser.add_argument("--burst-seconds", type=float, default=2.0, help="Window the upserts arrive in")
+    parser.add_argument("--window-ms", type=float, default=500.0, help="Write-behind window")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    parser.add_argument("--doc-gap-ms", type=float, default=20.0, help="Minimum gap between writes to a document")
+    args = parser.parse_args()
+    print(
+        f"{'mode':<22} {'upserts':>8} {'commits':>8} {'writes':>7} {'hot doc':>9} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'total':>8}"
+    )
+    for window_ms in (0.0, args.window_ms):
+        asyncio.run(_burst(args, window_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Seed a Firestore client with a realistic, reproducible dataset.
+
+Everything is written through the service layer, so rollups, incentives and
+customer revenue buckets are consistent with the seeded records exactly as
+they would be in production.  Intended for `app.fakes.InMemoryFirestore`.
+
+Usage::
+
+    python -m benchmarks.seed --managers 4 --employees 40 --days 90
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+from app.firestore import get_async_firestore_client, use_firestore_client
+from app.models import CallEntry, Demo, Payment
+from app.services import calls, payments, whatsapp
+from app.services.master_data import CONFIG_COLLECTION, MASTER_CONFIG_DOC, invalidate_master_data
+from app.services.users import USERS_COLLECTION
+
+
+SERVICES = {"WhatsApp API": 8.0, "RCS": 10.0, "Bulk SMS": 5.0, "Voice Calls": 6.0, "Email": 4.0}
+GLOBAL_PERCENT = 50.0
+
+
+@dataclass
+class Dataset:
+    """UIDs and date range of a seeded dataset."""
+
+    admin: str
+    managers: List[str]
+    employees: Dict[str, str]  # employee UID -> manager UID
+    start: date
+    end: date
+    mobiles: List[str] = field(default_factory=list)
+    whatsapp_mobiles: List[str] = field(default_factory=list)
+    payment_ids: List[str] = field(default_factory=list)
+
+
+async def seed(
+    managers: int = 4,
+    employees: int = 40,
+    days: int = 90,
+    payments_per_day: float = 2.0,
+    customers: int = 2000,
+    whatsapp_customers: int = 500,
+    end: date = date(2024, 6, 30),
+    rng_seed: int = 7,
+) -> Dataset:
+    """Populate the current Firestore client and describe what was written."""
+    rng = random.Random(rng_seed)
+    db = get_async_firestore_client()
+    start = end - timedelta(days=days - 1)
+    manager_uids = [f"mgr{m:02d}" for m in range(managers)]
+    employee_managers = {f"emp{e:03d}": manager_uids[e % managers] for e in range(employees)}
+    dataset = Dataset("admin", manager_uids, employee_managers, start, end)
+    dataset.mobiles = [f"9{n:09d}" for n in range(customers)]
+
+    await db.collection(CONFIG_COLLECTION).document(MASTER_CONFIG_DOC).set(
+        {"services": {name: {"base_percent": pct} for name, pct in SERVICES.items()}, "global_percent": GLOBAL_PERCENT}
+    )
+    invalidate_master_data()
+    users = db.collection(USERS_COLLECTION)
+    await users.document(dataset.admin).set({"role": "ADMIN", "name": "Admin"})
+    for uid in manager_uids:
+        await users.document(uid).set({"role": "MANAGER", "name": uid.title()})
+    for uid, manager_uid in employee_managers.items():
+        await users.document(uid).set({"role": "EMPLOYEE", "name": uid.title(), "manager_uid": manager_uid})
+
+    items = []
+    for uid, manager_uid in employee_managers.items():
+        for offset in range(days):
+            answered = rng.randint(20, 80)
+            items.append(
+                (
+                    uid,
+                    manager_uid,
+                    CallEntry(
+                        date=start + timedelta(days=offset),
+                        answered_calls=answered,
+                        unanswered_calls=rng.randint(0, 30),
+                        total_call_time_minutes=answered * rng.randint(2, 6),
+                        demos=[
+                            Demo(demo_time_minutes=rng.randint(10, 45), demo_card_link=f"https://crm.example.com/{rng.choice(dataset.mobiles)}")
+                            for _ in range(rng.randint(0, 2))
+                        ],
+                    ),
+                )
+            )
+    await calls.bulk_upsert_call_entries(items)
+
+    services = list(SERVICES)
+    for uid, manager_uid in employee_managers.items():
+        for offset in range(days):
+            count = int(payments_per_day) + (rng.random() < payments_per_day % 1)
+            for _ in range(count):
+                mobile = rng.choice(dataset.mobiles)
+                service = rng.choice(services)
+                payment = Payment(
+                    date=start + timedelta(days=offset),
+                    customer_name=f"Customer {mobile[-4:]}",
+                    mobile=mobile,
+                    organization_name=f"Org {mobile[-3:]}",
+                    customer_type=rng.choice(["new", "repeat"]),
+                    service=service,
+                    product_type=service,
+                    amount_paid=round(rng.uniform(500, 50000), 2),
+                    customer_card_link=f"https://crm.example.com/{mobile}",
+                )
+                dataset.payment_ids.append(await payments.create_payment(uid, manager_uid, payment))
+
+    for n in range(whatsapp_customers):
+        mobile = f"8{n:09d}"
+        await whatsapp.upsert_customer(
+            {
+                "mobile": mobile,
+                "customer_name": f"WA Customer {n}",
+                "fixed_due_day": rng.randint(1, 31),
+                "service": "WhatsApp API",
+                "amount": round(rng.uniform(1000, 10000), 2),
+            },
+            today=end,
+        )
+        dataset.whatsapp_mobiles.append(mobile)
+    return dataset
+
+
+def main() -> None:
+    from app.fakes import InMemoryFirestore
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--managers", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--payments-per-day", type=float, default=2.0)
+    args = parser.parse_args()
+
+    db = InMemoryFirestore()
+    use_firestore_client(db)
+    started = time.perf_counter()
+    dataset = asyncio.run(seed(args.managers, args.employees, args.days, args.payments_per_day))
+    elapsed = time.perf_counter() - started
+    counts: Dict[str, Any] = {name: len(docs) for name, docs in sorted(db._collections.items())}
+    print(f"seeded {dataset.start}..{dataset.end} in {elapsed:.1f}s: {counts}")
+
+
+if __name__ == "__main__":
+    main()
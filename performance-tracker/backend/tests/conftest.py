@@ -0,0 +1,50 @@
+"""Shared fixtures: every test runs against a fresh `InMemoryFirestore`."""
+
+from __future__ import annotations
+
+from typing import Awaitable, Callable
+
+import pytest
+from fastapi import FastAPI
+
+from app import auth, conditional
+from app.fakes import FakeTokenVerifier, InMemoryFirestore
+from app.firestore import use_firestore_client
+from app.main import create_app
+from app.services import trends
+from app.services.master_data import CONFIG_COLLECTION, MASTER_CONFIG_DOC, invalidate_master_data
+from app.services.users import invalidate_team_membership
+
+
+@pytest.fixture
+def db():
+    client = InMemoryFirestore()
+    use_firestore_client(client)
+    invalidate_master_data()
+    yield client
+    use_firestore_client(None)
+    invalidate_master_data()
+
+
+@pytest.fixture
+def set_percents(db: InMemoryFirestore) -> Callable[[float, float], Awaitable[None]]:
+    """Return a coroutine function storing the master config with the `RCS` service at the given percentages."""
+
+    async def store(base_percent: float, global_percent: float) -> None:
+        await db.collection(CONFIG_COLLECTION).document(MASTER_CONFIG_DOC).set(
+            {"services": {"RCS": {"base_percent": base_percent}}, "global_percent": global_percent}
+        )
+        invalidate_master_data()
+
+    return store
+
+
+@pytest.fixture
+def app(db: InMemoryFirestore) -> FastAPI:
+    """Return the API over `db`, accepting `<uid>` bearer tokens, with every in-process cache empty."""
+    auth._token_cache.clear()
+    auth._profile_cache.clear()
+    invalidate_team_membership()
+    conditional._responses.clear()
+    trends._trends_cache.clear()
+    return create_app(db, FakeTokenVerifier(), admission_control=False)
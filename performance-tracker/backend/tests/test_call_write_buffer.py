@@ -0,0 +1,148 @@
+"""Write-behind buffering of call entry upserts."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Any, Optional
+
+import pytest
+
+from app.fakes import InMemoryFirestore
+from app.models import CallEntry
+from app.services import calls, rollups
+
+
+DAY = date(2024, 5, 10)
+NEXT_DAY = date(2024, 5, 11)
+
+
+def _entry(answered: int, day: date = DAY) -> CallEntry:
+    return CallEntry(date=day, answered_calls=answered, unanswered_calls=1, total_call_time_minutes=10)
+
+
+@pytest.fixture
+def buffer(db: InMemoryFirestore, monkeypatch: Any) -> calls.CallWriteBuffer:
+    """Install a write-behind buffer whose timer never fires during a test."""
+    write_buffer = calls.CallWriteBuffer(window_ms=60_000)
+    monkeypatch.setattr(calls, "write_buffer", write_buffer)
+    return write_buffer
+
+
+async def _stored(db: InMemoryFirestore, day: date = DAY) -> Optional[dict]:
+    snap = await db.collection(calls.CALLS_COLLECTION).document(calls.call_doc_id("e1", day)).get()
+    return snap.to_dict() if snap.exists else None
+
+
+def test_repeated_upserts_are_coalesced(db: InMemoryFirestore, buffer: calls.CallWriteBuffer) -> None:
+    async def scenario() -> None:
+        for answered in (3, 5, 8):
+            await calls.upsert_call_entry("e1", "m1", _entry(answered))
+        await calls.upsert_call_entry("e1", "m1", _entry(2, NEXT_DAY))
+        assert await _stored(db) is None
+
+        db.reset_stats()
+        assert await buffer.flush() == 2
+        assert db.stats["round_trips"] == 1
+        assert (await _stored(db))["answered_calls"] == 8
+        overview = await rollups.read_overview(rollups.employee_scope("e1"), DAY, DAY)
+        assert overview["total_answered"] == 8
+        assert buffer.stats()["pending"] == 0
+        assert (buffer.counters["buffered"], buffer.counters["coalesced"]) == (4, 2)
+        await buffer.close()
+
+    asyncio.run(scenario())
+
+
+def test_reads_include_buffered_entries(db: InMemoryFirestore, buffer: calls.CallWriteBuffer) -> None:
+    async def scenario() -> None:
+        await calls.upsert_call_entry("e1", "m1", _entry(3))
+        await buffer.flush()
+        await calls.upsert_call_entry("e1", "m1", _entry(7))
+        await calls.upsert_call_entry("e1", "m1", _entry(4, NEXT_DAY))
+        await calls.upsert_call_entry("e2", "m1", _entry(9))
+
+        entries, _ = await calls.list_call_entries(["e1"], DAY, NEXT_DAY)
+        assert [(entry["id"], entry["answered_calls"]) for entry in entries] == [
+            (calls.call_doc_id("e1", DAY), 7),
+            (calls.call_doc_id("e1", NEXT_DAY), 4),
+        ]
+        assert (await _stored(db))["answered_calls"] == 3
+        await buffer.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_is_retried(db: InMemoryFirestore, buffer: calls.CallWriteBuffer, monkeypatch: Any) -> None:
+    write_entries = calls._write_entries
+    failures = []
+
+    async def fail_once(items: Any) -> Any:
+        if not failures:
+            failures.append(len(items))
+            raise RuntimeError("unavailable")
+        return await write_entries(items)
+
+    monkeypatch.setattr(calls, "_write_entries", fail_once)
+
+    async def scenario() -> None:
+        await calls.upsert_call_entry("e1", "m1", _entry(3))
+        await calls.upsert_call_entry("e1", "m1", _entry(4, NEXT_DAY))
+        assert await buffer.flush() == 0
+        assert buffer.counters["failed"] == 2
+        assert buffer.stats()["pending"] == 2
+        # A newer entry buffered after the failure replaces the one being retried.
+        await calls.upsert_call_entry("e1", "m1", _entry(6))
+
+        assert await buffer.flush() == 2
+        assert (await _stored(db))["answered_calls"] == 6
+        assert (await _stored(db, NEXT_DAY))["answered_calls"] == 4
+        assert buffer.stats()["pending"] == 0
+        await buffer.close()
+
+    asyncio.run(scenario())
+
+
+def test_bulk_upsert_writes_through_the_buffer(db: InMemoryFirestore, buffer: calls.CallWriteBuffer) -> None:
+    async def scenario() -> None:
+        await calls.upsert_call_entry("e1", "m1", _entry(3))
+        await calls.upsert_call_entry("e1", "m1", _entry(4, NEXT_DAY))
+
+        assert await calls.bulk_upsert_call_entries([("e1", "m1", _entry(10))]) == [None]
+        assert (await _stored(db))["answered_calls"] == 10
+        # Only the entry the bulk upsert did not replace is left to write.
+        assert await buffer.flush() == 1
+        assert (await _stored(db))["answered_calls"] == 10
+        assert (await _stored(db, NEXT_DAY))["answered_calls"] == 4
+        await buffer.close()
+
+    asyncio.run(scenario())
+
+
+def test_close_writes_everything_buffered(db: InMemoryFirestore, buffer: calls.CallWriteBuffer) -> None:
+    async def scenario() -> None:
+        await calls.upsert_call_entry("e1", "m1", _entry(3))
+        await calls.upsert_call_entry("e1", "m1", _entry(4, NEXT_DAY))
+        assert buffer._timer is not None
+
+        await buffer.close()
+
+        assert buffer._timer is None
+        assert buffer.stats()["pending"] == 0
+        assert (await _stored(db))["answered_calls"] == 3
+        assert (await _stored(db, NEXT_DAY))["answered_calls"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_window_timer_flushes(db: InMemoryFirestore, monkeypatch: Any) -> None:
+    monkeypatch.setattr(calls, "write_buffer", calls.CallWriteBuffer(window_ms=10))
+
+    async def scenario() -> None:
+        await calls.upsert_call_entry("e1", "m1", _entry(3))
+        await asyncio.sleep(0.1)
+        assert (await _stored(db))["answered_calls"] == 3
+        assert calls.write_buffer.counters["flushes"] == 1
+        await calls.write_buffer.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,140 @@
+"""Top customers served from the sharded month and day revenue buckets."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+from app.fakes import InMemoryFirestore
+from app.models import Payment
+from app.services import customer_revenue, payments, rollups
+
+
+START = date(2024, 4, 20)
+DAYS = 60
+EMPLOYEES = [("e1", "m1"), ("e2", "m1"), ("e3", "m2")]
+
+
+def _payment(day: date, mobile: str, amount: float) -> Payment:
+    return Payment(
+        date=day,
+        customer_name=f"Customer {mobile}",
+        mobile=mobile,
+        customer_type="repeat",
+        service="RCS",
+        product_type="RCS",
+        amount_paid=amount,
+        customer_card_link=f"https://crm.example.com/cards/{mobile}",
+    )
+
+
+async def _seed() -> List[Tuple[str, str, date, str, float]]:
+    """Create a payment per employee per day and return `(payment_id, uid, day, mobile, amount)` rows."""
+    created = []
+    for offset in range(DAYS):
+        day = START + timedelta(days=offset)
+        for index, (uid, team_uid) in enumerate(EMPLOYEES):
+            mobile = f"91980000{(offset * 7 + index) % 23:04d}"
+            amount = float(100 + (offset * 37 + index * 11) % 400)
+            payment_id = await payments.create_payment(uid, team_uid, _payment(day, mobile, amount))
+            created.append((payment_id, uid, day, mobile, amount))
+    return created
+
+
+def _expected(rows, uids, from_date: date, to_date: date, limit: int) -> List[Tuple[str, float]]:
+    totals: Dict[str, float] = defaultdict(float)
+    for _, uid, day, mobile, amount in rows:
+        if uid in uids and from_date <= day <= to_date:
+            totals[mobile] += amount
+    ranked = sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+    return [(mobile, round(total, 2)) for mobile, total in ranked]
+
+
+def _ranked(customers: List[Dict[str, Any]]) -> List[Tuple[str, float]]:
+    return sorted(((c["mobile"], c["revenue"]) for c in customers), key=lambda kv: (-kv[1], kv[0]))
+
+
+def test_team_buckets_are_sharded_by_mobile(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 0.0)
+        await _seed()
+        team_shards = set()
+        for collection in (customer_revenue.MONTH_BUCKETS_COLLECTION, customer_revenue.DAY_BUCKETS_COLLECTION):
+            async for snap in db.collection(collection).stream():
+                data = snap.to_dict()
+                shard = int(snap.id.rsplit("_", 1)[1])
+                assert {customer_revenue.bucket_shard(data["scope"], mobile) for mobile in data["customers"]} == {shard}
+                if data["scope"] == rollups.team_scope("m1"):
+                    team_shards.add(shard)
+        assert len(team_shards) > 1
+        assert customer_revenue.bucket_shards(rollups.employee_scope("e1")) == 1
+
+    asyncio.run(scenario())
+
+
+def test_default_range_reads_no_payments(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 0.0)
+        rows = await _seed()
+        to_date = date(2024, 6, 10)
+        from_date = to_date - timedelta(days=29)
+        for scope, uids in [
+            (rollups.ALL_SCOPE, {"e1", "e2", "e3"}),
+            (rollups.team_scope("m1"), {"e1", "e2"}),
+            (rollups.employee_scope("e3"), {"e3"}),
+        ]:
+            db.reset_stats()
+            customers = await customer_revenue.top_customers(scope, from_date, to_date, 5)
+            assert db.stats["queries"] == 0
+            assert db.stats["round_trips"] == 2
+            assert _ranked(customers) == _expected(rows, uids, from_date, to_date, 5)
+
+    asyncio.run(scenario())
+
+
+def test_whole_months_and_edges_add_up(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 0.0)
+        rows = await _seed()
+        from_date, to_date = date(2024, 4, 25), date(2024, 6, 3)
+        customers = await customer_revenue.top_customers(rollups.ALL_SCOPE, from_date, to_date, 30)
+        assert _ranked(customers) == _expected(rows, {"e1", "e2", "e3"}, from_date, to_date, 30)
+
+    asyncio.run(scenario())
+
+
+def test_moved_payment_leaves_its_old_day(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 0.0)
+        payment_id = await payments.create_payment("e1", "m1", _payment(date(2024, 5, 10), "919800000001", 500.0))
+        await payments.update_payment(payment_id, _payment(date(2024, 6, 20), "919800000001", 500.0))
+
+        may = await customer_revenue.top_customers(rollups.ALL_SCOPE, date(2024, 5, 5), date(2024, 5, 15), 10)
+        june = await customer_revenue.top_customers(rollups.ALL_SCOPE, date(2024, 6, 15), date(2024, 6, 25), 10)
+        assert may == []
+        assert [(c["mobile"], c["revenue"]) for c in june] == [("919800000001", 500.0)]
+
+    asyncio.run(scenario())
+
+
+def test_sorted_month_buckets_are_reused_until_they_change(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 0.0)
+        customer_revenue._sorted_buckets.clear()
+        scope = rollups.employee_scope("e1")
+        doc_id = customer_revenue.bucket_doc_id(scope, "2024-05", 0)
+        await payments.create_payment("e1", "m1", _payment(date(2024, 5, 10), "919800000001", 500.0))
+
+        await customer_revenue.top_customers(scope, date(2024, 5, 1), date(2024, 5, 31), 10)
+        first = customer_revenue._sorted_buckets.get(doc_id)
+        await customer_revenue.top_customers(scope, date(2024, 5, 1), date(2024, 5, 31), 10)
+        assert customer_revenue._sorted_buckets.get(doc_id) is first
+
+        await payments.create_payment("e1", "m1", _payment(date(2024, 5, 11), "919800000002", 900.0))
+        customers = await customer_revenue.top_customers(scope, date(2024, 5, 1), date(2024, 5, 31), 10)
+        assert customer_revenue._sorted_buckets.get(doc_id) is not first
+        assert [c["mobile"] for c in customers] == ["919800000002", "919800000001"]
+
+    asyncio.run(scenario())
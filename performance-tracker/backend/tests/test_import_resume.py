@@ -0,0 +1,54 @@
+"""Resuming CSV imports whose run died or is still alive."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List
+
+import pytest
+
+from app.fakes import InMemoryFirestore
+from app.jobs import import_csv
+from app.jobs.recalculate_incentives import JOBS_COLLECTION
+from app.services.users import USERS_COLLECTION
+
+
+async def _rows(rows: List[Dict[str, str]]) -> AsyncIterator[Dict[str, str]]:
+    for row in rows:
+        yield row
+
+
+def _calls(count: int) -> List[Dict[str, str]]:
+    row = {"uid": "e1", "answered_calls": "3", "unanswered_calls": "1", "total_call_time_minutes": "10"}
+    return [{**row, "date": f"2024-05-{day:02d}"} for day in range(1, count + 1)]
+
+
+async def _start_crashed_job(db: InMemoryFirestore, lease_expires_at: datetime) -> str:
+    await db.collection(USERS_COLLECTION).document("e1").set({"role": "EMPLOYEE", "manager_uid": "m1"})
+    job_id = await import_csv.start_job("calls")
+    # What a run leaves behind when its process dies: `running`, never reset.
+    await db.collection(JOBS_COLLECTION).document(f"import_{job_id}").update(
+        {"status": "running", "lease_expires_at": lease_expires_at}
+    )
+    return job_id
+
+
+def test_resume_after_lease_expires(db: InMemoryFirestore) -> None:
+    async def scenario() -> dict:
+        job_id = await _start_crashed_job(db, datetime.now(timezone.utc) - timedelta(seconds=1))
+        return await import_csv.run_job(job_id, _rows(_calls(5)))
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "completed"
+    assert (job["written"], job["next_row"]) == (5, 5)
+    assert job["lease_expires_at"] is None
+
+
+def test_resume_refused_while_lease_is_held(db: InMemoryFirestore) -> None:
+    async def scenario() -> None:
+        job_id = await _start_crashed_job(db, datetime.now(timezone.utc) + timedelta(minutes=5))
+        await import_csv.run_job(job_id, _rows(_calls(5)))
+
+    with pytest.raises(import_csv.ImportInProgress):
+        asyncio.run(scenario())
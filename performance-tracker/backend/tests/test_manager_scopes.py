@@ -0,0 +1,93 @@
+"""A manager who reports to another manager reads their own records.
+
+Such a manager's records are attributed to their manager's team, while their
+own team view includes them, so responses over their team must still see
+and be invalidated by their own writes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict
+
+import httpx
+from fastapi import FastAPI
+
+from app.fakes import InMemoryFirestore
+from app.services.users import USERS_COLLECTION
+
+
+MID = {"Authorization": "Bearer mid"}
+PAYMENT = {
+    "date": "2024-05-10",
+    "customer_name": "Acme",
+    "mobile": "919800000001",
+    "customer_type": "new",
+    "service": "RCS",
+    "product_type": "RCS",
+    "amount_paid": 1000,
+    "customer_card_link": "https://crm.example.com/cards/1",
+}
+
+
+async def _seed(db: InMemoryFirestore, set_percents: Any) -> None:
+    await set_percents(10.0, 0.0)
+    users: Dict[str, Dict[str, Any]] = {
+        "boss": {"role": "MANAGER"},
+        "mid": {"role": "MANAGER", "manager_uid": "boss"},
+        "e1": {"role": "EMPLOYEE", "manager_uid": "mid"},
+    }
+    for uid, profile in users.items():
+        await db.collection(USERS_COLLECTION).document(uid).set(profile)
+
+
+def test_own_payment_invalidates_cached_incentives(db: InMemoryFirestore, set_percents: Any, app: FastAPI) -> None:
+    async def scenario() -> None:
+        await _seed(db, set_percents)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            before = await client.get("/incentives/", headers=MID)
+            assert before.json()["incentives"] == []
+
+            created = await client.post("/payments/", json=PAYMENT, headers=MID)
+            assert created.status_code == 200
+
+            after = await client.get("/incentives/", headers={**MID, "If-None-Match": before.headers["etag"]})
+            assert after.status_code == 200
+            assert [incentive["uid"] for incentive in after.json()["incentives"]] == ["mid"]
+
+    asyncio.run(scenario())
+
+
+def test_team_analytics_include_the_managers_own_payments(
+    db: InMemoryFirestore, set_percents: Any, app: FastAPI
+) -> None:
+    async def scenario() -> None:
+        await _seed(db, set_percents)
+        may = {"from": "2024-05-01", "to": "2024-05-31"}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            before = await client.get("/analytics/overview", params=may, headers=MID)
+            assert before.json()["data"]["payment_count"] == 0
+
+            await client.post("/payments/", json=PAYMENT, headers=MID)
+            report = {**PAYMENT, "mobile": "919800000002", "amount_paid": 400}
+            await client.post("/payments/", json=report, headers={"Authorization": "Bearer e1"})
+
+            cached = {**MID, "If-None-Match": before.headers["etag"]}
+            overview = await client.get("/analytics/overview", params=may, headers=cached)
+            assert overview.status_code == 200
+            assert overview.json()["data"]["payment_count"] == 2
+            assert overview.json()["data"]["total_payments"] == 1400
+
+            trends = await client.get("/analytics/trends", params={**may, "granularity": "month"}, headers=MID)
+            assert trends.json()["data"]["total"] == {"count": [2], "amount": [1400.0]}
+
+            top = await client.get("/analytics/top-customers", params=may, headers=MID)
+            assert [(c["mobile"], c["revenue"]) for c in top.json()["customers"]] == [
+                ("919800000001", 1000),
+                ("919800000002", 400),
+            ]
+
+            funnel = await client.get("/analytics/conversion-funnel", params=may, headers=MID)
+            assert funnel.status_code == 200
+
+    asyncio.run(scenario())
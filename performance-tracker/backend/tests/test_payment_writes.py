@@ -0,0 +1,168 @@
+"""Idempotent and optimistically retried payment writes."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Any
+
+import pytest
+
+from app.fakes import InMemoryFirestore
+from app.models import Payment
+from app.services import customer_revenue, demo_index, payments, rollups
+from app.services.incentives import INCENTIVES_COLLECTION
+from app.services.master_data import CONFIG_COLLECTION, MASTER_CONFIG_DOC, invalidate_master_data
+
+
+DAY = date(2024, 5, 10)
+SCOPE = rollups.employee_scope("e1")
+
+
+def _payment(amount: float, service: str = "RCS", card: str = "1") -> Payment:
+    return Payment(
+        date=DAY,
+        customer_name="Acme",
+        mobile="919800000001",
+        customer_type="new",
+        service=service,
+        product_type=service,
+        amount_paid=amount,
+        customer_card_link=f"https://crm.example.com/cards/{card}",
+    )
+
+
+async def _count(db: InMemoryFirestore, collection: str) -> int:
+    return len([snap async for snap in db.collection(collection).stream()])
+
+
+async def _card_payments(db: InMemoryFirestore, card: str) -> dict:
+    key = demo_index.card_key(f"https://crm.example.com/cards/{card}")
+    snap = await db.collection(demo_index.CARD_PAYMENTS_COLLECTION).document(key).get()
+    return (snap.to_dict() or {}).get("payments") or {}
+
+
+def test_replayed_create_writes_once(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 50.0)
+        key = payments.scoped_idempotency_key("e1", "create-1")
+        first = await payments.create_payment("e1", "m1", _payment(1000.0), idempotency_key=key)
+        again = await payments.create_payment("e1", "m1", _payment(1000.0), idempotency_key=key)
+
+        assert again == first
+        assert await _count(db, payments.PAYMENTS_COLLECTION) == 1
+        overview = await rollups.read_overview(SCOPE, DAY, DAY)
+        assert (overview["payment_count"], overview["total_payments"]) == (1, 1000.0)
+        with pytest.raises(payments.PaymentConflict):
+            await payments.create_payment("e1", "m1", _payment(2000.0), idempotency_key=key)
+
+    asyncio.run(scenario())
+
+
+def test_replayed_update_and_delete_apply_once(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 50.0)
+        payment_id = await payments.create_payment("e1", "m1", _payment(1000.0))
+        update_key = payments.scoped_idempotency_key("m1", "update-1")
+        await payments.update_payment(payment_id, _payment(1500.0), idempotency_key=update_key)
+        # Someone else edits the payment; a late retry of the first update must not undo it.
+        await payments.update_payment(payment_id, _payment(1800.0))
+        await payments.update_payment(payment_id, _payment(1500.0), idempotency_key=update_key)
+
+        assert (await payments.get_payment(payment_id))["amount_paid"] == 1800.0
+        overview = await rollups.read_overview(SCOPE, DAY, DAY)
+        assert (overview["payment_count"], overview["total_payments"]) == (1, 1800.0)
+        with pytest.raises(payments.PaymentConflict):
+            await payments.delete_payment(payment_id, idempotency_key=update_key)
+
+        delete_key = payments.scoped_idempotency_key("m1", "delete-1")
+        await payments.delete_payment(payment_id, idempotency_key=delete_key)
+        await payments.delete_payment(payment_id, idempotency_key=delete_key)
+        with pytest.raises(KeyError):
+            await payments.delete_payment(payment_id)
+
+        tombstone = await db.collection(payments.TOMBSTONES_COLLECTION).document(payment_id).get()
+        assert tombstone.exists
+        overview = await rollups.read_overview(SCOPE, DAY, DAY)
+        assert (overview["payment_count"], overview["total_payments"]) == (0, 0.0)
+
+    asyncio.run(scenario())
+
+
+def test_update_retries_after_a_concurrent_edit(db: InMemoryFirestore, set_percents: Any, monkeypatch: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 50.0)
+        payment_id = await payments.create_payment("e1", "m1", _payment(1000.0))
+        get_all = db.get_all
+        reads = []
+
+        async def read_then_edit(references: Any, *args: Any, **kwargs: Any) -> Any:
+            snaps = [snap async for snap in get_all(references, *args, **kwargs)]
+            reads.append(len(reads))
+            if len(reads) == 1:
+                # Another request commits between this read and its commit.
+                await payments.update_payment(payment_id, _payment(3000.0))
+            for snap in snaps:
+                yield snap
+
+        monkeypatch.setattr(db, "get_all", read_then_edit)
+        await payments.update_payment(payment_id, _payment(2000.0))
+        monkeypatch.undo()
+
+        # The first read, the concurrent edit's read and the retried read.
+        assert len(reads) == 3
+        assert (await payments.get_payment(payment_id))["amount_paid"] == 2000.0
+        incentive = (await db.collection(INCENTIVES_COLLECTION).document(payment_id).get()).to_dict()
+        assert incentive["incentive_amount"] == 100.0
+        overview = await rollups.read_overview(SCOPE, DAY, DAY)
+        assert (overview["payment_count"], overview["total_payments"]) == (1, 2000.0)
+        assert overview["total_incentives"] == 100.0
+
+    asyncio.run(scenario())
+
+
+def test_update_gives_up_under_constant_contention(db: InMemoryFirestore, set_percents: Any, monkeypatch: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 50.0)
+        payment_id = await payments.create_payment("e1", "m1", _payment(1000.0))
+        payment_ref = db.collection(payments.PAYMENTS_COLLECTION).document(payment_id)
+        get_all = db.get_all
+
+        async def read_then_touch(references: Any, *args: Any, **kwargs: Any) -> Any:
+            snaps = [snap async for snap in get_all(references, *args, **kwargs)]
+            await payment_ref.update({"notes": "touched"})
+            for snap in snaps:
+                yield snap
+
+        monkeypatch.setattr(db, "get_all", read_then_touch)
+        with pytest.raises(payments.PaymentConflict):
+            await payments.update_payment(payment_id, _payment(2000.0))
+        monkeypatch.undo()
+
+        assert (await payments.get_payment(payment_id))["amount_paid"] == 1000.0
+        overview = await rollups.read_overview(SCOPE, DAY, DAY)
+        assert (overview["payment_count"], overview["total_payments"]) == (1, 1000.0)
+
+    asyncio.run(scenario())
+
+
+def test_edit_moves_aggregates_to_the_new_service_and_card(db: InMemoryFirestore) -> None:
+    async def scenario() -> None:
+        await db.collection(CONFIG_COLLECTION).document(MASTER_CONFIG_DOC).set(
+            {"services": {"RCS": {"base_percent": 10.0}, "SMS": {"base_percent": 5.0}}, "global_percent": 50.0}
+        )
+        invalidate_master_data()
+        payment_id = await payments.create_payment("e1", "m1", _payment(1000.0))
+        await payments.update_payment(payment_id, _payment(1000.0, service="SMS", card="2"))
+
+        for scope in (SCOPE, rollups.team_scope("m1"), rollups.ALL_SCOPE):
+            overview = await rollups.read_overview(scope, DAY, DAY)
+            assert overview["payment_count"] == 1
+            assert overview["total_incentives"] == 25.0
+            assert overview["service_breakdown"] == {"SMS": {"count": 1, "amount": 1000.0}}
+        assert await _card_payments(db, "1") == {}
+        assert list(await _card_payments(db, "2")) == [payment_id]
+        customers = await customer_revenue.top_customers(rollups.ALL_SCOPE, DAY, DAY, 10)
+        assert [(c["mobile"], c["revenue"]) for c in customers] == [("919800000001", 1000.0)]
+
+    asyncio.run(scenario())
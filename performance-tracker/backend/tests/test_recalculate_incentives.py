@@ -0,0 +1,59 @@
+"""Incentive recalculation racing a payment edit."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Any, Dict
+
+from app.fakes import InMemoryFirestore
+from app.jobs import recalculate_incentives
+from app.models import Payment
+from app.services import payments, rollups
+from app.services.incentives import INCENTIVES_COLLECTION
+
+
+DAY = date(2024, 5, 10)
+
+
+def _payment(amount: float) -> Payment:
+    return Payment(
+        date=DAY,
+        customer_name="Acme",
+        mobile="919800000001",
+        customer_type="new",
+        service="RCS",
+        product_type="RCS",
+        amount_paid=amount,
+        customer_card_link="https://crm.example.com/cards/1",
+    )
+
+
+def test_payment_edited_mid_page_is_not_overwritten(db: InMemoryFirestore, set_percents: Any, monkeypatch: Any) -> None:
+    read_current = recalculate_incentives._read_current
+    edits = []
+
+    async def read_then_edit(client: Any, page: Any) -> Any:
+        result = await read_current(client, page)
+        if not edits:
+            # The edit commits after the job read the page but before it writes.
+            edits.append(await payments.update_payment(page[0]["id"], _payment(2000.0)))
+        return result
+
+    monkeypatch.setattr(recalculate_incentives, "_read_current", read_then_edit)
+
+    async def scenario() -> Dict[str, Any]:
+        await set_percents(10.0, 50.0)
+        payment_id = await payments.create_payment("e1", "m1", _payment(1000.0))
+        await set_percents(20.0, 50.0)
+        job = await recalculate_incentives.run_job(await recalculate_incentives.start_job())
+        incentive = (await db.collection(INCENTIVES_COLLECTION).document(payment_id).get()).to_dict()
+        overview = await rollups.read_overview(rollups.employee_scope("e1"), DAY, DAY)
+        return {"job": job, "incentive": incentive, "overview": overview}
+
+    result = asyncio.run(scenario())
+    assert result["job"]["status"] == "completed"
+    # 2000 at 20% of 50%, not the 1000 the page was first read with.
+    assert result["incentive"]["amount_paid"] == 2000.0
+    assert result["incentive"]["incentive_amount"] == 200.0
+    assert result["overview"]["total_incentives"] == 200.0
@@ -0,0 +1,76 @@
+"""Organisation rollups spread over shard documents."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Any
+
+from app.fakes import InMemoryFirestore
+from app.jobs.rebuild_rollups import rebuild_rollups
+from app.models import Payment
+from app.services import payments, rollups
+
+
+DAY = date(2024, 5, 10)
+EMPLOYEES = [(f"e{index}", f"m{index % 2}") for index in range(12)]
+
+
+def _payment(amount: float) -> Payment:
+    return Payment(
+        date=DAY,
+        customer_name="Acme",
+        mobile="919800000001",
+        customer_type="new",
+        service="RCS",
+        product_type="RCS",
+        amount_paid=amount,
+        customer_card_link="https://crm.example.com/cards/1",
+    )
+
+
+async def _rollup_ids(db: InMemoryFirestore) -> set:
+    return {snap.id async for snap in db.collection(rollups.ROLLUPS_COLLECTION).stream()}
+
+
+def test_records_are_counted_in_a_stable_shard() -> None:
+    scope = rollups.stored_scopes_for("e1", "m1")[1]
+    assert scope == rollups.all_shard("e1")
+    assert scope in rollups.stored_scopes(rollups.ALL_SCOPE)
+    assert rollups.ALL_SCOPE not in rollups.stored_scopes_for("e1", "m1")
+    assert rollups.scopes_for("e1", "m1") == ["emp:e1", rollups.ALL_SCOPE, "team:m1"]
+
+
+def test_organisation_overview_merges_every_shard(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 0.0)
+        for index, (uid, team_uid) in enumerate(EMPLOYEES):
+            await payments.create_payment(uid, team_uid, _payment(100.0 * (index + 1)))
+        ids = await _rollup_ids(db)
+        assert rollups.rollup_doc_id(rollups.ALL_SCOPE, DAY.isoformat()) not in ids
+        assert len({rollups.all_shard(uid) for uid, _ in EMPLOYEES}) > 1
+
+        overview = await rollups.read_overview(rollups.ALL_SCOPE, DAY, DAY)
+        assert overview["payment_count"] == len(EMPLOYEES)
+        assert overview["total_payments"] == sum(100.0 * (index + 1) for index in range(len(EMPLOYEES)))
+        teams = [await rollups.read_overview(rollups.team_scope(team), DAY, DAY) for team in ("m0", "m1")]
+        assert overview["total_incentives"] == round(sum(team["total_incentives"] for team in teams), 2)
+
+    asyncio.run(scenario())
+
+
+def test_rebuild_writes_the_same_shards(db: InMemoryFirestore, set_percents: Any) -> None:
+    async def scenario() -> None:
+        await set_percents(10.0, 0.0)
+        for uid, team_uid in EMPLOYEES[:5]:
+            await payments.create_payment(uid, team_uid, _payment(500.0))
+        ids = await _rollup_ids(db)
+        before = await rollups.read_overview(rollups.ALL_SCOPE, DAY, DAY)
+
+        result = await rebuild_rollups(DAY, DAY)
+
+        assert result["rollups_deleted"] == 0
+        assert await _rollup_ids(db) == ids
+        assert await rollups.read_overview(rollups.ALL_SCOPE, DAY, DAY) == before
+
+    asyncio.run(scenario())
@@ -0,0 +1,97 @@
+"""Month-end behaviour of WhatsApp due dates.
+
+The date helpers are pure; `record_payment` and `upsert_customer` run
+against `app.fakes.InMemoryFirestore`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Any, Dict
+
+import pytest
+
+from app.fakes import InMemoryFirestore
+from app.services import whatsapp
+
+
+def _customer(fixed_due_day: int, mobile: str = "919800000001") -> Dict[str, Any]:
+    return {"mobile": mobile, "customer_name": "Acme", "fixed_due_day": fixed_due_day, "service": "API", "amount": 500}
+
+
+@pytest.mark.parametrize(
+    "year, expected",
+    [(2023, date(2023, 2, 28)), (2024, date(2024, 2, 29)), (2100, date(2100, 2, 28)), (2000, date(2000, 2, 29))],
+)
+def test_31st_rolls_back_to_end_of_february(year: int, expected: date) -> None:
+    assert whatsapp.due_date_in_month(year, 2, 31) == expected
+
+
+def test_31st_returns_to_31st_after_february() -> None:
+    due = date(2024, 1, 31)
+    dues = []
+    for _ in range(3):
+        due = whatsapp.next_due_after_payment(due, 31)
+        dues.append(due)
+    assert dues == [date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)]
+
+
+def test_30th_in_short_and_long_months() -> None:
+    assert whatsapp.due_date_in_month(2023, 2, 30) == date(2023, 2, 28)
+    assert whatsapp.due_date_in_month(2023, 4, 30) == date(2023, 4, 30)
+    assert whatsapp.due_date_in_month(2023, 5, 30) == date(2023, 5, 30)
+    assert whatsapp.next_due_after_payment(date(2023, 2, 28), 30) == date(2023, 3, 30)
+
+
+def test_december_rolls_over_to_january() -> None:
+    assert whatsapp.add_months(2024, 12, 1) == (2025, 1)
+    assert whatsapp.next_due_after_payment(date(2024, 12, 31), 31) == date(2025, 1, 31)
+    assert whatsapp.first_due_on_or_after(date(2024, 12, 20), 15) == date(2025, 1, 15)
+
+
+def test_first_due_on_or_after_includes_today() -> None:
+    assert whatsapp.first_due_on_or_after(date(2024, 3, 15), 15) == date(2024, 3, 15)
+    assert whatsapp.first_due_on_or_after(date(2024, 2, 29), 31) == date(2024, 2, 29)
+
+
+def test_record_payment_advances_next_due_date(db: InMemoryFirestore) -> None:
+    async def scenario() -> list:
+        await whatsapp.upsert_customer(_customer(31), today=date(2024, 1, 10))
+        results = []
+        for paid in ("2024-01-31", "2024-02-29", "2024-03-30"):
+            results.append(await whatsapp.record_payment({"mobile": "919800000001", "date_paid": paid, "amount": 500}))
+        snap = await db.collection(whatsapp.CUSTOMERS_COLLECTION).document("919800000001").get()
+        return results + [snap.to_dict()]
+
+    first, second, third, stored = asyncio.run(scenario())
+    assert (first["due_date"], first["next_due_date"]) == ("2024-01-31", "2024-02-29")
+    assert (second["due_date"], second["next_due_date"]) == ("2024-02-29", "2024-03-31")
+    assert (third["due_date"], third["next_due_date"]) == ("2024-03-31", "2024-04-30")
+    assert stored["next_due_date"] == "2024-04-30"
+    assert stored["last_paid_date"] == "2024-03-30"
+
+
+def test_record_payment_for_unknown_customer_raises(db: InMemoryFirestore) -> None:
+    with pytest.raises(KeyError):
+        asyncio.run(whatsapp.record_payment({"mobile": "919800000009", "date_paid": "2024-01-01", "amount": 1}))
+
+
+def test_upsert_customer_moves_due_day_within_the_month(db: InMemoryFirestore) -> None:
+    async def scenario() -> list:
+        created = await whatsapp.upsert_customer(_customer(10), today=date(2024, 2, 12))
+        later = await whatsapp.upsert_customer(_customer(31), today=date(2024, 2, 20))
+        earlier = await whatsapp.upsert_customer(_customer(5), today=date(2024, 2, 25))
+        return [created, later, earlier]
+
+    created, later, earlier = asyncio.run(scenario())
+    # Created after the 10th, so first due next month.
+    assert created["next_due_date"] == "2024-03-10"
+    # Changing the due day keeps the outstanding month and clamps to its end.
+    assert later["next_due_date"] == "2024-03-31"
+    assert earlier["next_due_date"] == "2024-03-05"
+
+
+def test_upsert_customer_clamps_to_february_end(db: InMemoryFirestore) -> None:
+    result = asyncio.run(whatsapp.upsert_customer(_customer(31), today=date(2023, 2, 1)))
+    assert result["next_due_date"] == "2023-02-28"